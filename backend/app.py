@@ -1,15 +1,17 @@
 import os
+import shutil
 from dotenv import load_dotenv
-import zipfile
-import locale
 from datetime import datetime
-from io import BytesIO
-from flask import Flask, send_file, render_template, jsonify, request
+from flask import Flask, Response, send_file, render_template, jsonify, request
 from flask_cors import CORS
 from apscheduler.schedulers.background import BackgroundScheduler
 from main_v7 import ehcpa_process, remote_download_process
-from src.scripts.get_dates_v7 import get_today_date, get_calibration_date, get_ARG_late_last_date, get_data_download_dates
-from tempfile import TemporaryDirectory
+from src.scripts.get_dates_v7 import get_today_date, get_data_download_dates, get_dates_index, get_month_name
+from src.scripts.zip_stream_v7 import stream_zip
+from src.scripts.download_bundles_v7 import get_download_file, get_download_bundle
+from src.scripts.download_clip_v7 import get_download_subset_params, build_download_subsets, OUTPUT_FORMATS
+from src.scripts.timeseries_store_v7 import get_pixel_timeseries
+from src.scripts.point_layers_v7 import get_point_values
 
 ###################################################################################################################################
 
@@ -20,14 +22,15 @@ from tempfile import TemporaryDirectory
 #  3. Configuramos CORS (Cross-Origin Resource Sharing) en la aplicación Flask. Este es un mecanismo de seguridad que los navegadores 
 #     usan para controlar las solicitudes HTTP que se hacen desde un origen (dominio, protocolo y puerto) diferente al origen desde 
 #     el cual se sirvio la página. Sin CORS, los navegadores bloquean automáticamente estas solicitudes de otro origen por razones 
-#     de seguridad.
+#     de seguridad. Ademas, exponemos el encabezado "Content-Disposition" para que el frontend pueda leer el nombre del archivo 
+#     descargado.
 
 dotenv_path = os.path.expanduser(os.path.join('~', 'EHCPA_SPI', 'backend', 'src', 'credentials', '.env'))
 load_dotenv(dotenv_path)
 backend_port = int(os.getenv('BACKEND_PORT'))
 
 app = Flask(__name__)
-cors = CORS(app, origins='*')   # origins=['https://example-front.com']
+cors = CORS(app, origins='*', expose_headers=['Content-Disposition'])   # origins=['https://example-front.com']
 
 ###################################################################################################################################
 
@@ -65,117 +68,86 @@ def home():
 
 ###################################################################################################################################
 
-## Funcion download_file: Sirve para descagar en formato ZIP, tanto de forma individual como grupal, los archivos de PTM y SPI.
+## Funcion download_file: Sirve para descagar los archivos de PTM y SPI, de forma individual como GeoTiff, o de forma grupal en 
+#  formato ZIP.
 #  1. El path o ruta de verificaion es "/download/<id_data>" donde "id_data" es el identificador del o los archivos que se desean
 #     descargar.
 #  2. El endpoint solo responde a solicitudes "GET", que generalmente se utilizan para recuperar datos o archivos.
-#
-#  - downloable_data_dir: Carpeta donde se encuentran los archivos de PTM y SPI generados para la descarga.
-#  - PTM_dir: Carpeta donde se encuentra el archivo de PTM de todas las bandas.
-#  - SPI_dir: Carpeta donde se encuentran los archivos de SPI de todas las bandas.
-#
-#  3. Listamos las escalas de los archivos SPI, para validar si la escala solicitada es correcta.
-#  4. Llamamos a la función "get_calibration_date()"" para obtener el mes y año de calibracion.
-#  5. Definimos una variable "ids" la cual divide el contenido de "id_data" en una lista usando la coma como separador, obteniendo 
+#     - Opcionalmente, la solicitud puede indicar los parametros de recorte "bbox" ("lon_min,lat_min,lon_max,lat_max"), "polygon"
+#       (nombre de un shapefile de "src/ShapeFiles"), "start" y "end" (meses "YYYY-MM") y "format" ("tif", "nc" o "csv"), que se 
+#       validan mediante "get_download_subset_params()". Si algun parametro no es correcto, se responde con el mensaje de error en 
+#       formato JSON y el codigo 400.
+#  3. Llamamos a la función "get_data_download_dates()" para obtener el mes y año de los datos descargables, y obtenemos del indice
+#     de fechas ("get_dates_index()") la version de los datos, con la que se identifican los ZIP de la cache de descargas. Ambos se
+#     leen del indice que actualiza el proceso, sin recorrer la carpeta "IMERG_late_month" en cada solicitud.
+#  4. Definimos una variable "ids" la cual divide el contenido de "id_data" en una lista usando la coma como separador, obteniendo 
 #     una lista de identificadores. Luego definimos "files_to_zip", que es una lista vacía para almacenar las rutas de los archivos 
 #     encontrados. Y "not_found_files" es una lista vacía para almacenar los identificadores de archivos que no se encuentran 
 #     disponibles.
-#  6. En el ciclo for se procesa cada uno de los identificadores almacenados en "ids", y se verifica:
-#     - Si el identificador es "PTM", construye la ruta del archivo PTM correspondiente usando las fechas de "calibration_end_month" 
-#       y "calibration_end_year" obtenidas.
-#     - Si el identificador comienza con "SPI_", se extrae la escala al dividir el identificador por el carácter "_" y se toma la 
-#       segunda parte. De esta manera comprobamos que la escala extraida esta en la lista de escalas definidas previamente, por lo 
-#       que:
-#       - Si la escala es valida, es decir, el numero extraido coincide con alguno de los definidos en la lista "spi_scales", se 
-#         construye la ruta del archivo correspondiente a SPI.
-#       - Si la escala es inválida, se responde con un mensaje de error en formato JSON y el código de estado 400 indicando que la
-#         escala solicitada es incorrecta.
-#     - Si el identificador no es ni "PTM" ni comienza con "SPI_", se responde con un error indicando que el identificador no es 
-#       válido.
-#  7. Para cada ruta construida de cada identificador, se verifica si dicha ruta existe, por lo que:
-#     - Si existe, se la argrega la ruta a la lista "files_to_zip".
+#  5. En el ciclo for se obtiene, para cada uno de los identificadores almacenados en "ids", la ruta de su archivo mediante 
+#     "get_download_file()" ("PTM", "SPI_<escala>", "PMP_<escala>" o "PMD_<escala>"). Si la escala o el identificador no son 
+#     correctos, se responde con el mensaje de error en formato JSON y el código de estado 400.
+#  6. Para cada ruta construida de cada identificador, se verifica si dicha ruta existe, por lo que:
+#     - Si existe, se la argrega la ruta a la lista "files_to_zip" (si el identificador se repite, se agrega una sola vez).
 #     - Caso contrario, se agraga directamente el identificador a la lista de "not_found_files".
-#  8. Para el caso de archivos no encontrados, en caso de que la lista "not_found_files" tenga contenido se verifica que:
+#  7. Para el caso de archivos no encontrados, en caso de que la lista "not_found_files" tenga contenido se verifica que:
 #     - Si "not_found_files" posee solo un elemento, es decir, un identificador, se retorna un mensaje de error en formato JSON
 #       y el codigo 404, para indicar que el archivo correspondiente a ese identificador no se encuentra disponible para su 
 #       descarga en este momento.
 #     - Si "not_found_files" posee mas de un elemento, es decir, varios identificador, se retorna un mensaje de error en formato 
 #       JSON y el codigo 404, para indicar que dichos archivos correspondientes a los identificadores almacenados no se encuentran
 #       disponibles para su descarga en este momento.
-#  9. Creamos un objeto de tipo "BytesIO", que es un archivo en memoria (similar a un archivo temporal) que permite escribir y 
-#     almacenar datos binarios sin necesidad de crear un archivo físico en el sistema. "BytesIO" servirá como el contenedor del 
-#     archivo ZIP que se va a crear, permitiendo empaquetar los archivos especificados sin necesidad de guardarlos en el disco.
-#     "zip_buffer" es el objeto de memoria (BytesIO) donde se almacenará el contenido del archivo ZIP, permitiendo que todo el 
-#     archivo se mantenga en memoria en lugar de guardarse en el disco. Con el argumento "w" indicamos que el archivo ZIP está 
-#     en modo de escritura, permitiendo añadir archivos al ZIP, y sobrescribiéndolo si ya tiene contenido. Y por ultimo se asigna 
-#     el archivo ZIP abierto al identificador "zip_file", que se usa para añadir archivos al ZIP durante el resto del bloque.
-#  10. En el ciclo for recorremos la lista de "files_to_zip" que contiene las rutas de los archivos que queremos incluir en el ZIP.
-#      Y se agrega cada archivo al ZIP, pero hacemos que el archivo se guarde en el ZIP con solo su nombre (sin la ruta completa). 
-#  11. Al escribir en "zip_buffer", el puntero en memoria se mueve al final del archivo, y esto ocurre cuando se añaden datos, ya 
-#      que se van escribiendo en secuencia hasta completar el archivo. Es por eso que se utiliza "seek(0)", para indicar que la 
-#      lectura del archivo en memoria "zip_buffer" comience desde el inicio del mismo y no desde el final, que es donde el puntero
-#      queda despues de escribir.
-#  12. Finalmente retornamos el archivo ZIP almacenado en memoria como parte de la respuesta HTTP, indicando mediante "as_attachment=True" 
-#      que el archivo debe enviarse como un archivo adjunto, y esto significa que el navegador descargará el archivo en lugar de 
-#      intentar abrirlo o visualizarlo. Ademas, especificamos el nombre del archivo que se vera al descargarlo. Y mediante  
-#      "mimetype='application/zip'" le indicamos al navegador que el contenido es un archivo ZIP, lo que ayuda al mismo a manejar la 
-#      descarga correctamente.
-#  13. Respecto al funcionamiento del try y el finally, se guarda la configuración actual del idioma que es Español, luego dentro del 
-#      bloque try se configura temporalmente el idioma a 'C' (neutral) para evitar conflictos, y luego en el finally se restaura el idioma 
-#      original para no afectar a la funcion get_dates.
+#  8. Si la solicitud tiene parametros de recorte, generamos el recorte de cada archivo mediante "build_download_subsets()", que lee 
+#     del GeoTiff solo la ventana y las bandas solicitadas, de a una banda por vez, por lo que el tiempo, la memoria y el tamaño de 
+#     la descarga dependen del recorte y no del archivo completo. Si el area o el periodo no tienen datos, se responde con el mensaje 
+#     de error en formato JSON y el codigo 400. Si se solicita un solo archivo se envia directamente mediante "send_file()", y caso 
+#     contrario en un ZIP generado por bloques mediante "stream_zip()". Los recortes no se guardan en la cache de descargas, sino en
+#     una carpeta temporal de la solicitud, que se elimina apenas se abren sus archivos (el sistema operativo mantiene los archivos
+#     abiertos hasta terminar de enviarlos), por lo que no quedan recortes en el disco aunque la descarga se interrumpa.
+#  9. Sin recorte, si se solicita un solo archivo, se envia directamente el GeoTiff mediante "send_file()", sin empaquetarlo en un 
+#     ZIP, como archivo adjunto con su nombre original. Al enviar un archivo del disco, el servidor WSGI puede usar "sendfile" del 
+#     sistema operativo, por lo que el archivo no pasa por la memoria de Python. La respuesta es condicional ("conditional=True"), 
+#     con el ETag y la fecha de modificacion ("Last-Modified") del archivo, por lo que:
+#     - Si el navegador ya tiene el archivo (encabezados "If-None-Match" o "If-Modified-Since"), se responde con el codigo 304.
+#     - Si el navegador solicita solo una parte del archivo (encabezado "Range"), por ejemplo para retomar una descarga interrumpida,
+#       se responde con el codigo 206 y solo dicha parte.
+#  10. Caso contrario, obtenemos el ZIP desde la cache de descargas mediante "get_download_bundle()", que lo genera solo si no existe 
+#      para la misma combinacion de identificadores y version de los datos, o si sus archivos cambiaron. El ZIP se envia mediante 
+#      "send_file()" como archivo adjunto con el nombre "EHCPA_Data.zip", y de forma condicional ("conditional=True") con su ETag, 
+#      por lo que:
+#      - Si el navegador ya tiene el ZIP (encabezado "If-None-Match" con el mismo ETag), se responde con el codigo 304 sin enviarlo.
+#      - Si el navegador solicita solo una parte del ZIP (encabezado "Range"), por ejemplo para retomar una descarga interrumpida, 
+#        se responde con el codigo 206 y solo dicha parte.
+#  11. Si la cache de descargas esta desactivada, generamos el archivo ZIP por bloques mediante "stream_zip()", que agrega cada 
+#      archivo con solo su nombre (sin la ruta completa) y sin comprimir ("ZIP_STORED"), ya que los GeoTiff ya se encuentran 
+#      comprimidos. De esta manera el ZIP no se arma completo en memoria ni en disco, sino que se envia a medida que se genera como 
+#      una respuesta HTTP por partes (transferencia "chunked"), indicando mediante el encabezado "Content-Disposition" que el 
+#      archivo debe descargarse como adjunto con el nombre "EHCPA_Data.zip".
 
 @app.route('/download/<id_data>', methods=['GET'])
 def download_file(id_data):
 
-    locale.setlocale(locale.LC_TIME, 'es_ES.UTF-8')
-
-    downloable_data_dir = os.path.expanduser(os.path.join('~', 'EHCPA_SPI', 'backend', 'src', 'output', 'downloable_data'))
-    PTM_dir = os.path.join(downloable_data_dir, 'PTM')
-    SPI_dir = os.path.join(downloable_data_dir, 'SPI')
-    PMD_dir = os.path.join(downloable_data_dir, 'PMD')
-
-    spi_scales = ['1', '2', '3', '6', '9', '12', '24', '36', '48', '60', '72']
-
-    pmp_scales = ['24h', '1']
-
-    pmd_scales = ['2', '5', '10', '25', '50', '100']
+    try:
+        subset_params = get_download_subset_params(request.args)
+    except ValueError as e:
+        return jsonify(message=str(e)), 400
 
     download_end_month, download_end_year = get_data_download_dates()
+    data_version = get_dates_index()['data_version']
 
     ids = id_data.split(',')
     files_to_zip = []
     not_found_files = []
 
     for data_id in ids:
-        if data_id == "PTM":
-            file_path = os.path.join(PTM_dir, f'PTM_jun_2000_{download_end_month.rstrip(".")}_{download_end_year}_all_bands_ARG_cropped.tif')
-            print(file_path)
-        elif data_id.startswith("PMP_"):
-            scale = data_id.split("_")[1]
-            if scale in pmp_scales:
-                file_path = os.path.join(PMD_dir, f'PMP_{scale}_ARG_cropped.tif')
-                print(file_path)
-            else:
-                return jsonify(message=f'La escala {scale} no es correcta.'), 400
-        elif data_id.startswith("PMD_"):
-            scale = data_id.split("_")[1]
-            if scale in pmd_scales:
-                file_path = os.path.join(PMD_dir, f'PMD_{scale}_ARG_cropped.tif')
-                print(file_path)
-            else:
-                return jsonify(message=f'La escala {scale} no es correcta.'), 400
-        elif data_id.startswith("SPI_"):
-            scale = data_id.split("_")[1]
-            if scale in spi_scales:
-                file_path = os.path.join(SPI_dir, f'SPI_jun_2000_{download_end_month.rstrip(".")}_{download_end_year}_scale_{scale}_all_bands_ARG_cropped.tif')
-                print(file_path)
-            else:
-                return jsonify(message=f'La escala {scale} no es correcta.'), 400
-        else:
-            return jsonify(message=f'El identificador {data_id} no es correcto.'), 400
+        try:
+            file_path = get_download_file(data_id, download_end_month, download_end_year)
+        except ValueError as e:
+            return jsonify(message=str(e)), 400
 
         if os.path.exists(file_path):
-            files_to_zip.append(file_path)
+            if file_path not in files_to_zip:
+                files_to_zip.append(file_path)
         else:
             not_found_files.append(data_id)
 
@@ -185,20 +157,47 @@ def download_file(id_data):
         else:
             return jsonify(message=f'Los siguientes archivos no están disponibles para su descarga en este momento: {", ".join(not_found_files)}'), 404
 
-    # Crear un directorio temporal para aislamiento
-    with TemporaryDirectory() as temp_dir:
-        zip_path = os.path.join(temp_dir, 'EHCPA_Data.zip')
-
-        # Crear el archivo ZIP dentro del directorio temporal
-        with zipfile.ZipFile(zip_path, 'w') as zip_file:
-            for file_path in files_to_zip:
-                zip_file.write(file_path, os.path.basename(file_path))
-
-        # Leer el ZIP y enviarlo como respuesta
-        with open(zip_path, 'rb') as zip_file:
-            zip_data = zip_file.read()
-
-    return send_file(BytesIO(zip_data), as_attachment=True, download_name='EHCPA_Data.zip', mimetype='application/zip')
+    if subset_params is not None:
+        try:
+            subsets_dir, subset_files = build_download_subsets(files_to_zip, subset_params)
+        except ValueError as e:
+            return jsonify(message=str(e)), 400
+
+        try:
+            if len(subset_files) == 1:
+                response = send_file(
+                    open(subset_files[0], 'rb'), mimetype=OUTPUT_FORMATS[subset_params['format']][1], as_attachment=True,
+                    download_name=os.path.basename(subset_files[0]), max_age=0
+                )
+            else:
+                response = Response(
+                    stream_zip(subset_files), mimetype='application/zip', direct_passthrough=True,
+                    headers={'Content-Disposition': 'attachment; filename=EHCPA_Data.zip'}
+                )
+        finally:
+            shutil.rmtree(subsets_dir, ignore_errors=True)
+
+        return response
+
+    if len(files_to_zip) == 1:
+        return send_file(
+            files_to_zip[0], mimetype='image/tiff', as_attachment=True, download_name=os.path.basename(files_to_zip[0]),
+            conditional=True, max_age=0
+        )
+
+    bundle = get_download_bundle(ids, files_to_zip, data_version)
+
+    if bundle is not None:
+        bundle_file, etag = bundle
+        return send_file(
+            bundle_file, mimetype='application/zip', as_attachment=True, download_name='EHCPA_Data.zip',
+            conditional=True, etag=etag, max_age=0
+        )
+
+    return Response(
+        stream_zip(files_to_zip), mimetype='application/zip', direct_passthrough=True,
+        headers={'Content-Disposition': 'attachment; filename=EHCPA_Data.zip'}
+    )
 
 ###################################################################################################################################
 
@@ -207,11 +206,12 @@ def download_file(id_data):
 #  calibracion. El objetivo es visualizar dichas fechas en el modal informativo del mapa del sitio web. 
 #  1. El path o ruta de verificaion es "/get_dates".
 #  2. El endpoint solo responde a solicitudes "GET", que generalmente se utilizan para recuperar datos o archivos.
-#  3. Configuramos el idioma de las fechas para que se muestren en español mediante el modulo de "locale".
 #  3. Obtenemos la fecha actual, y posteriormente, convertimos la misma, que esta en un formato de cadena ('%Y-%m-%d'), nuevamente a 
 #     un objeto "datetime" para facilitar el acceso a los componentes de dicha fecha. Despues, extraemos el dia, el nombre del mes 
-#     en español y con la primera letra en mayuscula, y por ultimo el año. 
-#  4. Obtenemos la fecha del utlimo archivo almacenado en el directorio "ARG_late". Y comprobamos lo siguiente:
+#     en español y con la primera letra en mayuscula (mediante "get_month_name()", sin depender ni modificar el idioma del sistema 
+#     con "locale", que es global al proceso y no es seguro entre solicitudes simultaneas), y por ultimo el año. 
+#  4. Obtenemos del indice de fechas ("get_dates_index()") la fecha del utlimo archivo almacenado en el directorio "ARG_late", sin 
+#     recorrer dicho directorio en cada solicitud. Y comprobamos lo siguiente:
 #     - Si la fecha esta disponible, convertimos dicha fecha, que esta en un formato de cadena ('%d/%m/%Y'), nuevamente a un objeto 
 #       "datetime" para facilitar el acceso a sus componentes. Despues, extraemos el dia, el nombre del mes en español y con la primera 
 #       letra en mayuscula, y por ultimo el año.
@@ -224,19 +224,18 @@ def download_file(id_data):
 def get_dates():
 
     today_date = get_today_date()
-    locale.setlocale(locale.LC_TIME, 'es_ES.UTF-8')
     date = datetime.strptime(today_date, '%Y-%m-%d')
 
     today_day = date.day
-    today_month = date.strftime('%B').capitalize()
+    today_month = get_month_name(date.month).capitalize()
     today_year = date.year
 
-    ARG_late_last_date = get_ARG_late_last_date()
+    ARG_late_last_date = get_dates_index()['ARG_late_last_date']
 
     if ARG_late_last_date != 'No disponible':
         date = datetime.strptime(ARG_late_last_date, '%d/%m/%Y')
         last_band_day = date.day
-        last_band_month = date.strftime('%B').capitalize()
+        last_band_month = get_month_name(date.month).capitalize()
         last_band_year = date.year
     else:
         last_band_day = last_band_month = last_band_year = 'No Disponible'
@@ -257,6 +256,78 @@ def get_dates():
     return jsonify(response)
 
 
+###################################################################################################################################
+
+## Funcion timeseries: Sirve para obtener, en una sola solicitud, la serie temporal completa (desde junio de 2000) de un pixel para 
+#  el PTM y el SPI de las escalas indicadas, con el objetivo de graficarla en el mapa del sitio web.
+#  1. El path o ruta de verificaion es "/timeseries", con los parametros "lat" y "lon" (coordenada del pixel) y "products" (opcional, 
+#     identificadores separados por coma, por ejemplo "PTM,SPI_3,SPI_12"; si no se indica, se retornan todos los productos).
+#  2. El endpoint solo responde a solicitudes "GET", que generalmente se utilizan para recuperar datos o archivos.
+#  3. Si "lat" o "lon" no se indican o no son numeros, se responde con un mensaje de error en formato JSON y el codigo 400.
+#  4. Obtenemos la serie del pixel mas cercano mediante "get_pixel_timeseries()", que la lee del almacen de series temporales 
+#     generado por el proceso diario, abierto en memoria ("memmap") una unica vez por cada version del almacen, por lo que cada 
+#     solicitud solo lee del disco los valores del pixel solicitado. Y comprobamos lo siguiente:
+#     - Si la coordenada esta fuera de Argentina o algun producto no es correcto, se responde con el mensaje de error en formato 
+#       JSON y el codigo 400.
+#     - Si el almacen todavia no fue generado, se responde con un mensaje de error en formato JSON y el codigo 404.
+#  5. Finalmente retornamos un objeto JSON con la coordenada del centro del pixel, las fechas ("YYYY-MM") y la serie de cada 
+#     producto, con "null" en los meses sin datos.
+
+@app.route('/timeseries', methods=['GET'])
+def timeseries():
+
+    try:
+        lat = float(request.args['lat'])
+        lon = float(request.args['lon'])
+    except (KeyError, ValueError):
+        return jsonify(message='Los parametros "lat" y "lon" son obligatorios y deben ser numericos.'), 400
+
+    products = [product for product in request.args.get('products', '').split(',') if product]
+
+    try:
+        response = get_pixel_timeseries(lat, lon, products)
+    except ValueError as e:
+        return jsonify(message=str(e)), 400
+    except FileNotFoundError:
+        return jsonify(message='Las series temporales no se encuentran disponibles en este momento.'), 404
+
+    return jsonify(response)
+
+
+###################################################################################################################################
+
+## Funcion point: Sirve para obtener, en una sola solicitud, el valor de la ultima banda del PTM y del SPI de todas las escalas en 
+#  una coordenada, para mostrarlo al hacer clic en el mapa del sitio web sin realizar una consulta "GetFeatureInfo" a GeoServer por
+#  cada capa.
+#  1. El path o ruta de verificaion es "/point", con los parametros "lat" y "lon" (coordenada consultada).
+#  2. El endpoint solo responde a solicitudes "GET", que generalmente se utilizan para recuperar datos o archivos.
+#  3. Si "lat" o "lon" no se indican o no son numeros, se responde con un mensaje de error en formato JSON y el codigo 400.
+#  4. Obtenemos los valores mediante "get_point_values()", que lee las capas de "output/geoserver/PTM" y "output/geoserver/SPI" una
+#     unica vez y las mantiene en memoria, volviendo a leer solo los archivos que el proceso diario actualiza. Y comprobamos lo 
+#     siguiente:
+#     - Si la coordenada esta fuera del area de las capas, se responde con el mensaje de error en formato JSON y el codigo 400.
+#     - Si las capas todavia no fueron generadas, se responde con un mensaje de error en formato JSON y el codigo 404.
+#  5. Finalmente retornamos un objeto JSON con la coordenada consultada y el valor de cada capa ("PTM", "SPI_1", ..., "SPI_72"), con 
+#     "null" en los pixeles sin datos.
+
+@app.route('/point', methods=['GET'])
+def point():
+
+    try:
+        lat = float(request.args['lat'])
+        lon = float(request.args['lon'])
+    except (KeyError, ValueError):
+        return jsonify(message='Los parametros "lat" y "lon" son obligatorios y deben ser numericos.'), 400
+
+    try:
+        response = get_point_values(lat, lon)
+    except ValueError as e:
+        return jsonify(message=str(e)), 400
+    except FileNotFoundError:
+        return jsonify(message='Las capas no se encuentran disponibles en este momento.'), 404
+
+    return jsonify(response)
+
 
 
 
@@ -1,20 +1,25 @@
 import time
 import schedule
+import os
 import json
 from datetime import datetime
 from dateutil.relativedelta import relativedelta
-from src.scripts.sleep_for_a_bit_v7 import sleep_for_a_bit
+from src.scripts.wait_until_v7 import wait_for_path
+from src.scripts.stage_graph_v7 import run_stage_graph, format_stage_timings
 from src.scripts.check_internet_connection_v7 import check_internet_connection
 from src.scripts.automatic_s3_downloader_v7 import automatic_s3_downloader
 from src.scripts.download_subset_v7 import download_subset
-from src.scripts.get_dates_v7 import get_today_date, get_download_date, get_ARG_late_last_date, get_ARG_late_reset_date
+from src.scripts.get_dates_v7 import get_today_date, get_download_date, get_ARG_late_last_date, get_ARG_late_reset_date, get_calibration_date, update_dates_index
 from src.scripts.P_acu_mensual_v7 import p_acu_mensual
 from src.scripts.automatic_s3_uploader_v7 import automatic_s3_uploader
 from src.scripts.concat_reord_v7 import concat_reord
 from src.scripts.ptm_conversion_crop_v7 import ptm_convertion_and_crop
-from src.scripts.spi_process_v7 import spi_process
+from src.scripts.spi_process_v7 import spi_process, get_spi_calibration_end_year
 from src.scripts.spi_conversion_crop_v7 import spi_convertion_and_crop
+from src.scripts.raster_blocks_v7 import get_output_profile
 from src.scripts.geoserver_upload_v7 import geoserver_upload
+from src.scripts.download_bundles_v7 import prebuild_download_bundles
+from src.scripts.timeseries_store_v7 import build_timeseries_store
 from src.scripts.send_email_v7 import send_email_with_internet
 from src.scripts.recieve_email_v7 import recieve_email
 
@@ -27,8 +32,8 @@ from src.scripts.recieve_email_v7 import recieve_email
 #  2. El proceso unicamente se ejecutara si hay conectividad a Internet, por lo tanto se realiza dicha verificacion mediante 
 #     "check_internet_connection()". Si hay conectividad continua el proceso, caso contrario el proceso se no se ejecutara indicando 
 #     que hay conectividad.
-#  3. En caso de haber conexion, durante el proceso se ejecutan, entre funcion y funcion, las funciones "sleep_for_a_bit()" para 
-#     pausar el proceso durante unos segundos y asi evitar sobrecargas.
+#  3. En caso de haber conexion, durante el proceso se verifica, entre funcion y funcion, que el resultado de la funcion anterior 
+#     este disponible mediante "wait_for_path()", en lugar de pausar el proceso un tiempo fijo.
 #  4. Se ejecuta "automatic_s3_downloader()" para verificar que en el directorio del proyecto este la carpeta "IMERG_late_month" con 
 #     todos los archivos de los acumulados mensuales. En caso de no existir la carpeta, esta se creara y se descargaran todos los 
 #     archivos desde el servicio de backup S3 de AWS. Si la carpeta existe paro la cantidad de archivos locales son menores a la 
@@ -40,7 +45,8 @@ from src.scripts.recieve_email_v7 import recieve_email
 #     fecha de formateo. De dicha funcion se extrae la flag "error_found" y el valor del mensaje de error en "error_message". Y se 
 #     verifica que si la flag "error_found" es "True", se envia un email avisando que el proceso finalizo con errores, enviando 
 #     "error_message", y el proceso se detiene. En caso de que ocurra un error y no haya conectividad, el mensaje se indica y se 
-#     informa que el mail no podra enviarse.
+#     informa que el mail no podra enviarse. Antes de dicha verificacion se actualiza el indice de fechas mediante 
+#     "update_dates_index()", ya que la descarga pudo agregar archivos o formatear el directorio "ARG_late".
 #  8. Se ejecuta nuevamente "get_ARG_late_last_date()" para obtener la fecha del nuevo archivo IMERG de precipitacion diaria descargado, 
 #     para que pueda ser notificado via email, al finalizar el proceso.
 #  9. Se ejecuta "p_acu_mensual()" para generar el archivo de precipitacion mensual acumulada del correspondiente mes de los archivos 
@@ -57,9 +63,19 @@ from src.scripts.recieve_email_v7 import recieve_email
 #      Argentina, tanto de todas las bandas como el de la ultima banda.
 #  15. Se ejecuta "geoserver_upload()" para enviar los archivos que poseen la ultima banda, tanto de PTM como de SPI de todas las 
 #      escalas, al servidor Geoserver para su visualizacion.
+#  16. Se ejecuta "prebuild_download_bundles()" para actualizar la cache de ZIP de descarga con los nuevos archivos de todas las 
+#      bandas, tanto de PTM como de SPI.
+#  17. Se ejecuta "build_timeseries_store()" para generar el almacen de series temporales por pixel, del PTM y del SPI de todas las 
+#      escalas, que consulta el endpoint "/timeseries" del backend.
+#  Las etapas 9 a 17 se declaran en "get_ehcpa_stages()" con sus dependencias, entradas y salidas, y se ejecutan mediante 
+#  "run_stage_graph()", de forma que la rama del PTM (etapa 12) y la rama del SPI (etapas 13 y 14), que solo dependen de 
+#  "concat_reord()", se ejecutan en paralelo. Ademas, en "input/stage_state.json" se registra la firma de las entradas y salidas de 
+#  cada etapa, y las etapas cuyas entradas no cambiaron desde su ultima ejecucion se omiten, por ejemplo, cuando no se descargaron 
+#  archivos IMERG nuevos, y asi tampoco se vuelven a publicar en GeoServer capas identicas. Al finalizar las etapas se vuelve a 
+#  actualizar el indice de fechas, ya que "p_acu_mensual()" pudo generar el acumulado de un nuevo mes.
 #  
 #  - Al terminar el proceso se obtienen varios resultados:
-#    - Si el proceso finalizó con éxito y sin errores, se envia un mensaje por correo. Y en caso de que no haya conexion u ocurrio un 
+#    - Si el proceso finalizó con éxito y sin errores, se envia un mensaje por correo, que incluye el tiempo de cada etapa. Y en caso de que no haya conexion u ocurrio un 
 #      error al enviar el email, se indica que todo termino bien pero que no se puede enviar el correo.
 #    - Si ocurre cualquier error no conocido durante el proceso, el mismo se detiene y se envia un mensaje por correo indicando dicho 
 #      error. Y en caso de que no haya conexion u ocurra un error al enviar el email, se indica que el proceso termino mal, pero que no 
@@ -76,15 +92,14 @@ def ehcpa_process():
 
     if check_internet_connection():
         try:
-            sleep_for_a_bit(15)
             #automatic_s3_downloader()
-            sleep_for_a_bit(45)
             today_date = get_today_date()
             print(f"Fecha actual: {today_date}")
 
             begTime, endTime = get_download_date()
             reset_ARG_late = True
             error_found, error_message = download_subset(begTime, endTime, reset_ARG_late)
+            update_dates_index()
 
             if error_found:
                 subject = "EHCPA - Error en el proceso"
@@ -107,21 +122,9 @@ def ehcpa_process():
 
             ARG_late_last_date = get_ARG_late_last_date()
 
-            sleep_for_a_bit(60)
-            p_acu_mensual()
-            sleep_for_a_bit(60)
-            #automatic_s3_uploader()
-            sleep_for_a_bit(60)
-            concat_reord()
-            sleep_for_a_bit(60)
-            ptm_convertion_and_crop()
-            sleep_for_a_bit(60)
-            spi_process()
-            sleep_for_a_bit(60)
-            spi_convertion_and_crop()
-            sleep_for_a_bit(60)
-            geoserver_upload()
-            sleep_for_a_bit(60)
+            stage_state_file = os.path.expanduser(os.path.join('~', 'EHCPA_SPI', 'backend', 'src', 'input', 'stage_state.json'))
+            stage_timings = run_stage_graph(get_ehcpa_stages(), state_file=stage_state_file)
+            update_dates_index()
             
             
             subject = "EHCPA - Proceso exitoso"
@@ -132,6 +135,8 @@ def ehcpa_process():
                 f" {ARG_late_last_date}\n"
                 f"- Fecha de formateo de carpeta ARG_Late: \n"
                 f" {ARG_late_reset_date}\n"
+                f"- Tiempos por etapa: \n"
+                f"{format_stage_timings(stage_timings)}"
             )
             email_sent = send_email_with_internet(subject, body) 
             if email_sent:
@@ -170,6 +175,130 @@ def ehcpa_process():
 
 ###################################################################################################################################
 
+## Funcion get_ehcpa_stages(): Sirve para declarar las etapas de procesamiento de "ehcpa_process()", a partir de los archivos IMERG 
+#  diarios descargados. Cada etapa indica la funcion que la ejecuta, las etapas de las que depende, y los archivos o carpetas que 
+#  lee (inputs) y genera (outputs).
+#  - "ptm_convertion_and_crop" y "spi_process" dependen unicamente de "concat_reord", por lo que se ejecutan en paralelo.
+#  - "geoserver_upload" depende de las dos ramas, ya que publica las ultimas bandas del PTM y del SPI. Se ejecuta siempre 
+#    ("always_run"), para volver a publicar las capas si GeoServer se reinicio o perdio su configuracion. Cuando las capas no 
+#    cambiaron, la sincronizacion solo consulta el estado de cada capa, sin volver a subir los archivos.
+#  - Cada etapa declara como salidas todos los archivos y carpetas que genera o modifica, de forma que si alguno se elimina o se 
+#    modifica por fuera del proceso, la etapa se vuelve a ejecutar aunque no haya datos nuevos. Por ejemplo, las etapas de 
+#    conversion declaran las carpetas de los archivos de todas las bandas para la descarga y las de la ultima banda para GeoServer.
+#    La mascara de corte de Argentina la declaran todas las etapas que la utilizan (ya que la generan si no existe), y 
+#    "spi_state.json" lo declaran "spi_process" (dentro de "SPI_params") y "spi_convertion_and_crop" (que vacia sus cambios 
+#    pendientes). Las salidas de "spi_process" corresponden al motor "native", que es el utilizado por defecto, y la publicacion en 
+#    GeoServer solo genera archivos (los granulos de los mosaicos) en el modo "mosaic".
+#  - Las etapas cuyo resultado depende ademas de la fecha actual declaran dicho valor en "params": el mes y año de calibracion, que 
+#    forman parte del nombre de los archivos de todas las bandas, y el año de calibracion del SPI. Las etapas de conversion declaran
+#    ademas el perfil de salida de los GeoTiff, para que se regeneren si el mismo cambia en el archivo ".env", y la publicacion en 
+#    GeoServer declara su modo ("layers" o "mosaic"), y los archivos de todas las bandas, de los que se extraen los granulos de los 
+#    mosaicos.
+#  - "prebuild_download_bundles" depende tambien de las dos ramas, ya que cuando cambian los archivos de todas las bandas, elimina de
+#    la cache de descargas los ZIP desactualizados y vuelve a generar los mas solicitados.
+#  - "build_timeseries_store" depende de "concat_reord" y "spi_process", ya que lee los cubos del PTM y del SPI de todas las escalas
+#    para generar el almacen de series temporales por pixel del endpoint "/timeseries".
+
+def get_ehcpa_stages():
+    src_dir = os.path.expanduser(os.path.join('~', 'EHCPA_SPI', 'backend', 'src'))
+    ARG_late_dir = os.path.join(src_dir, 'ARG_late')
+    IMERG_late_month_dir = os.path.join(src_dir, 'IMERG_late_month')
+    IMERG_late_month_manifest_dir = os.path.join(src_dir, 'IMERG_late_month_manifest')
+    concat_reord_dir = os.path.join(src_dir, 'input', 'concat_reord')
+    reord_file = os.path.join(concat_reord_dir, 'IMERG_reord_lat_fix.nc4')
+    PTM_dir = os.path.join(src_dir, 'input', 'PTM')
+    PTM_nc4_file = os.path.join(PTM_dir, 'PTM.nc4')
+    SPI_gamma_reord_dir = os.path.join(src_dir, 'input', 'SPI', 'SPI_gamma_reord')
+    SPI_params_dir = os.path.join(src_dir, 'input', 'SPI', 'SPI_params')
+    SPI_state_file = os.path.join(SPI_params_dir, 'spi_state.json')
+    clip_mask_file = os.path.join(src_dir, 'input', 'clip_mask', 'ARG_IMERG_clip_mask.npz')
+    geoserver_PTM_dir = os.path.join(src_dir, 'output', 'geoserver', 'PTM')
+    geoserver_SPI_dir = os.path.join(src_dir, 'output', 'geoserver', 'SPI')
+    downloable_data_dir = os.path.join(src_dir, 'output', 'downloable_data')
+    downloable_data_PTM_dir = os.path.join(downloable_data_dir, 'PTM')
+    downloable_data_SPI_dir = os.path.join(downloable_data_dir, 'SPI')
+    geoserver_mosaic_dir = os.path.join(src_dir, 'output', 'geoserver', 'mosaic')
+    download_cache_dir = os.path.join(src_dir, 'output', 'download_cache')
+    timeseries_dir = os.path.join(src_dir, 'output', 'timeseries')
+
+    calibration_date = get_calibration_date()
+    output_profile = get_output_profile()
+    geoserver_upload_mode = os.getenv('GEOSERVER_UPLOAD_MODE') or 'layers'
+
+    return [
+        {
+            'name': 'p_acu_mensual',
+            'function': p_acu_mensual,
+            'depends_on': [],
+            'inputs': [ARG_late_dir],
+            'outputs': [IMERG_late_month_dir, IMERG_late_month_manifest_dir],
+        },
+        #{
+        #    'name': 'automatic_s3_uploader',
+        #    'function': automatic_s3_uploader,
+        #    'depends_on': ['p_acu_mensual'],
+        #    'inputs': [IMERG_late_month_dir],
+        #    'outputs': [],
+        #},
+        {
+            'name': 'concat_reord',
+            'function': concat_reord,
+            'depends_on': ['p_acu_mensual'],
+            'inputs': [IMERG_late_month_dir],
+            'outputs': [concat_reord_dir, PTM_dir],
+        },
+        {
+            'name': 'ptm_convertion_and_crop',
+            'function': ptm_convertion_and_crop,
+            'depends_on': ['concat_reord'],
+            'inputs': [PTM_nc4_file],
+            'params': [calibration_date, output_profile],
+            'outputs': [downloable_data_PTM_dir, geoserver_PTM_dir, clip_mask_file],
+        },
+        {
+            'name': 'spi_process',
+            'function': spi_process,
+            'depends_on': ['concat_reord'],
+            'inputs': [reord_file],
+            'params': [get_spi_calibration_end_year()],
+            'outputs': [SPI_gamma_reord_dir, SPI_params_dir],
+        },
+        {
+            'name': 'spi_convertion_and_crop',
+            'function': spi_convertion_and_crop,
+            'depends_on': ['spi_process'],
+            'inputs': [SPI_gamma_reord_dir],
+            'params': [calibration_date, output_profile],
+            'outputs': [downloable_data_SPI_dir, geoserver_SPI_dir, clip_mask_file, SPI_state_file],
+        },
+        {
+            'name': 'geoserver_upload',
+            'function': geoserver_upload,
+            'depends_on': ['ptm_convertion_and_crop', 'spi_convertion_and_crop'],
+            'inputs': [geoserver_PTM_dir, geoserver_SPI_dir, downloable_data_dir],
+            'params': [geoserver_upload_mode],
+            'outputs': [geoserver_mosaic_dir] if geoserver_upload_mode == 'mosaic' else [],
+            'always_run': True,
+        },
+        {
+            'name': 'prebuild_download_bundles',
+            'function': prebuild_download_bundles,
+            'depends_on': ['ptm_convertion_and_crop', 'spi_convertion_and_crop'],
+            'inputs': [downloable_data_dir, IMERG_late_month_dir],
+            'params': [os.getenv('DOWNLOAD_PREBUILT_BUNDLES') or ''],
+            'outputs': [download_cache_dir],
+        },
+        {
+            'name': 'build_timeseries_store',
+            'function': build_timeseries_store,
+            'depends_on': ['concat_reord', 'spi_process'],
+            'inputs': [reord_file, SPI_gamma_reord_dir],
+            'outputs': [timeseries_dir, clip_mask_file],
+        },
+    ]
+
+###################################################################################################################################
+
 ## Funcion remote_download_process(): Sirve para efectura la descarga remota de archivos IMERG de precipitacion diaria, via Gmail.
 #  1. Mediante "get_ARG_late_last_date()" se obtiene la fecha del archivo IMERG de precipitacion diaria mas recientemente descargado, 
 #     para que pueda ser notificado via email, al finalizar el proceso. De igual manera con "get_ARG_late_reset_date()" para obtener 
@@ -177,8 +306,8 @@ def ehcpa_process():
 #  2. El proceso unicamente se ejecutara si hay conectividad a Internet, por lo tanto se realiza dicha verificacion mediante 
 #     "check_internet_connection()". Si hay conectividad continua el proceso, caso contrario el proceso se no se ejecutara indicando 
 #     que hay conectividad.
-#  3. En caso de haber conexion, durante el proceso se ejecutan, entre funcion y funcion, las funciones "sleep_for_a_bit()" para 
-#     pausar el proceso durante unos segundos y asi evitar sobrecargas.
+#  3. En caso de haber conexion, durante el proceso se verifica, entre funcion y funcion, que el resultado de la funcion anterior 
+#     este disponible mediante "wait_for_path()", en lugar de pausar el proceso un tiempo fijo.
 #  4. Se ejecuta "recieve_email()" la cual permite identificar si llego un mail con peticion de descarga remota. De dicha funcion se  
 #     extraen las fechas indicadas a descargar y una señal de deteccion de solicitud.
 #  5. En caso de que las fechas de descarga extraidas tengan datos, continua el proceso, caso contrario, se muestra el mensaje de 
@@ -188,7 +317,7 @@ def ehcpa_process():
 #     "ARG_late". De dicha funcion se extrae la flag "error_found" y el valor del mensaje de error en "error_message". Y se verifica 
 #     que si la flag "error_found" es "True", se envia un email avisando que el proceso finalizo con errores, enviando "error_message", 
 #     y el proceso se detiene. En caso de que ocurra un error y no haya conectividad, el mensaje se indica y se informa que el mail 
-#     no podra enviarse.
+#     no podra enviarse. Antes de dicha verificacion se actualiza el indice de fechas mediante "update_dates_index()".
 #  7. Se ejecuta nuevamente "get_ARG_late_last_date()" para obtener la fecha del nuevo archivo IMERG de precipitacion diaria descargado, 
 #     para que pueda ser notificado via email, al finalizar el proceso. Y el proceso finaliza.
 #
@@ -215,10 +344,9 @@ def remote_download_process():
 
             if begTime and endTime:
 
-                sleep_for_a_bit(30)
-
                 reset_ARG_late = False
                 error_found, error_message = download_subset(begTime, endTime, reset_ARG_late)
+                update_dates_index()
 
                 if error_found:
                     subject = "EHCPA - Error en descarga remota"
@@ -238,7 +366,7 @@ def remote_download_process():
 
                     return
 
-                sleep_for_a_bit(15)
+                wait_for_path(os.path.expanduser(os.path.join('~', 'EHCPA_SPI', 'backend', 'src', 'ARG_late')))
 
                 ARG_late_last_date = get_ARG_late_last_date()
 
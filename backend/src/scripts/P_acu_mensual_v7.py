@@ -1,19 +1,27 @@
 import os
+import re
+import json
 import pandas as pd
 import xarray as xr
 
 ###################################################################################################################################
 
-## Funcion p_acu_mensual: Sirve para procesar los archivos IMERG de precipitación diaria con el obteivo de calcular la precipitación 
+## Funcion p_acu_mensual: Sirve para procesar los archivos IMERG de precipitación diaria con el obteivo de calcular la precipitación
 #  mensual acumulada.
+#  - La funcion recibe como parametro "incremental", que por defecto es "True", e indica que el acumulado mensual se actualiza de
+#    forma incremental, es decir, que solo se suman al acumulado existente los dias nuevos que todavia no fueron incorporados. Si es
+#    "False", los acumulados de cada mes presente en "ARG_late" se recalculan desde cero (una unica vez por mes).
+
+def p_acu_mensual(incremental=True):
 
-def p_acu_mensual():
-    
     ## Distribucion de carpetas/directorios:
     #
     #   - arg_late_dir: Carpeta donde se encuentran los archivos IMERG de precipitacion diaria.
     #   - IMERG_late_month_dir: Carpeta donde se van a guardar los archivos de precipitacion mensual acumulada.
     #     Si dicha carpeta no existe, se crea.
+    #   - IMERG_late_month_manifest_dir: Carpeta donde se guarda, para cada mes, el manifiesto con los archivos IMERG diarios que
+    #     ya fueron sumados en su acumulado mensual. Si dicha carpeta no existe, se crea. Se mantiene separada de "IMERG_late_month"
+    #     para no alterar el backup de S3 ni el conteo de archivos de dicho directorio.
 
     arg_late_dir = os.path.expanduser(os.path.join('~', 'EHCPA_SPI', 'backend', 'src', 'ARG_late'))      # input_dir = os.path.join(os.getcwd(), 'ARG_late')
 
@@ -22,22 +30,27 @@ def p_acu_mensual():
     if not os.path.exists(IMERG_late_month_dir):
         os.makedirs(IMERG_late_month_dir)
 
+    IMERG_late_month_manifest_dir = os.path.expanduser(os.path.join('~', 'EHCPA_SPI', 'backend', 'src', 'IMERG_late_month_manifest'))
+
+    if not os.path.exists(IMERG_late_month_manifest_dir):
+        os.makedirs(IMERG_late_month_manifest_dir)
+
     ###################################################################################################################################
 
-    ## PROCEDIMIENTO:  
-    #  1. Creamos una lista que contenga todos los archivos IMERG de precipitacion diaria en el directorio de entrada y calculamos la 
-    #     cantidad de archivos en el mismo. Se aplica un filtro a los archivos, dejando aquellos que solo contienen la palabra "IMERG" 
-    #     para ser procesados, y esto es asi ya que la descarga desde la API de la NASA provee dos archivos PDF. 
-    #  2. Iteramos sobre cada uno de los archivos de entrada, y extraemos el año y el mes de cada uno, y concatenamos en funcion del 
-    #     mes, es decir, concatenamos aquellos que pertenezcan al mismo mes.
-    #  3. El acumulado mensual es basicamente la suma de la variable presipitacion de todos los archivos a traves de la variable "time". 
-    #     Luego de calcularlo, agregamos atributos a la variable mensual de precipitación, como una descripcion de la variable, unidad 
-    #     de medida, y valores para representar datos faltantes.
-    #  4. Expandimos la dimensión time para agregar el mes como una dimensión temporal, y aplicamos un reordenamiento de las dimensiones 
-    #     para asegurar que "time" este primero, seguido de "lon" y "lat". Configuramos la variable "precipitation" aplicando una variable 
-    #     "time_var" para representar el tiempo correspondiente al mes de los datos procesados (el primer dia del mes), como asi tambien 
-    #     la longitud y latitud extraidas del archivo original. 
-    #  5. Finalmente, los acumulados son guardados como archivos netCDF.
+    ## PROCEDIMIENTO:
+    #  1. Creamos una lista que contenga todos los archivos IMERG de precipitacion diaria en el directorio de entrada y calculamos la
+    #     cantidad de archivos en el mismo. Se aplica un filtro a los archivos, dejando aquellos que solo contienen la palabra "IMERG"
+    #     para ser procesados, y esto es asi ya que la descarga desde la API de la NASA provee dos archivos PDF.
+    #  2. Agrupamos los archivos por mes, extrayendo el año y el mes de la fecha (YYYYMMDD) presente en el nombre de cada archivo, de
+    #     forma que cada mes se procese una unica vez, sin necesidad de abrir cada archivo diario para conocer su fecha.
+    #  3. Para cada mes, leemos su manifiesto y determinamos que archivos diarios son nuevos, es decir, que todavia no fueron sumados
+    #     al acumulado. Si un archivo ya sumado cambio de tamaño (por ejemplo, porque se volvio a descargar), si el acumulado del mes
+    #     no existe, si el mes no tiene manifiesto (primera ejecucion, o acumulado restaurado desde S3), o si el modo no es
+    #     incremental, el acumulado de ese mes se recalcula desde cero con todos sus archivos diarios.
+    #     Si no hay archivos nuevos, el mes se omite y su acumulado no se vuelve a escribir.
+    #  4. El acumulado mensual es basicamente la suma de la variable presipitacion de todos los archivos a traves de la variable "time".
+    #     En el modo incremental, a la suma de los archivos nuevos se le agrega el acumulado existente del mes.
+    #  5. Finalmente, el acumulado de cada mes modificado se guarda una unica vez como archivo netCDF, y se actualiza su manifiesto.
 
     files = os.listdir(arg_late_dir)
     num_files = len(files)
@@ -45,35 +58,111 @@ def p_acu_mensual():
 
     files = [f for f in files if 'IMERG' in f]
 
-    for file in files:
+    pattern = r'(\d{4})(\d{2})\d{2}'
+    files_by_month = {}
 
-        ds = xr.open_dataset(os.path.join(arg_late_dir, file))
+    for file in sorted(files):
+        match = re.search(pattern, file)
+        if match:
+            year, month = match.group(1), match.group(2)
+            files_by_month.setdefault((year, month), []).append(file)
 
-        year = str(ds.time.dt.year.values[0])
-        month = str(ds.time.dt.month.values[0]).zfill(2)
+    for (year, month), daily_files in sorted(files_by_month.items()):
 
-        daily_files = [f for f in files if year+month in f]
-        ds_month = xr.open_mfdataset([os.path.join(arg_late_dir, f) for f in daily_files], combine='by_coords')
+        output_file = os.path.join(IMERG_late_month_dir, f'IMERG_monthly_accumulated_precip_{year}_{month}.nc4')
+        manifest_file = os.path.join(IMERG_late_month_manifest_dir, f'IMERG_monthly_accumulated_precip_{year}_{month}.json')
 
-        monthly_precip = ds_month['precipitation'].sum(dim='time')
-        
-        monthly_precip.attrs['long_name'] = 'Monthly accumulated precipitation (combined microwave-IR) estimate'
-        monthly_precip.attrs['units'] = 'mm'
-        monthly_precip.attrs['_FillValue'] = -9999.9
-        monthly_precip.attrs['missing_value'] = -9999.9
+        daily_sizes = {f: os.path.getsize(os.path.join(arg_late_dir, f)) for f in daily_files}
 
-        monthly_precip = monthly_precip.expand_dims(dim='time')
-        monthly_precip = monthly_precip.transpose('time', 'lon', 'lat')
+        folded_files = read_month_manifest(manifest_file)
 
-        time_var = pd.date_range(start=f'{year}-{month}-01', periods=1, freq='MS')
-        ds_out = xr.Dataset({'precipitation': monthly_precip}, coords={'time': time_var, 'lon': monthly_precip.lon, 'lat': monthly_precip.lat})
+        rebuild = (
+            not incremental
+            or not os.path.exists(output_file)
+            or not folded_files
+            or any(f in daily_sizes and daily_sizes[f] != size for f, size in folded_files.items())
+        )
 
-        output_file = os.path.join(IMERG_late_month_dir, f'IMERG_monthly_accumulated_precip_{year}_{month}.nc4')
-        ds_out.to_netcdf(output_file)
+        if rebuild:
+            folded_files = {}
+            new_files = daily_files
+        else:
+            new_files = [f for f in daily_files if f not in folded_files]
+
+        if not new_files:
+            print(f"Acumulado mensual {year}_{month} sin archivos nuevos, se omite.")
+            continue
+
+        ds_month = xr.open_mfdataset([os.path.join(arg_late_dir, f) for f in new_files], combine='by_coords')
+
+        monthly_precip = ds_month['precipitation'].sum(dim='time').load()
+        ds_month.close()
+
+        if not rebuild:
+            with xr.open_dataset(output_file) as ds_previous:
+                previous_precip = ds_previous['precipitation'].isel(time=0).transpose(*monthly_precip.dims).load()
+            monthly_precip = monthly_precip.copy(data=monthly_precip.values + previous_precip.values)
+
+        write_monthly_precip(monthly_precip, year, month, output_file)
+
+        for f in new_files:
+            folded_files[f] = daily_sizes[f]
+        write_month_manifest(manifest_file, folded_files)
+
+        print(f"Acumulado mensual {year}_{month} actualizado con {len(new_files)} archivo(s) diario(s).")
+
+###################################################################################################################################
+
+## Funcion write_monthly_precip: Sirve para guardar el acumulado mensual de precipitacion como archivo netCDF.
+#  1. Agregamos atributos a la variable mensual de precipitación, como una descripcion de la variable, unidad de medida, y valores
+#     para representar datos faltantes.
+#  2. Expandimos la dimensión time para agregar el mes como una dimensión temporal, y aplicamos un reordenamiento de las dimensiones
+#     para asegurar que "time" este primero, seguido de "lon" y "lat". Configuramos la variable "precipitation" aplicando una variable
+#     "time_var" para representar el tiempo correspondiente al mes de los datos procesados (el primer dia del mes), como asi tambien
+#     la longitud y latitud extraidas del archivo original.
+#  3. El archivo se escribe primero con un nombre temporal y luego se renombra, para que el acumulado anterior nunca quede a medio
+#     escribir si el proceso se interrumpe.
+
+def write_monthly_precip(monthly_precip, year, month, output_file):
+
+    monthly_precip.attrs['long_name'] = 'Monthly accumulated precipitation (combined microwave-IR) estimate'
+    monthly_precip.attrs['units'] = 'mm'
+    monthly_precip.attrs['_FillValue'] = -9999.9
+    monthly_precip.attrs['missing_value'] = -9999.9
+
+    monthly_precip = monthly_precip.expand_dims(dim='time')
+    monthly_precip = monthly_precip.transpose('time', 'lon', 'lat')
+
+    time_var = pd.date_range(start=f'{year}-{month}-01', periods=1, freq='MS')
+    ds_out = xr.Dataset({'precipitation': monthly_precip}, coords={'time': time_var, 'lon': monthly_precip.lon, 'lat': monthly_precip.lat})
+
+    temp_file = output_file + '.TMP'
+    ds_out.to_netcdf(temp_file)
+    os.replace(temp_file, output_file)
+
+###################################################################################################################################
+
+## Funciones read_month_manifest y write_month_manifest: Sirven para leer y guardar el manifiesto de un mes, es decir, el diccionario
+#  con el nombre de cada archivo IMERG diario ya sumado en el acumulado mensual y su tamaño en bytes.
+#  - Si el manifiesto no existe o esta corrupto, se retorna un diccionario vacio, lo que provoca que el mes se recalcule desde cero.
+
+def read_month_manifest(manifest_file):
+    try:
+        with open(manifest_file, 'r') as f:
+            return json.load(f).get('daily_files', {})
+    except (OSError, ValueError):
+        return {}
+
+
+def write_month_manifest(manifest_file, folded_files):
+    temp_file = manifest_file + '.TMP'
+    with open(temp_file, 'w') as f:
+        json.dump({'daily_files': folded_files}, f, indent=2, sort_keys=True)
+    os.replace(temp_file, manifest_file)
 
 
 
 
 
 if __name__ == '__main__':
-    p_acu_mensual()
\ No newline at end of file
+    p_acu_mensual()
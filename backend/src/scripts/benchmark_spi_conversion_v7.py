@@ -0,0 +1,43 @@
+import os
+import sys
+import time
+
+try:
+    from spi_conversion_crop_v7 import spi_convertion_and_crop
+except ModuleNotFoundError:
+    from src.scripts.spi_conversion_crop_v7 import spi_convertion_and_crop
+
+###################################################################################################################################
+
+## Funcion benchmark_spi_conversion: Sirve para medir el tiempo de "spi_convertion_and_crop()" en funcion de la cantidad de escalas
+#  que se procesan en paralelo ("max_workers"), sobre los archivos SPI reordenados existentes en "SPI_gamma_reord".
+#  1. La funcion recibe como parametro la lista de cantidades de procesos a medir. Para cada una, se ejecuta la conversion completa
+#     (modo no incremental, para que todas las escalas se regeneren) y se mide el tiempo total.
+#  2. Se imprime una tabla con el tiempo de cada cantidad de procesos y la aceleracion respecto de la ejecucion en serie (1 proceso),
+#     y se retorna la lista de resultados.
+#  - Los archivos resultantes se sobreescriben, por lo que no se recomienda ejecutarla mientras el proceso principal esta en curso.
+
+def benchmark_spi_conversion(worker_counts=(1, 2, 4, 8, 11)):
+    results = []
+
+    for max_workers in worker_counts:
+        start_time = time.monotonic()
+        spi_convertion_and_crop(incremental=False, max_workers=max_workers)
+        elapsed = time.monotonic() - start_time
+        results.append({'max_workers': max_workers, 'elapsed_s': elapsed})
+
+    serial_time = next((result['elapsed_s'] for result in results if result['max_workers'] == 1), results[0]['elapsed_s'])
+
+    print(f"\nCPUs disponibles: {os.cpu_count()}")
+    print(f"{'Procesos':>10} {'Tiempo (s)':>12} {'Aceleracion':>12}")
+    for result in results:
+        print(f"{result['max_workers']:>10} {result['elapsed_s']:>12.1f} {serial_time / result['elapsed_s']:>11.2f}x")
+
+    return results
+
+
+
+
+if __name__ == '__main__':
+    worker_counts = [int(arg) for arg in sys.argv[1:]] or [1, 2, 4, 8, 11]
+    benchmark_spi_conversion(worker_counts)
@@ -0,0 +1,114 @@
+import os
+import json
+import hashlib
+import numpy as np
+import xarray as xr
+import fiona
+import rasterio.windows
+from rasterio.features import geometry_mask
+
+###################################################################################################################################
+
+## Funcion load_clip_mask: Sirve para obtener la mascara de corte sobre Argentina para la grilla IMERG de un raster, sin tener que
+#  volver a leer el shapefile ni rasterizar su geometria en cada corte.
+#  1. La funcion recibe como parametros el raster (DataArray con las dimensiones espaciales y el CRS ya configurados), la ruta del
+#     shapefile de Argentina y la ruta del archivo donde se guarda la mascara.
+#  2. Calculamos la firma de la grilla (coordenadas de longitud y latitud y transformacion del raster) y la firma del shapefile
+#     (tamaño y fecha de modificacion de sus archivos). Si el archivo de la mascara existe y fue generado con las mismas firmas,
+#     se lo reutiliza.
+#  3. Caso contrario, se abre el shapefile, se rasteriza su geometria sobre la grilla con "geometry_mask" (el mismo criterio que
+#     aplica "rio.clip": se incluyen los pixeles cuyo centro cae dentro del contorno), y se calcula la ventana minima que contiene
+#     a todos los pixeles de la mascara. Se guarda la mascara recortada a dicha ventana, junto con la ventana y las firmas.
+#  4. Se retorna un diccionario con la mascara ("mask", booleana, con forma alto x ancho de la ventana) y la ventana ("window",
+#     como fila inicial, columna inicial, alto y ancho).
+
+def load_clip_mask(data_array, shp_file, mask_file):
+    grid_signature = get_grid_signature(data_array)
+    shp_signature = get_shapefile_signature(shp_file)
+
+    if os.path.exists(mask_file):
+        with np.load(mask_file) as stored:
+            if str(stored['grid_signature']) == grid_signature and str(stored['shp_signature']) == shp_signature:
+                return {'mask': stored['mask'], 'window': tuple(int(v) for v in stored['window'])}
+
+    with fiona.open(shp_file, "r") as shapefile:
+        shapes = [feature["geometry"] for feature in shapefile]
+
+    full_mask = geometry_mask(
+        shapes,
+        out_shape=(int(data_array.rio.height), int(data_array.rio.width)),
+        transform=data_array.rio.transform(recalc=True),
+        invert=True,
+    )
+
+    window = rasterio.windows.get_data_window(np.ma.masked_array(full_mask, ~full_mask))
+    row_off, col_off, height, width = int(window.row_off), int(window.col_off), int(window.height), int(window.width)
+    mask = full_mask[row_off:row_off + height, col_off:col_off + width]
+
+    mask_dir = os.path.dirname(mask_file)
+    if mask_dir and not os.path.exists(mask_dir):
+        os.makedirs(mask_dir)
+
+    temp_file = mask_file + f'.{os.getpid()}.TMP.npz'
+    np.savez(
+        temp_file, mask=mask, window=np.array([row_off, col_off, height, width]),
+        grid_signature=grid_signature, shp_signature=shp_signature
+    )
+    os.replace(temp_file, mask_file)
+
+    print(f"Mascara de corte generada: {mask_file}")
+
+    return {'mask': mask, 'window': (row_off, col_off, height, width)}
+
+###################################################################################################################################
+
+## Funcion clip_with_mask: Sirve para cortar un raster sobre Argentina con la mascara de "load_clip_mask()".
+#  - Se seleccionan las filas y columnas de la ventana con "isel", y los pixeles fuera de la mascara se reemplazan por NaN con
+#    "where", para todas las bandas a la vez. Si el raster tiene un valor "nodata" distinto de NaN, se usa dicho valor. Ademas se 
+#    conservan los atributos, el CRS y el "nodata" del raster original, por lo que el resultado es el mismo que el de "rio.clip" 
+#    con el contorno de Argentina.
+
+def clip_with_mask(data_array, clip_mask):
+    row_off, col_off, height, width = clip_mask['window']
+    y_dim, x_dim = data_array.rio.y_dim, data_array.rio.x_dim
+
+    cropped = data_array.isel({y_dim: slice(row_off, row_off + height), x_dim: slice(col_off, col_off + width)})
+    cropped = cropped.where(xr.DataArray(clip_mask['mask'], dims=(y_dim, x_dim)))
+
+    nodata = data_array.rio.nodata
+    if nodata is not None and not np.isnan(nodata):
+        cropped = cropped.fillna(nodata)
+
+    cropped = cropped.astype(data_array.dtype)
+    cropped.attrs = data_array.attrs.copy()
+    cropped.encoding = data_array.encoding.copy()
+
+    cropped = cropped.rio.set_spatial_dims(x_dim, y_dim)
+    cropped = cropped.rio.write_crs(data_array.rio.crs)
+
+    if data_array.rio.encoded_nodata is not None:
+        return cropped.rio.write_nodata(data_array.rio.encoded_nodata, encoded=True)
+    return cropped.rio.write_nodata(nodata)
+
+###################################################################################################################################
+
+## Funciones get_grid_signature y get_shapefile_signature: Sirven para calcular las firmas con las que se determina si la mascara
+#  guardada sigue siendo valida, es decir, si no cambio la grilla del raster ni el shapefile.
+
+def get_grid_signature(data_array):
+    grid = hashlib.sha1()
+    grid.update(np.ascontiguousarray(data_array[data_array.rio.x_dim].values, dtype='float64').tobytes())
+    grid.update(np.ascontiguousarray(data_array[data_array.rio.y_dim].values, dtype='float64').tobytes())
+    grid.update(str(tuple(data_array.rio.transform(recalc=True))).encode('utf-8'))
+    return grid.hexdigest()
+
+
+def get_shapefile_signature(shp_file):
+    signature = {}
+    base_file = os.path.splitext(shp_file)[0]
+    for extension in ['.shp', '.shx', '.dbf', '.prj']:
+        file_path = base_file + extension
+        if os.path.exists(file_path):
+            stat = os.stat(file_path)
+            signature[extension] = [stat.st_size, stat.st_mtime_ns]
+    return json.dumps(signature, sort_keys=True)
@@ -1,22 +1,37 @@
 import os
 import platform
 import shutil
+import time
+import json
 from subprocess import Popen
 import math
+import numpy as np
+import netCDF4
 from datetime import datetime
 from dateutil.relativedelta import relativedelta
 
 try:
-    from sleep_for_a_bit_v7 import sleep_for_a_bit 
+    import resource
+except ImportError:
+    resource = None
+
+try:
+    from wait_until_v7 import wait_for_path, wait_for_path_removed
 except ModuleNotFoundError:
-    from src.scripts.sleep_for_a_bit_v7 import sleep_for_a_bit
+    from src.scripts.wait_until_v7 import wait_for_path, wait_for_path_removed
 
 ###################################################################################################################################
 
 ## Funcion concat_reord: Sirve para realizar la concatenación, reordenamiento y corrección de los archivos de precipitación mensual
 #  acumulada, y generar el archivo de Precipitacion Total Mensual (PTM) en un formato específico para su posterior análisis.  
-
-def concat_reord():
+#  - La funcion recibe como parametro "engine", que indica el motor utilizado:
+#    - "xarray" (por defecto): Se utiliza el motor en Python "concat_reord_xarray()", que genera ambos archivos en una sola pasada.
+#    - "nco": Se utiliza la cadena de comandos NCO (ncks, ncrcat y ncpdq) de los pasos 1 a 5.
+#  - Y recibe el parametro "append", que por defecto es "True" y solo aplica al motor "xarray". Indica que los archivos de salida 
+#    no se regeneran completos, sino que solo se reescriben los meses modificados y se agregan los meses nuevos al final de la 
+#    dimension "time", mediante "update_concat_reord_xarray()".
+
+def concat_reord(engine='xarray', append=True):
     
     ## Distribucion de carpetas/directorios:
     #
@@ -28,7 +43,10 @@ def concat_reord():
     #
     #   - Si la carpeta input no existe, se la crea.
     #   - Para las carpetas concat_reord y PTM, en caso de que estas existan, al momento de ejecutar el proceso, 
-    #     estas se borran y vuelven a crear vacias, y en caso de que no existan, solo se crean.
+    #     estas se borran y vuelven a crear vacias, y en caso de que no existan, solo se crean. En el modo "append" estas 
+    #     carpetas no se borran, ya que se actualizan los archivos existentes.
+    #   - Luego de crear o borrar cada carpeta, en lugar de pausar el proceso un tiempo fijo, se espera a que la carpeta exista
+    #     (o deje de existir) mediante "wait_for_path()" y "wait_for_path_removed()".
     #   - Almacenamos en una variable "file", todos los acumulados mensuales, iterando sobre la carpeta IMERG_late_month.
 
     IMERG_late_month_dir = os.path.expanduser(os.path.join('~', 'EHCPA_SPI', 'backend', 'src', 'IMERG_late_month'))
@@ -37,32 +55,55 @@ def concat_reord():
 
     if not os.path.exists(input_dir):
         os.makedirs(input_dir)
-    sleep_for_a_bit(20)
+    wait_for_path(input_dir)
 
     concat_reord_dir = os.path.expanduser(os.path.join('~', 'EHCPA_SPI', 'backend', 'src', 'input', 'concat_reord'))
 
-    if os.path.exists(concat_reord_dir):
+    append = append and engine == 'xarray'
+
+    if os.path.exists(concat_reord_dir) and not append:
         shutil.rmtree(concat_reord_dir)
-        sleep_for_a_bit(20)
+        wait_for_path_removed(concat_reord_dir)
         os.makedirs(concat_reord_dir)
-    else:
+    elif not os.path.exists(concat_reord_dir):
         os.makedirs(concat_reord_dir)
-    sleep_for_a_bit(120)
+    wait_for_path(concat_reord_dir)
 
     PTM_dir = os.path.expanduser(os.path.join('~', 'EHCPA_SPI', 'backend', 'src', 'input', 'PTM'))
 
-    if os.path.exists(PTM_dir):
+    if os.path.exists(PTM_dir) and not append:
         shutil.rmtree(PTM_dir)
-        sleep_for_a_bit(45)
+        wait_for_path_removed(PTM_dir)
         os.makedirs(PTM_dir)
-    else:
+    elif not os.path.exists(PTM_dir):
         os.makedirs(PTM_dir)
-    sleep_for_a_bit(45)
+    wait_for_path(PTM_dir)
 
     files = [f for f in os.listdir(IMERG_late_month_dir) if f.endswith('.nc4')]
 
     ###################################################################################################################################
 
+    ## PASO UNICO (motor "xarray"): Proceso de concatenacion y reordenamiento en Python, sin comandos NCO.
+    #  1. Ordenamos cronologicamente los acumulados mensuales (el nombre de cada archivo termina en "_YYYY_MM.nc4").
+    #  2. Mediante "concat_reord_xarray()" se leen los acumulados mensuales de a bloques y se escriben directamente los dos archivos
+    #     finales: "IMERG_reord_lat_fix.nc4" (lat,lon,time) para el calculo del SPI y "PTM.nc4" (time,lat,lon) para la conversion del
+    #     PTM. Los acumulados mensuales no se modifican, por lo que no es necesario el paso 1 de la cadena NCO.
+    #  3. En el modo "append", mediante "update_concat_reord_xarray()" solo se escriben los meses nuevos o modificados desde la 
+    #     ultima ejecucion, registrados en el manifiesto "concat_reord_manifest.json".
+
+    if engine == 'xarray':
+        monthly_files = [os.path.join(IMERG_late_month_dir, f) for f in sorted(files)]
+        reord_fixed_file = os.path.join(concat_reord_dir, 'IMERG_reord_lat_fix.nc4')
+        IMERG_precip_file = os.path.join(PTM_dir, 'PTM.nc4')
+
+        if append:
+            manifest_file = os.path.join(concat_reord_dir, 'concat_reord_manifest.json')
+            return update_concat_reord_xarray(monthly_files, reord_fixed_file, IMERG_precip_file, manifest_file)
+
+        return concat_reord_xarray(monthly_files, reord_fixed_file, IMERG_precip_file)
+
+    ###################################################################################################################################
+
     ## PASO 1: Proceso para hacer que la dimension "time", de los acumulados mensuales, sea la variable/dimension registrada o fija, 
     #  para concatenar los archivos.
     #  1. Para macOS/Linux: Se itera sobre la variable "file", guardando la ruta de cada uno de los acumulados mensuales, y se la aplica 
@@ -109,8 +150,8 @@ def concat_reord():
     #     termine antes de continuar.          
 
     if platform.system() != "Windows":
-        concat_file = os.path.join(concat_reord_dir, 'IMERG_concat.nc4')
-        command_concat = f'ncrcat -h {os.path.join(IMERG_late_month_dir, "*.nc4")} {concat_file}'
+        final_concat_file = os.path.join(concat_reord_dir, 'IMERG_concat.nc4')
+        command_concat = f'ncrcat -h {os.path.join(IMERG_late_month_dir, "*.nc4")} {final_concat_file}'
         Popen(command_concat, shell=True).wait()
     else:
         chunk_size = 50  
@@ -171,6 +212,258 @@ def concat_reord():
     command_final_reorder = f'ncpdq -a time,lat,lon {reord_fixed_file} {IMERG_precip_file}'
     Popen(command_final_reorder, shell=True).wait()
 
+###################################################################################################################################
+
+## Funcion concat_reord_xarray: Sirve para generar, en una sola pasada y sin comandos NCO, los archivos "IMERG_reord_lat_fix.nc4" 
+#  (dimensiones lat,lon,time) y "PTM.nc4" (dimensiones time,lat,lon) a partir de los acumulados mensuales, con el mismo contenido 
+#  que genera la cadena "ncks --mk_rec_dmn", "ncrcat", "ncpdq -a lat,lon,time", "ncks --fix_rec_dmn lat" y "ncpdq -a time,lat,lon".
+#  1. La funcion recibe como parametros la lista ordenada de acumulados mensuales, las rutas de ambos archivos de salida, y el 
+#     tamaño de bloque "block_size", es decir, la cantidad de meses que se mantienen en memoria a la vez. 
+#  2. Del primer acumulado mensual tomamos las variables lat y lon, los atributos de todas las variables, y las unidades y el 
+#     calendario de "time". Al igual que "ncrcat", los valores de "time" de todos los meses se expresan en las unidades del primer 
+#     archivo.
+#  3. Creamos ambos archivos de salida con las mismas dimensiones que quedan luego de la cadena NCO, salvo "time", que es una 
+#     dimension ilimitada (como en "IMERG_concat.nc4") para poder agregar meses sin regenerar los archivos. El archivo PTM se 
+#     escribe en bloques de un mes, y el archivo reordenado en bloques de "block_size" meses, de forma que cada bloque leido se 
+#     escribe en bloques completos en ambos archivos.
+#  4. Iteramos sobre los acumulados mensuales de a bloques, leyendo la precipitacion (time,lon,lat) de cada mes y reordenandola 
+#     en memoria, para escribir el bloque en ambos archivos.
+#  5. Los archivos se escriben con un nombre temporal y se renombran al finalizar, para no dejar archivos incompletos. Finalmente 
+#     se informa el tiempo total y el pico de memoria del proceso, y se retornan dichos valores.
+
+def concat_reord_xarray(monthly_files, reord_fixed_file, IMERG_precip_file, block_size=12):
+
+    start_time = time.perf_counter()
+
+    num_months = len(monthly_files)
+
+    with netCDF4.Dataset(monthly_files[0], 'r') as first_file:
+        first_file.set_auto_maskandscale(False)
+        lat = first_file.variables['lat']
+        lon = first_file.variables['lon']
+        time_var = first_file.variables['time']
+        precip = first_file.variables['precipitation']
+
+        lat_values, lat_attrs, lat_dtype = lat[:], get_nc_attrs(lat), lat.dtype
+        lon_values, lon_attrs, lon_dtype = lon[:], get_nc_attrs(lon), lon.dtype
+        time_attrs, time_dtype = get_nc_attrs(time_var), time_var.dtype
+        precip_attrs, precip_dtype = get_nc_attrs(precip), precip.dtype
+
+    num_lat, num_lon = len(lat_values), len(lon_values)
+    block_size = max(1, block_size)
+
+    reord_temp_file = reord_fixed_file + '.TMP'
+    precip_temp_file = IMERG_precip_file + '.TMP'
+
+    reord_ds = netCDF4.Dataset(reord_temp_file, 'w', format='NETCDF4')
+    ptm_ds = netCDF4.Dataset(precip_temp_file, 'w', format='NETCDF4')
+
+    try:
+        layouts = [
+            (reord_ds, ('lat', 'lon', 'time'), (num_lat, num_lon, block_size)),
+            (ptm_ds, ('time', 'lat', 'lon'), (1, num_lat, num_lon)),
+        ]
+
+        for ds, precip_dims, precip_chunks in layouts:
+            ds.set_auto_maskandscale(False)
+            ds.createDimension('lat', num_lat)
+            ds.createDimension('lon', num_lon)
+            ds.createDimension('time', None)
+            create_nc_variable(ds, 'lat', lat_dtype, ('lat',), lat_attrs)[:] = lat_values
+            create_nc_variable(ds, 'lon', lon_dtype, ('lon',), lon_attrs)[:] = lon_values
+            create_nc_variable(ds, 'time', time_dtype, ('time',), time_attrs)
+            create_nc_variable(ds, 'precipitation', precip_dtype, precip_dims, precip_attrs, chunksizes=precip_chunks)
+
+        write_monthly_slices(monthly_files, 0, reord_ds, ptm_ds, block_size)
+    finally:
+        reord_ds.close()
+        ptm_ds.close()
+
+    os.replace(reord_temp_file, reord_fixed_file)
+    os.replace(precip_temp_file, IMERG_precip_file)
+
+    wall_time = time.perf_counter() - start_time
+    peak_rss_mb = get_peak_rss_mb()
+
+    print(f"Concatenacion y reordenamiento completados en {wall_time:.1f} segundo(s)")
+    if peak_rss_mb is not None:
+        print(f"Pico de memoria del proceso: {peak_rss_mb:.1f} MB")
+
+    return {'wall_time_s': wall_time, 'peak_rss_mb': peak_rss_mb}
+
+###################################################################################################################################
+
+## Funcion update_concat_reord_xarray: Sirve para actualizar los archivos "IMERG_reord_lat_fix.nc4" y "PTM.nc4" escribiendo 
+#  unicamente los meses nuevos o modificados, de forma que la escritura nocturna no crezca con el tamaño del archivo historico.
+#  1. La funcion recibe como parametros la lista ordenada de acumulados mensuales, las rutas de ambos archivos de salida, la ruta 
+#     del manifiesto y el tamaño de bloque. El manifiesto registra, para cada acumulado mensual ya escrito, su tamaño y fecha de 
+#     modificacion, en el mismo orden que la dimension "time".
+#  2. Si alguno de los archivos de salida o el manifiesto no existe, o si los meses registrados no coinciden con el inicio de la 
+#     lista actual (por ejemplo, porque se agrego un mes intermedio), se regeneran ambos archivos completos con 
+#     "concat_reord_xarray()".
+#  3. Caso contrario, se reescriben en su posicion los meses cuyo tamaño o fecha de modificacion cambio (tipicamente el mes en 
+#     curso), y se agregan al final de la dimension "time" los meses nuevos.
+#  4. El manifiesto se elimina antes de escribir y se vuelve a guardar al finalizar, por lo que si el proceso se interrumpe, la 
+#     proxima ejecucion regenera los archivos completos. En el manifiesto tambien se registra el indice del primer mes modificado, 
+#     para que las etapas siguientes sepan desde que mes cambiaron los datos.
+#  5. Se retorna el tiempo total, el pico de memoria y el indice del primer mes modificado (None si no hubo cambios).
+
+def update_concat_reord_xarray(monthly_files, reord_fixed_file, IMERG_precip_file, manifest_file, block_size=12):
+
+    start_time = time.perf_counter()
+
+    current_files = [[os.path.basename(f), *get_file_signature(f)] for f in monthly_files]
+
+    try:
+        with open(manifest_file, 'r') as f:
+            previous_files = json.load(f)['monthly_files']
+    except (OSError, ValueError, KeyError):
+        previous_files = None
+
+    previous_names = [entry[0] for entry in previous_files] if previous_files is not None else None
+    current_names = [entry[0] for entry in current_files]
+
+    full_rebuild = (
+        previous_names is None
+        or not os.path.exists(reord_fixed_file)
+        or not os.path.exists(IMERG_precip_file)
+        or current_names[:len(previous_names)] != previous_names
+    )
+
+    if os.path.exists(manifest_file):
+        os.remove(manifest_file)
+
+    if full_rebuild:
+        print("Regenerando archivos concatenados completos")
+        stats = concat_reord_xarray(monthly_files, reord_fixed_file, IMERG_precip_file, block_size=block_size)
+        first_changed_index = 0
+    else:
+        changed_indexes = [i for i, entry in enumerate(previous_files) if entry != current_files[i]]
+        changed_indexes += list(range(len(previous_files), len(current_files)))
+
+        first_changed_index = changed_indexes[0] if changed_indexes else None
+
+        with netCDF4.Dataset(reord_fixed_file, 'a') as reord_ds, netCDF4.Dataset(IMERG_precip_file, 'a') as ptm_ds:
+            reord_ds.set_auto_maskandscale(False)
+            ptm_ds.set_auto_maskandscale(False)
+
+            for run_start, run_end in get_contiguous_runs(changed_indexes):
+                write_monthly_slices(monthly_files[run_start:run_end], run_start, reord_ds, ptm_ds, block_size)
+
+        print(f"Meses reescritos o agregados: {len(changed_indexes)} de {len(current_files)}")
+
+        stats = {'wall_time_s': time.perf_counter() - start_time, 'peak_rss_mb': get_peak_rss_mb()}
+
+    manifest = {'monthly_files': current_files, 'first_changed_index': first_changed_index}
+    temp_manifest_file = manifest_file + '.TMP'
+    with open(temp_manifest_file, 'w') as f:
+        json.dump(manifest, f, indent=2)
+    os.replace(temp_manifest_file, manifest_file)
+
+    stats['first_changed_index'] = first_changed_index
+    return stats
+
+###################################################################################################################################
+
+## Funcion write_monthly_slices: Sirve para escribir en ambos archivos de salida una secuencia consecutiva de acumulados mensuales, 
+#  a partir de la posicion "start_index" de la dimension "time". Los meses se leen y escriben de a bloques de "block_size" meses, 
+#  tomando las unidades y el calendario de "time" del archivo de salida.
+
+def write_monthly_slices(monthly_files, start_index, reord_ds, ptm_ds, block_size):
+    ptm_time = ptm_ds.variables['time']
+    time_units = ptm_time.units
+    time_calendar = getattr(ptm_time, 'calendar', 'standard')
+    precip_dtype = ptm_ds.variables['precipitation'].dtype
+
+    for offset in range(0, len(monthly_files), block_size):
+        block_files = monthly_files[offset:offset + block_size]
+        block_start = start_index + offset
+        block_end = block_start + len(block_files)
+
+        precip_block, time_block = read_monthly_block(block_files, time_units, time_calendar, precip_dtype, ptm_time.dtype)
+
+        ptm_ds.variables['precipitation'][block_start:block_end, :, :] = precip_block
+        reord_ds.variables['precipitation'][:, :, block_start:block_end] = np.transpose(precip_block, (1, 2, 0))
+        ptm_ds.variables['time'][block_start:block_end] = time_block
+        reord_ds.variables['time'][block_start:block_end] = time_block
+
+        print(f"Escritos los meses {block_start + 1} a {block_end} de los acumulados mensuales")
+
+###################################################################################################################################
+
+## Funciones get_file_signature y get_contiguous_runs: Sirven para obtener el tamaño y la fecha de modificacion de un archivo, y 
+#  para agrupar una lista ordenada de indices en rangos consecutivos [inicio, fin).
+
+def get_file_signature(file_path):
+    file_stat = os.stat(file_path)
+    return file_stat.st_size, file_stat.st_mtime_ns
+
+
+def get_contiguous_runs(indexes):
+    runs = []
+    for index in indexes:
+        if runs and runs[-1][1] == index:
+            runs[-1][1] = index + 1
+        else:
+            runs.append([index, index + 1])
+    return runs
+
+###################################################################################################################################
+
+## Funcion read_monthly_block: Sirve para leer un bloque de acumulados mensuales.
+#  1. De cada archivo se lee la precipitacion del unico mes que contiene, con dimensiones (lon,lat), y se la reordena a (lat,lon). 
+#     Los valores se leen sin aplicar mascaras, de forma que los valores faltantes se copian tal cual.
+#  2. El valor de "time" de cada archivo se convierte a las unidades y calendario recibidos por parametro.
+#  3. Se retorna el bloque de precipitacion con dimensiones (time,lat,lon) y los valores de "time" del bloque.
+
+def read_monthly_block(block_files, time_units, time_calendar, precip_dtype, time_dtype):
+    precip_block = []
+    time_block = []
+
+    for monthly_file in block_files:
+        with netCDF4.Dataset(monthly_file, 'r') as ds:
+            ds.set_auto_maskandscale(False)
+            precip = ds.variables['precipitation']
+            precip_values = precip[0, :, :]
+            if precip.dimensions[1:] == ('lon', 'lat'):
+                precip_values = precip_values.T
+            precip_block.append(precip_values)
+
+            file_time = ds.variables['time']
+            file_dates = netCDF4.num2date(file_time[:], file_time.units, getattr(file_time, 'calendar', 'standard'))
+            time_block.append(netCDF4.date2num(file_dates[0], time_units, time_calendar))
+
+    return np.stack(precip_block).astype(precip_dtype, copy=False), np.array(time_block).astype(time_dtype)
+
+###################################################################################################################################
+
+## Funciones get_nc_attrs y create_nc_variable: Sirven para copiar los atributos de una variable netCDF, y para crear una variable 
+#  con dichos atributos. El atributo "_FillValue" solo puede asignarse al crear la variable, por lo que se lo pasa por separado.
+
+def get_nc_attrs(variable):
+    return {attr: variable.getncattr(attr) for attr in variable.ncattrs()}
+
+
+def create_nc_variable(ds, name, dtype, dimensions, attrs, chunksizes=None):
+    attrs = dict(attrs)
+    fill_value = attrs.pop('_FillValue', None)
+    variable = ds.createVariable(name, dtype, dimensions, fill_value=fill_value, chunksizes=chunksizes)
+    variable.setncatts(attrs)
+    return variable
+
+###################################################################################################################################
+
+## Funcion get_peak_rss_mb: Sirve para obtener el pico de memoria residente (RSS) del proceso en MB. En Linux "ru_maxrss" esta en 
+#  KB y en macOS en bytes. En Windows no se dispone del modulo "resource", por lo que se retorna None.
+
+def get_peak_rss_mb():
+    if resource is None:
+        return None
+    peak_rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    if platform.system() == "Darwin":
+        return peak_rss / (1024 * 1024)
+    return peak_rss / 1024
+
 
 
 
@@ -0,0 +1,258 @@
+import os
+import json
+import time
+import hashlib
+import threading
+from dotenv import load_dotenv
+
+try:
+    from get_dates_v7 import get_data_download_dates, get_data_version
+except ModuleNotFoundError:
+    from src.scripts.get_dates_v7 import get_data_download_dates, get_data_version
+
+try:
+    from zip_stream_v7 import stream_zip
+except ModuleNotFoundError:
+    from src.scripts.zip_stream_v7 import stream_zip
+
+###################################################################################################################################
+
+## Configuracion de la cache de descargas:
+#  - SPI_SCALES, PMP_SCALES y PMD_SCALES: Escalas validas de los identificadores "SPI_<escala>", "PMP_<escala>" y "PMD_<escala>".
+#  - DOWNLOAD_CACHE_MAX_MB: Tamaño maximo, en MB, que ocupan en disco los ZIP de la cache, si no se indica en el archivo ".env".
+#  - bundle_locks: Grupo fijo de "BUNDLE_LOCKS_COUNT" candados, para que si varias solicitudes piden a la vez el mismo ZIP que no 
+#    esta en la cache, se genere una sola vez. Cada ZIP usa el candado que corresponde al hash de su clave, por lo que la cantidad 
+#    de candados no crece con la cantidad de combinaciones solicitadas (dos ZIP distintos pueden compartir un candado, en cuyo caso
+#    se generan uno despues del otro).
+
+SPI_SCALES = ['1', '2', '3', '6', '9', '12', '24', '36', '48', '60', '72']
+PMP_SCALES = ['24h', '1']
+PMD_SCALES = ['2', '5', '10', '25', '50', '100']
+
+DOWNLOAD_CACHE_MAX_MB = 2048
+
+BUNDLE_LOCKS_COUNT = 64
+
+bundle_locks = [threading.Lock() for _ in range(BUNDLE_LOCKS_COUNT)]
+
+###################################################################################################################################
+
+## Funcion get_download_file: Sirve para obtener la ruta del archivo de descarga correspondiente a un identificador ("PTM",
+#  "SPI_<escala>", "PMP_<escala>" o "PMD_<escala>"), a partir del mes y año de los datos descargables.
+#  - Si la escala o el identificador no son correctos, se lanza un "ValueError" con el mensaje que se informa al usuario.
+#  - La ruta se retorna aunque el archivo no exista, para que quien la solicita informe que no esta disponible.
+
+def get_download_file(data_id, download_end_month, download_end_year):
+    downloable_data_dir = os.path.expanduser(os.path.join('~', 'EHCPA_SPI', 'backend', 'src', 'output', 'downloable_data'))
+    PTM_dir = os.path.join(downloable_data_dir, 'PTM')
+    SPI_dir = os.path.join(downloable_data_dir, 'SPI')
+    PMD_dir = os.path.join(downloable_data_dir, 'PMD')
+
+    scale = data_id.split("_")[1] if "_" in data_id else None
+
+    if data_id == "PTM":
+        return os.path.join(PTM_dir, f'PTM_jun_2000_{download_end_month.rstrip(".")}_{download_end_year}_all_bands_ARG_cropped.tif')
+    elif data_id.startswith("PMP_"):
+        if scale in PMP_SCALES:
+            return os.path.join(PMD_dir, f'PMP_{scale}_ARG_cropped.tif')
+        raise ValueError(f'La escala {scale} no es correcta.')
+    elif data_id.startswith("PMD_"):
+        if scale in PMD_SCALES:
+            return os.path.join(PMD_dir, f'PMD_{scale}_ARG_cropped.tif')
+        raise ValueError(f'La escala {scale} no es correcta.')
+    elif data_id.startswith("SPI_"):
+        if scale in SPI_SCALES:
+            return os.path.join(SPI_dir, f'SPI_jun_2000_{download_end_month.rstrip(".")}_{download_end_year}_scale_{scale}_all_bands_ARG_cropped.tif')
+        raise ValueError(f'La escala {scale} no es correcta.')
+    raise ValueError(f'El identificador {data_id} no es correcto.')
+
+###################################################################################################################################
+
+## Funcion get_download_bundle: Sirve para obtener el ZIP con los archivos "files" de los identificadores "ids" desde la cache de
+#  descargas, generandolo si no existe o si quedo desactualizado.
+#  1. La clave del ZIP es la version de los datos ("data_version", el año y mes del ultimo archivo IMERG mensual) junto con los
+#     identificadores ordenados y sin repetir, por lo que "PTM,SPI_3" y "SPI_3,PTM" comparten el mismo ZIP (con los archivos en el
+#     mismo orden). Junto a cada ZIP se guarda un archivo JSON con su clave y la firma (tamaño y fecha de modificacion) de los 
+#     archivos que contiene.
+#  2. Si el ZIP existe y la firma de sus archivos coincide con la actual, se usa el de la cache, y se actualiza su fecha de ultimo
+#     acceso para el desalojo LRU. Caso contrario, se genera mediante "build_download_bundle()", y luego se desalojan los ZIP menos
+#     usados hasta que la cache no supere su tamaño maximo, mediante "evict_download_bundles()".
+#  3. Se retorna la ruta del ZIP y su ETag, que se calcula a partir de la clave y la firma de sus archivos, por lo que no cambia
+#     mientras los archivos no cambien. Si la cache esta desactivada ("DOWNLOAD_CACHE_MAX_MB=0") o no hay version de los datos, se
+#     retorna None, y el ZIP debe generarse para la solicitud.
+
+def get_download_bundle(ids, files, data_version):
+    max_bytes = get_download_cache_max_bytes()
+    if max_bytes <= 0 or data_version is None:
+        return None
+
+    download_cache_dir = get_download_cache_dir()
+    os.makedirs(download_cache_dir, exist_ok=True)
+
+    bundle_key = f"{data_version}|{','.join(sorted(set(ids)))}"
+    bundle_hash = hashlib.sha1(bundle_key.encode('utf-8')).hexdigest()
+    bundle_name = f"EHCPA_Data_{bundle_hash[:16]}"
+    bundle_file = os.path.join(download_cache_dir, f'{bundle_name}.zip')
+    bundle_info_file = os.path.join(download_cache_dir, f'{bundle_name}.json')
+
+    files = sorted(set(files))
+    sources = get_bundle_sources(files)
+    etag = hashlib.sha256(json.dumps([bundle_key, sources]).encode('utf-8')).hexdigest()[:32]
+
+    with bundle_locks[int(bundle_hash, 16) % BUNDLE_LOCKS_COUNT]:
+        if read_bundle_info(bundle_info_file).get('etag') == etag and os.path.exists(bundle_file):
+            os.utime(bundle_file, (time.time(), os.stat(bundle_file).st_mtime))
+            return bundle_file, etag
+
+        build_download_bundle(bundle_file, files)
+
+        temp_file = bundle_info_file + '.TMP'
+        with open(temp_file, 'w') as f:
+            json.dump({'key': bundle_key, 'sources': sources, 'etag': etag}, f, indent=2)
+        os.replace(temp_file, bundle_info_file)
+
+    evict_download_bundles(max_bytes, keep=bundle_file)
+
+    return bundle_file, etag
+
+###################################################################################################################################
+
+## Funcion build_download_bundle: Sirve para generar un ZIP de la cache a partir de una lista de archivos. El ZIP se genera por
+#  bloques mediante "stream_zip()" (sin comprimir y sin cargarlo en memoria) en un archivo temporal propio de cada hilo, que luego
+#  se renombra, para que nunca se sirva un ZIP a medio escribir.
+
+def build_download_bundle(bundle_file, files):
+    temp_file = f'{bundle_file}.{os.getpid()}.{threading.get_ident()}.TMP'
+    try:
+        with open(temp_file, 'wb') as f:
+            for chunk in stream_zip(files):
+                f.write(chunk)
+        os.replace(temp_file, bundle_file)
+    finally:
+        if os.path.exists(temp_file):
+            os.remove(temp_file)
+
+###################################################################################################################################
+
+## Funcion evict_download_bundles: Sirve para desalojar de la cache los ZIP usados hace mas tiempo (segun su fecha de ultimo acceso),
+#  junto con su archivo JSON, hasta que el tamaño total de la cache no supere "max_bytes". El ZIP indicado en "keep" (el que se
+#  acaba de generar) nunca se desaloja.
+
+def evict_download_bundles(max_bytes, keep=None):
+    download_cache_dir = get_download_cache_dir()
+
+    bundles = []
+    for file in os.listdir(download_cache_dir):
+        if file.endswith('.zip'):
+            try:
+                stat = os.stat(os.path.join(download_cache_dir, file))
+            except FileNotFoundError:
+                continue
+            bundles.append((stat.st_atime, stat.st_size, os.path.join(download_cache_dir, file)))
+
+    total_bytes = sum(size for _, size, _ in bundles)
+
+    for _, size, bundle_file in sorted(bundles):
+        if total_bytes <= max_bytes:
+            break
+        if bundle_file == keep:
+            continue
+        remove_download_bundle(bundle_file)
+        total_bytes -= size
+
+###################################################################################################################################
+
+## Funcion prebuild_download_bundles: Sirve para actualizar la cache de descargas luego de que el proceso diario publica nuevos
+#  archivos de PTM y SPI.
+#  1. Se crea la carpeta de la cache si no existe (ya que es la salida de la etapa), y se eliminan de la cache los ZIP de versiones
+#     anteriores de los datos, o cuyos archivos cambiaron desde que se generaron.
+#  2. Se generan por adelantado los ZIP de las combinaciones de identificadores mas solicitadas, indicadas en la variable
+#     "DOWNLOAD_PREBUILT_BUNDLES" del archivo ".env", separadas por ";" (por ejemplo "PTM,SPI_3,SPI_12;PTM"). Se omiten las
+#     combinaciones con algun archivo que no existe.
+
+def prebuild_download_bundles():
+    dotenv_path = os.path.expanduser(os.path.join('~', 'EHCPA_SPI', 'backend', 'src', 'credentials', '.env'))
+    load_dotenv(dotenv_path)
+    prebuilt_bundles = os.getenv('DOWNLOAD_PREBUILT_BUNDLES') or ''
+
+    download_cache_dir = get_download_cache_dir()
+    os.makedirs(download_cache_dir, exist_ok=True)
+    data_version = get_data_version()
+
+    for file in os.listdir(download_cache_dir):
+        if file.endswith('.json'):
+            bundle_info = read_bundle_info(os.path.join(download_cache_dir, file))
+            bundle_file = os.path.join(download_cache_dir, file[:-len('.json')] + '.zip')
+            if not is_bundle_current(bundle_info, data_version):
+                remove_download_bundle(bundle_file)
+
+    download_end_month, download_end_year = get_data_download_dates()
+
+    for id_data in filter(None, prebuilt_bundles.split(';')):
+        ids = id_data.strip().split(',')
+        files = [get_download_file(data_id, download_end_month, download_end_year) for data_id in ids]
+        if all(os.path.exists(file) for file in files):
+            get_download_bundle(ids, files, data_version)
+            print(f"ZIP de descarga listo: {id_data.strip()}")
+
+###################################################################################################################################
+
+## Funcion is_bundle_current: Sirve para determinar si un ZIP de la cache corresponde a la version actual de los datos y si sus
+#  archivos no cambiaron desde que se genero.
+
+def is_bundle_current(bundle_info, data_version):
+    if not bundle_info.get('key', '').startswith(f'{data_version}|'):
+        return False
+    try:
+        files = [source[0] for source in bundle_info['sources']]
+        return get_bundle_sources(files) == bundle_info['sources']
+    except OSError:
+        return False
+
+###################################################################################################################################
+
+## Funcion get_bundle_sources: Sirve para obtener la firma de los archivos de un ZIP, es decir, la ruta, el tamaño y la fecha de
+#  modificacion (en nanosegundos) de cada uno.
+
+def get_bundle_sources(files):
+    sources = []
+    for file in files:
+        stat = os.stat(file)
+        sources.append([file, stat.st_size, stat.st_mtime_ns])
+    return sources
+
+###################################################################################################################################
+
+## Funciones read_bundle_info y remove_download_bundle: Sirven para leer el archivo JSON de un ZIP de la cache (si no existe o esta
+#  corrupto, se retorna un diccionario vacio), y para eliminar un ZIP de la cache junto con su archivo JSON (si otro proceso ya los
+#  elimino, se ignora).
+
+def read_bundle_info(bundle_info_file):
+    try:
+        with open(bundle_info_file, 'r') as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return {}
+
+
+def remove_download_bundle(bundle_file):
+    for file in [bundle_file, bundle_file[:-len('.zip')] + '.json']:
+        try:
+            os.remove(file)
+        except FileNotFoundError:
+            pass
+
+###################################################################################################################################
+
+## Funciones get_download_cache_dir y get_download_cache_max_bytes: Sirven para obtener la carpeta de la cache de descargas, y su
+#  tamaño maximo en bytes, que se toma de la variable "DOWNLOAD_CACHE_MAX_MB" del archivo ".env" (si no existe, se usa
+#  "DOWNLOAD_CACHE_MAX_MB").
+
+def get_download_cache_dir():
+    return os.path.expanduser(os.path.join('~', 'EHCPA_SPI', 'backend', 'src', 'output', 'download_cache'))
+
+
+def get_download_cache_max_bytes():
+    dotenv_path = os.path.expanduser(os.path.join('~', 'EHCPA_SPI', 'backend', 'src', 'credentials', '.env'))
+    load_dotenv(dotenv_path)
+    return int(float(os.getenv('DOWNLOAD_CACHE_MAX_MB') or DOWNLOAD_CACHE_MAX_MB) * 1024 * 1024)
@@ -0,0 +1,365 @@
+import os
+import re
+import csv
+import math
+import shutil
+import tempfile
+import datetime
+import numpy as np
+import rasterio
+import fiona
+import netCDF4
+from rasterio.features import geometry_mask
+from rasterio.windows import Window
+
+try:
+    from get_dates_v7 import get_month_name
+except ModuleNotFoundError:
+    from src.scripts.get_dates_v7 import get_month_name
+
+###################################################################################################################################
+
+## Configuracion de los recortes de descarga:
+#  - FIRST_DATE: Año y mes de la primera banda de los GeoTiff "all_bands" del PTM y del SPI (junio de 2000). La banda "i" (desde 0)
+#    corresponde al mes "i" posterior a esta fecha. Los GeoTiff del PMP y PMD no tienen eje temporal.
+#  - OUTPUT_FORMATS: Formatos de salida de los recortes, con su extension y su tipo MIME.
+
+FIRST_DATE = (2000, 6)
+
+OUTPUT_FORMATS = {
+    'tif': ('.tif', 'image/tiff'),
+    'nc': ('.nc', 'application/x-netcdf'),
+    'csv': ('.csv', 'text/csv'),
+}
+
+###################################################################################################################################
+
+## Funcion get_download_subset_params: Sirve para obtener los parametros de recorte de una solicitud de descarga ("request.args"):
+#  - "bbox": Rectangulo "lon_min,lat_min,lon_max,lat_max" en grados.
+#  - "polygon": Identificador del poligono, que es el nombre de una carpeta de "src/ShapeFiles" con el shapefile del mismo nombre
+#    (por ejemplo "Argentina", o el de una provincia agregada en "ShapeFiles/<nombre>/<nombre>.shp").
+#  - "start" y "end": Primer y ultimo mes ("YYYY-MM"), ambos incluidos.
+#  - "format": Formato de salida, "tif" (por defecto), "nc" o "csv".
+#  - Si la solicitud no tiene ningun parametro de recorte y el formato es "tif", se retorna None, y se descargan los archivos
+#    completos. Caso contrario se retorna un diccionario con los parametros.
+#  - Si algun parametro no es correcto se lanza un "ValueError" con el mensaje que se informa al usuario.
+
+def get_download_subset_params(args):
+    bbox = args.get('bbox')
+    polygon = args.get('polygon')
+    start = args.get('start')
+    end = args.get('end')
+    output_format = args.get('format', 'tif')
+
+    if not any([bbox, polygon, start, end]) and output_format == 'tif':
+        return None
+
+    if output_format not in OUTPUT_FORMATS:
+        raise ValueError(f"El formato {output_format} no es correcto, los formatos disponibles son: {', '.join(OUTPUT_FORMATS)}.")
+
+    if bbox:
+        try:
+            bbox = [float(value) for value in bbox.split(',')]
+        except ValueError:
+            bbox = None
+        if bbox is None or len(bbox) != 4 or bbox[0] >= bbox[2] or bbox[1] >= bbox[3]:
+            raise ValueError('El parametro "bbox" debe tener el formato "lon_min,lat_min,lon_max,lat_max".')
+
+    if polygon:
+        shp_file = get_polygon_file(polygon)
+        if shp_file is None:
+            raise ValueError(f'El poligono {polygon} no es correcto.')
+
+    start = parse_month(start, 'start') if start else None
+    end = parse_month(end, 'end') if end else None
+    if start and end and start > end:
+        raise ValueError('El parametro "start" debe ser anterior o igual al parametro "end".')
+
+    return {'bbox': bbox, 'polygon': polygon, 'start': start, 'end': end, 'format': output_format}
+
+###################################################################################################################################
+
+## Funcion build_download_subsets: Sirve para generar el recorte de cada archivo de descarga en una carpeta temporal propia de la
+#  solicitud (dentro de "output/download_subsets"), mediante "build_download_subset()".
+#  - Se retorna la carpeta y la lista de archivos generados. Quien la solicita debe eliminar la carpeta luego de abrirlos.
+#  - Si algun recorte falla (por ejemplo, porque el area o el periodo no tienen datos), se elimina la carpeta y se vuelve a lanzar
+#    el error.
+
+def build_download_subsets(files, params):
+    subsets_dir = os.path.expanduser(os.path.join('~', 'EHCPA_SPI', 'backend', 'src', 'output', 'download_subsets'))
+    os.makedirs(subsets_dir, exist_ok=True)
+
+    output_dir = tempfile.mkdtemp(dir=subsets_dir)
+    try:
+        output_files = [build_download_subset(file, params, output_dir) for file in files]
+    except Exception:
+        shutil.rmtree(output_dir, ignore_errors=True)
+        raise
+
+    return output_dir, output_files
+
+###################################################################################################################################
+
+## Funcion build_download_subset: Sirve para generar el recorte de un GeoTiff de descarga, leyendo solo la ventana y las bandas
+#  solicitadas, de a una banda por vez, por lo que la memoria utilizada depende del tamaño del recorte y no del archivo completo.
+#  1. Se calcula la ventana del recorte mediante "get_subset_window()" (interseccion del "bbox", del rectangulo que contiene al
+#     poligono y del raster), y la mascara del poligono sobre dicha ventana. Los pixeles fuera del poligono quedan con el valor
+#     "nodata" del archivo.
+#  2. Se calculan las bandas del periodo solicitado mediante "get_subset_bands()". Los archivos sin eje temporal (PMP y PMD) se
+#     recortan solo espacialmente.
+#  3. Se escribe el recorte en el formato solicitado, con un nombre que indica el periodo (por ejemplo
+#     "SPI_ene_2020_oct_2026_scale_3_subset.nc"), y se retorna su ruta.
+
+def build_download_subset(file_path, params, output_dir):
+    extension = OUTPUT_FORMATS[params['format']][0]
+
+    with rasterio.open(file_path) as src:
+        window, mask = get_subset_window(src, params['bbox'], params['polygon'])
+        bands, dates = get_subset_bands(src, file_path, params['start'], params['end'])
+
+        name = re.sub(r'_(all_bands_)?ARG_cropped\.tif$', '', os.path.basename(file_path))
+        if dates:
+            first_date, last_date = dates[0], dates[-1]
+            span = f'{get_month_name(first_date[1], True)}_{first_date[0]}_{get_month_name(last_date[1], True)}_{last_date[0]}'
+            name = re.sub(r'jun_2000_[a-z]+\.?_\d{4}', span, name)
+        output_file = os.path.join(output_dir, f'{name}_subset{extension}')
+
+        if params['format'] == 'tif':
+            write_subset_tif(src, window, mask, bands, dates, output_file)
+        elif params['format'] == 'nc':
+            write_subset_nc(src, window, mask, bands, dates, output_file)
+        else:
+            write_subset_csv(src, window, mask, bands, dates, output_file)
+
+    return output_file
+
+###################################################################################################################################
+
+## Funcion get_subset_window: Sirve para obtener la ventana del raster que cubre el "bbox" y el poligono solicitados, y la mascara
+#  del poligono sobre la misma (None si no se indico poligono).
+#  - La mascara incluye los pixeles cuyo centro cae dentro del poligono, el mismo criterio que "load_clip_mask()".
+#  - Si la ventana queda vacia (el area esta fuera del raster) se lanza un "ValueError".
+
+def get_subset_window(src, bbox, polygon):
+    window = Window(0, 0, src.width, src.height)
+    shapes = None
+
+    if bbox:
+        window = intersect_windows(window, get_bounds_window(src.transform, bbox))
+
+    if polygon:
+        with fiona.open(get_polygon_file(polygon), "r") as shapefile:
+            shapes = [feature["geometry"] for feature in shapefile]
+            polygon_bounds = shapefile.bounds
+        window = intersect_windows(window, get_bounds_window(src.transform, polygon_bounds))
+
+    if window is None:
+        raise ValueError('El area solicitada esta fuera del area de Argentina.')
+
+    mask = None
+    if shapes is not None:
+        mask = geometry_mask(
+            shapes,
+            out_shape=(int(window.height), int(window.width)),
+            transform=src.window_transform(window),
+            invert=True,
+        )
+        if not mask.any():
+            raise ValueError('El area solicitada esta fuera del area de Argentina.')
+
+    return window, mask
+
+###################################################################################################################################
+
+## Funcion get_bounds_window: Sirve para obtener la ventana de pixeles (redondeada hacia afuera) que cubre un rectangulo
+#  "lon_min,lat_min,lon_max,lat_max". Se calcula con las dos esquinas, ya que las filas del raster pueden estar ordenadas de sur a
+#  norte o de norte a sur.
+
+def get_bounds_window(transform, bounds):
+    col_1, row_1 = ~transform * (bounds[0], bounds[1])
+    col_2, row_2 = ~transform * (bounds[2], bounds[3])
+    col_off, row_off = math.floor(min(col_1, col_2)), math.floor(min(row_1, row_2))
+    return Window(col_off, row_off, math.ceil(max(col_1, col_2)) - col_off, math.ceil(max(row_1, row_2)) - row_off)
+
+###################################################################################################################################
+
+## Funcion intersect_windows: Sirve para obtener la interseccion de dos ventanas, o None si no se intersectan.
+
+def intersect_windows(window_1, window_2):
+    if window_1 is None:
+        return None
+    col_off = max(window_1.col_off, window_2.col_off)
+    row_off = max(window_1.row_off, window_2.row_off)
+    col_end = min(window_1.col_off + window_1.width, window_2.col_off + window_2.width)
+    row_end = min(window_1.row_off + window_1.height, window_2.row_off + window_2.height)
+    if col_end <= col_off or row_end <= row_off:
+        return None
+    return Window(col_off, row_off, col_end - col_off, row_end - row_off)
+
+###################################################################################################################################
+
+## Funcion get_subset_bands: Sirve para obtener las bandas (desde 1, como en "rasterio") del periodo entre "start" y "end", y la
+#  fecha (año, mes) de cada una.
+#  - Los GeoTiff "all_bands" (PTM y SPI) tienen una banda por mes desde "FIRST_DATE". Si el periodo no tiene bandas se lanza un
+#    "ValueError".
+#  - Los demas (PMP y PMD) no tienen eje temporal, por lo que se retornan todas sus bandas y None en las fechas.
+
+def get_subset_bands(src, file_path, start, end):
+    if '_all_bands_' not in os.path.basename(file_path):
+        return list(range(1, src.count + 1)), None
+
+    first_index = FIRST_DATE[0] * 12 + FIRST_DATE[1] - 1
+    start_band = max((start[0] * 12 + start[1] - 1) - first_index, 0) if start else 0
+    end_band = min((end[0] * 12 + end[1] - 1) - first_index, src.count - 1) if end else src.count - 1
+
+    if start_band > end_band:
+        raise ValueError('No hay datos disponibles en el periodo solicitado.')
+
+    bands = list(range(start_band + 1, end_band + 2))
+    dates = [divmod(first_index + band - 1, 12) for band in bands]
+    return bands, [(year, month + 1) for year, month in dates]
+
+###################################################################################################################################
+
+## Funcion get_subset_nodata: Sirve para obtener el valor "nodata" del recorte. Es el del archivo original y, si este no tiene, NaN 
+#  para los tipos de dato reales o el menor valor del tipo de dato para los enteros, ya que los pixeles fuera del poligono siempre 
+#  necesitan un valor "nodata".
+
+def get_subset_nodata(src):
+    if src.nodata is not None:
+        return src.nodata
+    if np.issubdtype(np.dtype(src.dtypes[0]), np.floating):
+        return np.nan
+    return np.iinfo(np.dtype(src.dtypes[0])).min
+
+###################################################################################################################################
+
+## Funcion read_subset_band: Sirve para leer una banda de la ventana del recorte, asignando el valor "nodata" del recorte (ver 
+#  "get_subset_nodata()") a los pixeles fuera de la mascara del poligono.
+
+def read_subset_band(src, band, window, mask):
+    data = src.read(band, window=window)
+    if mask is not None:
+        data[~mask] = get_subset_nodata(src)
+    return data
+
+###################################################################################################################################
+
+## Funcion read_subset_values: Sirve para leer una banda de la ventana del recorte como valores reales (float32), aplicando la 
+#  escala y el desplazamiento de la banda (por ejemplo, el SPI guardado como int16), y asignando NaN a los pixeles "nodata".
+
+def read_subset_values(src, band, window, mask):
+    raw = read_subset_band(src, band, window, mask)
+    data = raw.astype('float32') * np.float32(src.scales[band - 1]) + np.float32(src.offsets[band - 1])
+    nodata = get_subset_nodata(src)
+    if not np.isnan(nodata):
+        data[raw == nodata] = np.nan
+    return data
+
+###################################################################################################################################
+
+## Funcion write_subset_tif: Sirve para escribir el recorte como GeoTiff (comprimido con DEFLATE), de a una banda por vez. Se
+#  conservan los metadatos del archivo original, junto con la escala y el desplazamiento de cada banda, y el valor "nodata" del 
+#  recorte (ver "get_subset_nodata()"). Cada banda lleva como descripcion su fecha ("YYYY-MM").
+
+def write_subset_tif(src, window, mask, bands, dates, output_file):
+    profile = {
+        'driver': 'GTiff', 'dtype': src.dtypes[0], 'nodata': get_subset_nodata(src), 'crs': src.crs,
+        'transform': src.window_transform(window), 'width': int(window.width), 'height': int(window.height),
+        'count': len(bands), 'compress': 'DEFLATE',
+    }
+
+    with rasterio.open(output_file, 'w', **profile) as dst:
+        dst.update_tags(**src.tags())
+        dst.scales = tuple(src.scales[band - 1] for band in bands)
+        dst.offsets = tuple(src.offsets[band - 1] for band in bands)
+        for position, band in enumerate(bands, start=1):
+            dst.write(read_subset_band(src, band, window, mask), position)
+            if dates:
+                dst.set_band_description(position, f'{dates[position - 1][0]}-{dates[position - 1][1]:02d}')
+
+###################################################################################################################################
+
+## Funcion write_subset_nc: Sirve para escribir el recorte como NetCDF, con las dimensiones (time, lat, lon) (o (lat, lon) si el
+#  archivo no tiene eje temporal), de a una banda por vez. La latitud y longitud son las del centro de cada pixel, el tiempo el
+#  primer dia de cada mes, los valores se leen mediante "read_subset_values()" y los pixeles "nodata" se guardan como NaN. La 
+#  variable se llama "spi" o "precipitation" segun el archivo.
+
+def write_subset_nc(src, window, mask, bands, dates, output_file):
+    transform = src.window_transform(window)
+    height, width = int(window.height), int(window.width)
+    lat = transform.f + transform.e * (np.arange(height) + 0.5)
+    lon = transform.c + transform.a * (np.arange(width) + 0.5)
+    tags = src.tags()
+
+    with netCDF4.Dataset(output_file, 'w') as dst:
+        dst.createDimension('lat', height)
+        dst.createDimension('lon', width)
+        dst.createVariable('lat', 'f8', ('lat',))[:] = lat
+        dst.createVariable('lon', 'f8', ('lon',))[:] = lon
+        dst['lat'].units = 'degrees_north'
+        dst['lon'].units = 'degrees_east'
+
+        dimensions = ('lat', 'lon')
+        if dates:
+            dst.createDimension('time', len(dates))
+            time_var = dst.createVariable('time', 'i4', ('time',))
+            time_var.units = 'days since 1970-01-01'
+            time_var.calendar = 'standard'
+            time_var[:] = [(datetime.date(year, month, 1) - datetime.date(1970, 1, 1)).days for year, month in dates]
+            dimensions = ('time', 'lat', 'lon')
+
+        variable_name = 'spi' if os.path.basename(src.name).startswith('SPI') else 'precipitation'
+        variable = dst.createVariable(variable_name, 'f4', dimensions, zlib=True, fill_value=np.float32(np.nan))
+        for attribute in ['long_name', 'units']:
+            if attribute in tags:
+                variable.setncattr(attribute, tags[attribute])
+
+        for position, band in enumerate(bands):
+            data = read_subset_values(src, band, window, mask)
+            if dates:
+                variable[position] = data
+            else:
+                variable[:] = data
+
+###################################################################################################################################
+
+## Funcion write_subset_csv: Sirve para escribir el recorte como CSV, con una fila por pixel con datos (y por mes, si el archivo
+#  tiene eje temporal), con las columnas "date" ("YYYY-MM"), "lat", "lon" y "value". Se escribe de a una banda por vez, con los 
+#  valores leidos mediante "read_subset_values()", y se omiten los pixeles "nodata".
+
+def write_subset_csv(src, window, mask, bands, dates, output_file):
+    transform = src.window_transform(window)
+    lat = (transform.f + transform.e * (np.arange(int(window.height)) + 0.5)).round(4)
+    lon = (transform.c + transform.a * (np.arange(int(window.width)) + 0.5)).round(4)
+
+    with open(output_file, 'w', newline='') as f:
+        writer = csv.writer(f)
+        writer.writerow(['date', 'lat', 'lon', 'value'] if dates else ['lat', 'lon', 'value'])
+
+        for position, band in enumerate(bands):
+            data = read_subset_values(src, band, window, mask)
+            rows, cols = np.nonzero(~np.isnan(data))
+            values = data[rows, cols].astype('float64').round(4)
+
+            prefix = [f'{dates[position][0]}-{dates[position][1]:02d}'] if dates else []
+            writer.writerows(prefix + [lat[row], lon[col], value] for row, col, value in zip(rows, cols, values))
+
+###################################################################################################################################
+
+## Funciones get_polygon_file y parse_month: Sirven para obtener la ruta del shapefile de un poligono ("ShapeFiles/<id>/<id>.shp",
+#  o None si el identificador no es valido o el shapefile no existe), y para convertir un mes "YYYY-MM" en una tupla (año, mes),
+#  lanzando un "ValueError" si no tiene dicho formato.
+
+def get_polygon_file(polygon):
+    if not re.fullmatch(r'[A-Za-z0-9_-]+', polygon):
+        return None
+    shp_file = os.path.expanduser(os.path.join('~', 'EHCPA_SPI', 'backend', 'src', 'ShapeFiles', polygon, f'{polygon}.shp'))
+    return shp_file if os.path.exists(shp_file) else None
+
+
+def parse_month(value, name):
+    match = re.fullmatch(r'(\d{4})-(\d{2})', value)
+    if not match or not 1 <= int(match.group(2)) <= 12:
+        raise ValueError(f'El parametro "{name}" debe tener el formato "YYYY-MM".')
+    return int(match.group(1)), int(match.group(2))
@@ -1,13 +1,16 @@
-import sys
 import json
+import hashlib
+import random
 import urllib3
 import requests
 from urllib3.exceptions import MaxRetryError, NameResolutionError
 from urllib3.exceptions import TimeoutError as UrllibTimeoutError
 from requests.exceptions import Timeout as RequestsTimeoutError
 from requests.exceptions import HTTPError
+from requests.adapters import HTTPAdapter
+from concurrent.futures import ThreadPoolExecutor
 import certifi
-from time import sleep
+from time import sleep, monotonic
 from subprocess import Popen
 from getpass import getpass
 import platform
@@ -27,8 +30,13 @@ except ModuleNotFoundError:
 ## Funcion concat_reord: Sirve para descargar el subconjunto de datos de imagenes satelitales IMERG de precipitación diaria desde 
 #  la API de la NASA para un rango de fechas específico, y gestionar el almacenamiento y las credenciales de autenticación. 
 #  Por otro lado, se realiza un control de errores especificos y conocidos.
+#  - La funcion recibe ademas el parametro "max_workers", que indica la cantidad de archivos IMERG que se descargan en paralelo, y 
+#    "verify_checksum", que indica si los archivos ya presentes en "ARG_late" se verifican por checksum MD5 ademas de por tamaño.
+#  - El parametro "job_deadline" indica el tiempo maximo, en segundos, que se espera a que la API de la NASA complete la solicitud 
+#    del subset antes de abandonarla y reportar el error.
+#  - El parametro "results_page_size" indica la cantidad de resultados que se piden a la API en cada pagina de "GetResult".
 
-def download_subset(begTime, endTime, reset_ARG_late):
+def download_subset(begTime, endTime, reset_ARG_late, max_workers=4, verify_checksum=False, job_deadline=3600, results_page_size=100):
 
     ## Declaracion de variables/flags:
     #
@@ -74,33 +82,31 @@ def download_subset(begTime, endTime, reset_ARG_late):
     #     determinar el estado de la solicitud, construimos una nueva solicitud JSON que se envia como parametro nuevamente a la funcion 
     #     "get_http_data", utilizando el metodo "GetStatus" y asignando el identificador o el "JobID" para especificar que la informacion 
     #     solicitada es sobre la solicitud inicial. A continuacion, tenemos un bucle "while", el cual monitorea constantemente el estado de 
-    #     la solicitud. Este ciclo se ejecuta mientras el estado de la solicitud sea:
+    #     la solicitud, mediante la funcion "poll_subset_job()". Este ciclo se ejecuta mientras el estado de la solicitud sea:
     #     - "Accepted": Significa que la API acepto la solicitud pero no comenzo a procesarla.
     #     - "Running": Significa que la API esta procesando la solicitud.
-    #     Entonces, cada 5 segundos, nuestro programa envia la solicitud "GetStatus" a la API para verificar el estado de la solicitud. Esto 
-    #     es asi para no saturar el servidor. La respuesta de la solicitud "GetStatus" incluye ademas del estado, un porcentaje del avance 
-    #     del proceso. El ciclo terminna cuando el estado de la solicitud es:
+    #     Entonces, nuestro programa envia la solicitud "GetStatus" a la API para verificar el estado de la solicitud, esperando entre 
+    #     cada consulta un tiempo que crece de forma exponencial (con una variacion aleatoria), para no saturar el servidor. La respuesta 
+    #     de la solicitud "GetStatus" incluye ademas del estado, un porcentaje del avance del proceso. El ciclo termina cuando el estado 
+    #     de la solicitud es:
     #     - "Succeeded": Es decir, la solicitud del subset a la API de la NASA se completo correctamente. 
-    #     - "Failed": Significa que algo salio mal y termina el programa (VERIFICAR ESTO).
+    #     - "Failed": Significa que algo salio mal.
+    #     o cuando se supera el tiempo maximo "job_deadline". En los dos ultimos casos se setea la bandera "error_found" como "True", se 
+    #     setea el mensaje del error en "error_message", se lo imprime y se retorna, sin finalizar el programa.
     #  4. Obtencion de los resultados de la solicitud: Una vez que la solicitud del subset a la API se completo con exito, creamos una nueva 
     #     solicitud JSON para pasar como parametro a la funcion "get_http_data" para poder obtener los resultados. En dicho JSON utilizamos 
     #     el metodo "GetResult", e indicamos que queremos obtener los resultados de la solicitud inicial mediante el "JobID", luego definimos 
-    #     que vamos a obtener los resultados en bloques de a 20 para evitar sobrecargargas, e indicamos desde que posicion queremos empezar a 
+    #     que vamos a obtener los resultados en paginas de "results_page_size" elementos, e indicamos desde que posicion queremos empezar a 
     #     recuperar los resultados, en este caso se indica 0, lo que indica que se descargaran los 2 primeros PDF y luego el dato. 
-    #     Inicializamos una lista vacia donde se van a almacenar los resultados que obtenemos de la API, e inicializamos un contador para contar 
-    #     cuantos resultados obtenemos. El ciclo "while" nos sirve para controla r que hayamos recibido todos los resultados, en donde se envia 
-    #     la solicitud "GetResult" a la funcion "get_http_data", obteniendo un nuevo bloque de resultados, luego se actualiza el contador con 
-    #     el numero de resultados obtenidos en la solicitud "GetResult", y se añaden dichos resultados a la lista. Por ultimo, se muestra por 
-    #     consola cuantos resultados obtuvimos finalmente, respecto a cuantos resultados esperabamos recibir en total.
-    #  5. Recuperacion de los resultados de la solicitud: Enviamos una solicitud HTTP GET a la API de la NASA, utilizando el "JobID" de la 
-    #     solicitud inicial para recuperar una lista de resultados en texto sin formato de una sola vez. Verificamos que la solicitud GET sea 
-    #     exitosa, en donde en caso de que la respuesta tenga un estado 200, se devuelve una lista de URLs que son en definitiva el resultado 
-    #     de la solicitud, es decir, datos del subset solicitado inicialmente. En caso de que la solicitud GET no se exitosa se imprime el 
-    #     mensaje de error con su estado. Luego, dividimos los resultados en documentos (PDF) y URLs, a traves de un bucle que recorre todos 
-    #     los elementos de la lista de resultados, y verifica que si el elemento de la lista contiene datos relacionados con las fechas de inicio 
-    #     y fin (start y end), se lo agrega a la lista de URLs ya que son elementos a descargar, caso contrario, el elemento se añade a la lista 
-    #     de documentos para ser ignorados. Finalmente, se imprimen los enlaces de los documentos PDF que se obtuvieron, pero como dijimos 
-    #     anteriormente, estos no nos interesan y se ignoran en la descarga.
+    #     La primera pagina nos indica el total de resultados esperados ("totalResults") y la cantidad de resultados por pagina que 
+    #     efectivamente entrega la API (que puede ser menor a la pedida), por lo que el resto de las paginas se solicitan en paralelo 
+    #     mediante "get_result_pages()", y se añaden a la lista de resultados en el orden original. Por ultimo, se muestra por consola 
+    #     cuantos resultados obtuvimos finalmente, respecto a cuantos resultados esperabamos recibir en total.
+    #  5. Separacion de los resultados de la solicitud: Dividimos los resultados en documentos (PDF) y URLs, a traves de un bucle que 
+    #     recorre todos los elementos de la lista de resultados, y verifica que si el elemento de la lista contiene datos relacionados con 
+    #     las fechas de inicio y fin (start y end), se lo agrega a la lista de URLs ya que son elementos a descargar, caso contrario, el 
+    #     elemento se añade a la lista de documentos para ser ignorados. Finalmente, se imprimen los enlaces de los documentos PDF que se 
+    #     obtuvieron, pero como dijimos anteriormente, estos no nos interesan y se ignoran en la descarga.
 
         http = urllib3.PoolManager(cert_reqs='CERT_REQUIRED',ca_certs=certifi.where())
 
@@ -157,56 +163,39 @@ def download_subset(begTime, endTime, reset_ARG_late):
             'args': {'jobId': myJobId}
         }
 
-        while response['result']['Status'] in ['Accepted', 'Running']:
-            sleep(5)
-            response = get_http_data(status_request)
-            status  = response['result']['Status']
-            percent = response['result']['PercentCompleted']
-            print ('Job status: %s (%d%c complete)' % (status,percent,'%'))
+        job_status, response = poll_subset_job(get_http_data, status_request, response, deadline=job_deadline)
 
-        if response['result']['Status'] == 'Succeeded' :
+        if job_status == 'Succeeded' :
             print ('Job Finished:  %s' % response['result']['message'])
         else :
-            print('Job Failed: %s' % response['fault']['code'])
-            sys.exit(1)
+            error_found = True
+            error_message = get_subset_job_error_message(myJobId, job_status, response, job_deadline)
+            print(error_message)
+            return error_found, error_message
 
 
 
-        batchsize = 20
         results_request = {
             'methodname': 'GetResult',
             'version': '1.0',
             'type': 'jsonwsp/request',
             'args': {
                 'jobId': myJobId,
-                'count': batchsize,
+                'count': results_page_size,
                 'startIndex': 0
             }
         }
 
         results = []
-        count = 0
         response = get_http_data(results_request)
-        count = count + response['result']['itemsPerPage']
         results.extend(response['result']['items'])
 
         total = response['result']['totalResults']
-        while count < total :
-            results_request['args']['startIndex'] += batchsize
-            response = get_http_data(results_request)
-            count = count + response['result']['itemsPerPage']
-            results.extend(response['result']['items'])
+        page_size = response['result']['itemsPerPage'] or results_page_size
+        start_indexes = range(page_size, total, page_size)
+        results.extend(get_result_pages(get_http_data, myJobId, start_indexes, page_size, max_workers))
 
         print('Retrieved %d out of %d expected items' % (len(results), total))
-        
-        nasa_api_jobs_result = os.getenv('NASA_API_JOBS_RESULT')
-        result = requests.get(nasa_api_jobs_result+myJobId)
-        try:
-            result.raise_for_status()
-            urls = result.text.split('\n')
-            for i in urls : print('\n%s' % i)
-        except :
-            print('Request returned error code %d' % result.status_code)
 
         docs = []
         urls = []
@@ -276,6 +265,9 @@ def download_subset(begTime, endTime, reset_ARG_late):
     ## PASO 3: Proceso de descarga de las imagenes IMERG.
     #          
     #  - download_dir: Carpeta donde se almacenaran las imagenes satelitales IMERG de precipitacion diaria, luego de ser descargadas.
+    #  - download_cache_dir: Carpeta donde se guarda el cache de descargas ("download_cache.json"), con el tamaño y checksum MD5 de 
+    #    cada archivo IMERG descargado por completo, y la subcarpeta "partial" con las descargas en curso o interrumpidas. Se mantiene 
+    #    separada de "ARG_late" para que los archivos parciales nunca sean tomados como archivos IMERG validos.
     #          
     #  1. Formateo de carpeta ARG_late: en caso de que la variable "reset_ARG_late", pasada por parametro a la funcion, sea "True", 
     #     se verifica:
@@ -287,13 +279,17 @@ def download_subset(begTime, endTime, reset_ARG_late):
     #       - Si el directorio no existe, directamente se crea.
     #     - Si hoy no es la fecha de formateo se emite un mensaje y no se borra la carpeta "ARG_late".
     #     Pero si la variable es "False" no se realizan las verificaciones anteriores y simplemente se procede a realizar la descarga.  
-    #  2. Descarga de archivos: Como primera medida se imprime un mensaje indicando que se va a mostrar la salida de los servicios HTTP, 
-    #     luego iteramos sobre cada URL de la lista de URLs obtenidas del subset, extrayendo de cada una el enlace o link y guardandolo 
-    #     en una variable URL. Con "requests.get(URL)", realizamos una solicitud HTTP GET a la URL tomada en la iteracion para descargar 
-    #     el contenido del mismo. Se verifica si la solicitud fue exitosa, y si el código de estado HTTP indica un error (cualquier valor 
-    #     distinto de 200), se lanza una excepcion. Todos los archivos se van a guardar en el directorio "ARG_late", por lo tanto se crea 
-    #     un archivo con dicha ruta, y se lo abre en modo escritura binaria con "wb", para escribir sobre el contenido del archivo 
-    #     descargado mediante la operacion la operacion "write", y luego se imprime el nombre del archivo creado.
+    #  2. Descarga de archivos: Como primera medida se imprime un mensaje indicando que se va a mostrar la salida de los servicios HTTP. 
+    #     Creamos una sesion HTTP ("requests.Session") con un pool de "max_workers" conexiones, que se reutiliza en todas las descargas 
+    #     (incluidas las cookies de autenticacion de Earthdata), y un grupo de "max_workers" hilos ("ThreadPoolExecutor"). Para cada 
+    #     URL de la lista de URLs obtenidas del subset, se extrae el enlace o link y se descarga en un hilo mediante "download_granule()", 
+    #     que escribe el contenido por bloques, sin mantener el archivo completo en memoria. Si el archivo ya esta completo en "ARG_late" 
+    #     segun el cache de descargas, no se vuelve a descargar. Si una descarga anterior quedo interrumpida, se reanuda desde el ultimo 
+    #     byte recibido. Al finalizar, se actualiza el cache de descargas con los archivos descargados.
+    #  3. Recorremos los resultados en el mismo orden que las URLs. Si la descarga fue exitosa se imprime el nombre del archivo creado. 
+    #     Si el código de estado HTTP indica un error (cualquier valor distinto de 200), se agrega la URL a la lista de URLs fallidas y 
+    #     se arma el mensaje de error. Los demas errores (por ejemplo, de conexion o de tiempo de espera) se relanzan al obtener el 
+    #     resultado del hilo, y son capturados por el manejo de errores de la funcion.
 
         download_dir = os.path.expanduser(os.path.join('~', 'EHCPA_SPI', 'backend', 'src', 'ARG_late'))
 
@@ -316,39 +312,73 @@ def download_subset(begTime, endTime, reset_ARG_late):
                 print(f"Hoy no es {ARG_late_reset_date}, por ende la carpeta ARG_late no sera formateada.")
         
 
+        download_cache_dir = os.path.expanduser(os.path.join('~', 'EHCPA_SPI', 'backend', 'src', 'ARG_late_download_cache'))
+        partial_dir = os.path.join(download_cache_dir, 'partial')
+
+        if not os.path.exists(partial_dir):
+            os.makedirs(partial_dir)
+
+        download_cache_file = os.path.join(download_cache_dir, 'download_cache.json')
+        download_cache = read_download_cache(download_cache_file)
+
         print('\nHTTP_services output:')
         failed_urls = []
-        for item in urls :
-            URL = item['link']
-            result = requests.get(URL)
-            try:
-                result.raise_for_status()
-                ##outfn = item['label']
-                ##f = open(outfn,'wb')
-                ##f.write(result.content)
-                ##f.close()
-                ##print(outfn)
-
-                outfn = os.path.join(download_dir, item['label'])
-                
-                with open(outfn, 'wb') as f:
-                    f.write(result.content)
-                print(outfn)
-
-                downloaded_files += 1
-            except HTTPError as http_err:
-                error_found = True
-                failed_urls.append(URL)
-                failed_urls_content = '\n'.join(failed_urls) 
-                error_message = (
-                    f"HTTPError: Error en la descarga de archivos IMERG.\n"
-                    f"- Descripción: Ocurrió un error de autenticación durante la descarga de los siguientes archivos IMERG del subset:\n"
-                    f"{failed_urls_content}\n"
-                    f"- Ayuda para descargar datos en:\n"
-                    f"https://disc.gsfc.nasa.gov/information/documents?title=Data%20Access\n"
-                    f"- Detalles: {http_err}\n"
-                )
-                print('Error! Status code is %d for this URL:\n%s' % (result.status_code,URL))
+
+        session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=max_workers, pool_maxsize=max_workers)
+        session.mount('https://', adapter)
+        session.mount('http://', adapter)
+
+        ## Los resultados de cada descarga se procesan a medida que se obtienen, y el cache de descargas se guarda en el bloque 
+        #  "finally", por lo que los archivos ya descargados quedan registrados aunque alguna descarga falle con un error que no sea
+        #  HTTP (por ejemplo, un error de conexion). Dicho error se relanza luego de procesar el resto de las descargas, para que lo 
+        #  capturen los manejadores de errores de la funcion. Solo se cuentan en "downloaded_files" los archivos descargados, y no los 
+        #  que ya estaban completos.
+
+        worker_error = None
+        try:
+            with session, ThreadPoolExecutor(max_workers=max_workers) as executor:
+                futures = [
+                    (item['link'], executor.submit(
+                        download_granule, session, item['link'], os.path.join(download_dir, item['label']),
+                        os.path.join(partial_dir, item['label'] + '.part'), download_cache.get(item['label']), verify_checksum
+                    ))
+                    for item in urls
+                ]
+
+                for URL, future in futures:
+                    try:
+                        outfn, status_code, http_err, file_info = future.result()
+                    except Exception as e:
+                        worker_error = worker_error or e
+                        continue
+
+                    if http_err is None:
+                        if file_info is None:
+                            print(f"{outfn} (ya descargado, se omite)")
+                        else:
+                            download_cache[os.path.basename(outfn)] = file_info
+                            downloaded_files += 1
+                            print(outfn)
+                    else:
+                        error_found = True
+                        failed_urls.append(URL)
+                        failed_urls_content = '\n'.join(failed_urls) 
+                        error_message = (
+                            f"HTTPError: Error en la descarga de archivos IMERG.\n"
+                            f"- Descripción: Ocurrió un error de autenticación durante la descarga de los siguientes archivos IMERG del subset:\n"
+                            f"{failed_urls_content}\n"
+                            f"- Ayuda para descargar datos en:\n"
+                            f"https://disc.gsfc.nasa.gov/information/documents?title=Data%20Access\n"
+                            f"- Detalles: {http_err}\n"
+                        )
+                        print('Error! Status code is %d for this URL:\n%s' % (status_code,URL))
+        finally:
+            write_download_cache(download_cache_file, download_cache)
+
+        if worker_error is not None:
+            raise worker_error
+
         if error_found:
             print(error_message)
 
@@ -426,6 +456,249 @@ def download_subset(begTime, endTime, reset_ARG_late):
 
 
 
+###################################################################################################################################
+
+## Funcion poll_subset_job: Sirve para monitorear el estado de la solicitud del subset a la API de la NASA hasta que la misma termine.
+#  1. La funcion recibe como parametros la funcion que envia la solicitud JSON WSP ("get_http_data", o una equivalente que apunte a 
+#     un servicio local para pruebas), la solicitud "GetStatus", la respuesta inicial de la API, el intervalo inicial y maximo de 
+#     espera entre consultas, el factor de crecimiento del intervalo y el tiempo maximo total de espera ("deadline"), en segundos.
+#  2. Mientras el estado sea "Accepted" o "Running", se espera el intervalo actual, con una variacion aleatoria de hasta un 20% 
+#     (jitter), para no consultar al servidor siempre al mismo ritmo, y se envia la solicitud "GetStatus". Luego de cada consulta, 
+#     el intervalo se multiplica por "backoff", sin superar "max_interval". La espera nunca supera el tiempo que resta hasta el 
+#     "deadline".
+#  3. Se retorna el estado final y la ultima respuesta de la API. El estado puede ser "Succeeded", "Failed" (o cualquier otro estado 
+#     final informado por la API), o "Timeout" si se supero el "deadline" sin que la solicitud termine.
+
+def poll_subset_job(get_http_data, status_request, response, initial_interval=5, max_interval=60, backoff=2, deadline=3600):
+    start_time = monotonic()
+    interval = initial_interval
+
+    while response['result']['Status'] in ['Accepted', 'Running']:
+        remaining = deadline - (monotonic() - start_time)
+        if remaining <= 0:
+            return 'Timeout', response
+
+        sleep(min(interval * random.uniform(0.8, 1.2), remaining))
+
+        response = get_http_data(status_request)
+        status  = response['result']['Status']
+        percent = response['result']['PercentCompleted']
+        print ('Job status: %s (%d%c complete)' % (status,percent,'%'))
+
+        interval = min(interval * backoff, max_interval)
+
+    return response['result']['Status'], response
+
+###################################################################################################################################
+
+## Funcion get_subset_job_error_message: Sirve para armar el mensaje de error cuando la solicitud del subset no se completa, ya sea 
+#  porque la API informo que fallo o porque se supero el tiempo maximo de espera.
+
+def get_subset_job_error_message(job_id, job_status, response, job_deadline):
+    if job_status == 'Timeout':
+        return (
+            f"TimeoutError: La solicitud del subset no se completó.\n"
+            f"- Descripción: La solicitud del subset (Job ID: {job_id}) a la API de la NASA no finalizó dentro del tiempo límite de {job_deadline} segundos.\n"
+            f"- Verificar estado del sitio GES DISC en:\n"
+            f"https://disc.gsfc.nasa.gov/datasets/GPM_3IMERGDL_07/summary?keywords=imerg\n"
+            f"- Detalles: Último estado informado: {response['result'].get('Status')}\n"
+        )
+
+    details = response.get('fault', {}).get('code') or response['result'].get('message')
+    return (
+        f"API Error: La solicitud del subset falló.\n"
+        f"- Descripción: La API de la NASA informó el estado {job_status} para la solicitud del subset (Job ID: {job_id}).\n"
+        f"- Verificar estado del sitio GES DISC en:\n"
+        f"https://disc.gsfc.nasa.gov/datasets/GPM_3IMERGDL_07/summary?keywords=imerg\n"
+        f"- Detalles: {details}\n"
+    )
+
+###################################################################################################################################
+
+## Funcion get_result_pages: Sirve para obtener en paralelo las paginas restantes de resultados de la solicitud del subset.
+#  - La funcion recibe como parametros la funcion que envia la solicitud JSON WSP, el "JobID", las posiciones de inicio de cada 
+#    pagina, la cantidad de resultados por pagina y la cantidad de solicitudes simultaneas.
+#  - Para cada posicion de inicio se arma una solicitud "GetResult" propia y se envia en un hilo. Los resultados se retornan en el 
+#    mismo orden de las paginas, y los errores de una solicitud se relanzan al obtener el resultado de su hilo.
+
+def get_result_pages(get_http_data, job_id, start_indexes, page_size, max_workers=4):
+    def get_page(start_index):
+        results_request = {
+            'methodname': 'GetResult',
+            'version': '1.0',
+            'type': 'jsonwsp/request',
+            'args': {
+                'jobId': job_id,
+                'count': page_size,
+                'startIndex': start_index
+            }
+        }
+        return get_http_data(results_request)['result']['items']
+
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        pages = list(executor.map(get_page, start_indexes))
+
+    return [item for page in pages for item in page]
+
+###################################################################################################################################
+
+## Funcion download_granule: Sirve para descargar un archivo IMERG del subset.
+#  1. La funcion recibe como parametros la sesion HTTP compartida, la URL del archivo, la ruta de destino, la ruta del archivo 
+#     parcial, la informacion del cache de descargas para dicho archivo (o None), si se verifica el checksum y el tamaño de bloque.
+#  2. Si el archivo de destino ya esta completo segun "is_granule_complete()", no se descarga y se retorna sin informacion nueva.
+#  3. Si existe un archivo parcial de una descarga interrumpida, realizamos la solicitud HTTP GET con el encabezado "Range" para 
+#     pedir solo los bytes faltantes, junto con el encabezado "If-Range" con el validador (ETag o Last-Modified) que el servidor 
+#     informo al comenzar la descarga, guardado junto al archivo parcial (ver "read_partial_validator()"). Asi, el servidor solo 
+#     responde 206 (contenido parcial) si el archivo no cambio, y se continua escribiendo al final del archivo parcial. Si el archivo 
+#     cambio (o el servidor no admite "Range") responde 200 con el archivo completo, que se escribe desde el principio, por lo que 
+#     nunca se mezclan partes de dos versiones del archivo. Si el archivo parcial no tiene validador, se descarga de nuevo completo. 
+#     Si responde 416 (rango no valido), se borra el archivo parcial y se descarga de nuevo completo.
+#  4. La solicitud se realiza en modo "stream", para que el contenido no se descargue completo en memoria, y verificamos que fue 
+#     exitosa con "raise_for_status()". Luego escribimos el contenido en el archivo parcial por bloques, y al finalizar se renombra 
+#     al archivo de destino con "os.replace", de forma que en "ARG_late" nunca quede un archivo a medio escribir.
+#  5. Se retorna la ruta del archivo, el codigo de estado HTTP, el error HTTP (None si la descarga fue exitosa) y la informacion 
+#     para el cache de descargas (tamaño y checksum MD5), que es None si el archivo no se descargo.
+
+def download_granule(session, URL, outfn, partfn, cached_info=None, verify_checksum=False, chunk_size=1024 * 1024):
+    if is_granule_complete(session, URL, outfn, cached_info, verify_checksum):
+        return outfn, 200, None, None
+
+    validator_file = partfn + '.json'
+    offset = os.path.getsize(partfn) if os.path.exists(partfn) else 0
+    validator = read_partial_validator(validator_file) if offset > 0 else None
+    headers = {'Range': f'bytes={offset}-', 'If-Range': validator} if validator else {}
+
+    with session.get(URL, stream=True, timeout=60, headers=headers) as result:
+        if result.status_code == 416 and headers:
+            os.remove(partfn)
+            write_partial_validator(validator_file, None)
+            return download_granule(session, URL, outfn, partfn, None, verify_checksum, chunk_size)
+
+        try:
+            result.raise_for_status()
+        except HTTPError as http_err:
+            return outfn, result.status_code, http_err, None
+
+        if result.status_code == 206 and headers:
+            mode = 'ab'
+        else:
+            mode = 'wb'
+            write_partial_validator(validator_file, get_response_validator(result))
+
+        with open(partfn, mode) as f:
+            for chunk in result.iter_content(chunk_size=chunk_size):
+                f.write(chunk)
+
+        status_code = result.status_code
+
+    file_info = {'size': os.path.getsize(partfn), 'md5': get_file_md5(partfn)}
+    os.replace(partfn, outfn)
+    write_partial_validator(validator_file, None)
+
+    return outfn, status_code, None, file_info
+
+###################################################################################################################################
+
+## Funciones get_response_validator, read_partial_validator y write_partial_validator: Sirven para obtener y guardar el validador 
+#  de la version del archivo que se esta descargando, que se envia en el encabezado "If-Range" al continuar una descarga.
+#  - get_response_validator: Retorna el ETag de la respuesta, si es un ETag fuerte (los ETag debiles, "W/...", no se admiten en 
+#    "If-Range"), o caso contrario su fecha "Last-Modified". Si el servidor no informa ninguno, retorna None.
+#  - El validador se guarda en un archivo JSON junto al archivo parcial ("<archivo>.part.json"), primero con un nombre temporal y 
+#    luego se renombra. Si el validador es None, el archivo se elimina, y la descarga no se podra continuar.
+#  - Si el archivo no existe o esta corrupto, "read_partial_validator()" retorna None.
+
+def get_response_validator(response):
+    etag = response.headers.get('ETag')
+    if etag and not etag.startswith('W/'):
+        return etag
+    return response.headers.get('Last-Modified')
+
+
+def read_partial_validator(validator_file):
+    try:
+        with open(validator_file, 'r') as f:
+            return json.load(f).get('if_range')
+    except (OSError, ValueError):
+        return None
+
+
+def write_partial_validator(validator_file, validator):
+    if validator is None:
+        if os.path.exists(validator_file):
+            os.remove(validator_file)
+        return
+
+    temp_file = validator_file + '.TMP'
+    with open(temp_file, 'w') as f:
+        json.dump({'if_range': validator}, f)
+    os.replace(temp_file, validator_file)
+
+###################################################################################################################################
+
+## Funcion is_granule_complete: Sirve para determinar si un archivo IMERG ya esta descargado por completo en "ARG_late".
+#  - Si el archivo no existe, no esta completo.
+#  - Si el archivo figura en el cache de descargas, se compara su tamaño con el registrado y, si "verify_checksum" es "True", 
+#    tambien su checksum MD5.
+#  - Si el archivo existe pero no figura en el cache (por ejemplo, fue descargado antes de que existiera el cache), se consulta el 
+#    tamaño en el servidor con una solicitud HTTP HEAD, sin descargar el contenido. Si el servidor no informa el tamaño, el archivo 
+#    se considera incompleto y se vuelve a descargar.
+
+def is_granule_complete(session, URL, outfn, cached_info, verify_checksum):
+    if not os.path.exists(outfn):
+        return False
+
+    size = os.path.getsize(outfn)
+
+    if cached_info is not None:
+        if size != cached_info.get('size'):
+            return False
+        return not verify_checksum or get_file_md5(outfn) == cached_info.get('md5')
+
+    try:
+        head = session.head(URL, allow_redirects=True, timeout=60)
+        head.raise_for_status()
+    except HTTPError:
+        return False
+
+    content_length = head.headers.get('Content-Length')
+    return content_length is not None and int(content_length) == size
+
+###################################################################################################################################
+
+## Funcion get_file_md5: Sirve para calcular el checksum MD5 de un archivo, leyendolo por bloques.
+
+def get_file_md5(file_path, chunk_size=1024 * 1024):
+    md5 = hashlib.md5()
+    with open(file_path, 'rb') as f:
+        for chunk in iter(lambda: f.read(chunk_size), b''):
+            md5.update(chunk)
+    return md5.hexdigest()
+
+###################################################################################################################################
+
+## Funciones read_download_cache y write_download_cache: Sirven para leer y guardar el cache de descargas, es decir, el diccionario 
+#  con el nombre de cada archivo IMERG descargado por completo (el "label" del subset) y su tamaño y checksum MD5.
+#  - Si el cache no existe o esta corrupto, se retorna un diccionario vacio.
+#  - El cache se escribe primero con un nombre temporal y luego se renombra, para que nunca quede a medio escribir.
+
+def read_download_cache(download_cache_file):
+    try:
+        with open(download_cache_file, 'r') as f:
+            return json.load(f).get('granules', {})
+    except (OSError, ValueError):
+        return {}
+
+
+def write_download_cache(download_cache_file, download_cache):
+    temp_file = download_cache_file + '.TMP'
+    with open(temp_file, 'w') as f:
+        json.dump({'granules': download_cache}, f, indent=2, sort_keys=True)
+    os.replace(temp_file, download_cache_file)
+
+
+
+
+
 if __name__ == '__main__':
     
     print("Ingrese fecha de inicio (begTime):")
@@ -0,0 +1,303 @@
+import os
+import glob
+import zipfile
+import numpy as np
+import rasterio
+from datetime import datetime
+from dateutil.relativedelta import relativedelta
+
+try:
+    from wait_until_v7 import wait_for_geoserver_resource
+except ModuleNotFoundError:
+    from src.scripts.wait_until_v7 import wait_for_geoserver_resource
+
+###################################################################################################################################
+
+## Configuracion de los mosaicos:
+#  - MOSAIC_START_DATE: Mes de la primera banda de los archivos de todas las bandas (junio de 2000). La banda "i" corresponde al mes
+#    "MOSAIC_START_DATE + i meses", por lo que cada granulo (una banda guardada como GeoTiff) se nombra con su año y mes ("YYYYMM").
+#  - TIME_REGEX y SCALE_REGEX: Expresiones regulares con las que GeoServer extrae, del nombre de cada granulo, la fecha (dimension
+#    "time") y la escala del SPI (dimension "scale").
+#  - PTM_INDEXER y SPI_INDEXER: Configuracion del indice de cada mosaico ("indexer.properties"). El mosaico del PTM tiene solo la
+#    dimension temporal, y el del SPI tiene ademas la dimension de la escala, por lo que todas las escalas se publican en una sola
+#    capa.
+
+MOSAIC_START_DATE = datetime(2000, 6, 1)
+
+TIME_REGEX = 'regex=[0-9]{6}(?=\\.tif),format=yyyyMM\n'
+SCALE_REGEX = 'regex=(?<=scale_)[0-9]+(?=_)\n'
+
+PTM_INDEXER = (
+    'TimeAttribute=time\n'
+    'Schema=*the_geom:Polygon,location:String,time:java.util.Date\n'
+    'PropertyCollectors=TimestampFileNameExtractorSPI[timeregex](time)\n'
+    'AbsolutePath=false\n'
+    'Caching=false\n'
+)
+
+SPI_INDEXER = (
+    'TimeAttribute=time\n'
+    'AdditionalDomainAttributes=scale\n'
+    'Schema=*the_geom:Polygon,location:String,time:java.util.Date,scale:Integer\n'
+    'PropertyCollectors=TimestampFileNameExtractorSPI[timeregex](time),IntegerFileNameExtractorSPI[scaleregex](scale)\n'
+    'AbsolutePath=false\n'
+    'Caching=false\n'
+)
+
+###################################################################################################################################
+
+## Funcion geoserver_mosaic_upload: Sirve para publicar el PTM y el SPI en GeoServer como dos capas ImageMosaic con dimension
+#  temporal ("PTM_Mosaic" y "SPI_Mosaic", esta ultima con la dimension adicional "scale"), en lugar de una capa por archivo de la
+#  ultima banda. Cada mes es un granulo del mosaico, por lo que el frontend puede solicitar cualquier mes de la serie mediante el
+#  parametro "TIME" (y la escala mediante "DIM_SCALE"), y la publicacion diaria solo envia los granulos nuevos o modificados.
+#  - La funcion recibe como parametros la sesion HTTP autenticada con la que se realizan todas las solicitudes, la URL de GeoServer y
+#    el espacio de trabajo, ya creado y disponible (ver "geoserver_upload()").
+#
+#  PROCEDIMIENTO:
+#  1. Para cada mosaico, se generan los granulos a partir de los archivos de todas las bandas mediante "write_mosaic_granules()", que
+#     solo escribe los meses nuevos o cuyos valores cambiaron (normalmente, solo el mes en curso).
+#  2. Si el mosaico no existe en GeoServer, se crea con un unico archivo ZIP que contiene la configuracion del indice y todos los
+#     granulos, se habilitan sus dimensiones y se publica su estilo, mediante "create_mosaic_store()".
+#  3. Si el mosaico ya existe, se consultan los granulos que tiene su indice, y se envian en un unico archivo ZIP los granulos que
+#     faltan o que cambiaron, mediante "harvest_mosaic_granules()". Los granulos que cambiaron se quitan previamente del indice.
+#  4. Recien cuando GeoServer confirma la publicacion, los granulos nuevos reemplazan a los anteriores en la carpeta local, de modo
+#     que si la publicacion falla, se vuelven a enviar en la siguiente ejecucion.
+
+def geoserver_mosaic_upload(session, url, workspace_name):
+
+    ## Distribucion de carpetas/directorios:
+    #
+    #   - downloable_data_PTM_dir y downloable_data_SPI_dir: Carpetas donde se encuentran los archivos de PTM y SPI de todas las
+    #     bandas, de los que se extraen los granulos.
+    #   - mosaic_dir: Carpeta donde se guardan los granulos publicados de cada mosaico, en las subcarpetas "PTM" y "SPI".
+
+    downloable_data_dir = os.path.expanduser(os.path.join('~', 'EHCPA_SPI', 'backend', 'src', 'output', 'downloable_data'))
+    downloable_data_PTM_dir = os.path.join(downloable_data_dir, 'PTM')
+    downloable_data_SPI_dir = os.path.join(downloable_data_dir, 'SPI')
+
+    mosaic_dir = os.path.expanduser(os.path.join('~', 'EHCPA_SPI', 'backend', 'src', 'output', 'geoserver', 'mosaic'))
+
+    spi_scales = ['1', '2', '3', '6', '9', '12', '24', '36', '48', '60', '72']
+
+    mosaics = [
+        {
+            'store_name': 'PTM_Mosaic',
+            'style_name': 'PTM_Style',
+            'granule_dir': os.path.join(mosaic_dir, 'PTM'),
+            'sources': [(get_all_bands_tif(downloable_data_PTM_dir, 'PTM_jun_2000_*_all_bands_ARG_cropped.tif'), 'PTM')],
+            'config_files': {'indexer.properties': PTM_INDEXER, 'timeregex.properties': TIME_REGEX},
+            'custom_dimensions': [],
+        },
+        {
+            'store_name': 'SPI_Mosaic',
+            'style_name': 'SPI_Style',
+            'granule_dir': os.path.join(mosaic_dir, 'SPI'),
+            'sources': [
+                (get_all_bands_tif(downloable_data_SPI_dir, f'SPI_jun_2000_*_scale_{scale}_all_bands_ARG_cropped.tif'), f'SPI_scale_{scale}')
+                for scale in spi_scales
+            ],
+            'config_files': {'indexer.properties': SPI_INDEXER, 'timeregex.properties': TIME_REGEX, 'scaleregex.properties': SCALE_REGEX},
+            'custom_dimensions': ['SCALE'],
+        },
+    ]
+
+    for mosaic in mosaics:
+        store_name = mosaic['store_name']
+        store_url = f"{url}/rest/workspaces/{workspace_name}/coveragestores/{store_name}"
+
+        if not os.path.exists(mosaic['granule_dir']):
+            os.makedirs(mosaic['granule_dir'])
+
+        pending_granules = []
+        for all_bands_tif, prefix in mosaic['sources']:
+            pending_granules += write_mosaic_granules(all_bands_tif, mosaic['granule_dir'], prefix)
+
+        store_exists = session.get(f"{store_url}.json", timeout=30).status_code == 200
+
+        try:
+            if not store_exists:
+                print(f"Creando mosaico: {store_name}")
+                all_granules = get_mosaic_granules(mosaic['granule_dir'], pending_granules)
+                create_mosaic_store(session, url, workspace_name, mosaic, all_granules)
+            else:
+                indexed_granules = get_indexed_granules(session, store_url, store_name)
+                upload_granules = [
+                    (temp_file, granule_file) for temp_file, granule_file in get_mosaic_granules(mosaic['granule_dir'], pending_granules)
+                    if temp_file != granule_file or os.path.basename(granule_file) not in indexed_granules
+                ]
+                if upload_granules:
+                    print(f"Publicando {len(upload_granules)} granulo(s) en el mosaico: {store_name}")
+                    harvest_mosaic_granules(session, store_url, store_name, upload_granules, indexed_granules)
+                else:
+                    print(f"El mosaico {store_name} ya esta actualizado.")
+        except Exception:
+            for temp_file, _ in pending_granules:
+                if os.path.exists(temp_file):
+                    os.remove(temp_file)
+            raise
+
+        for temp_file, granule_file in pending_granules:
+            os.replace(temp_file, granule_file)
+
+###################################################################################################################################
+
+## Funcion write_mosaic_granules: Sirve para generar los granulos de un mosaico a partir de un archivo de todas las bandas.
+#  1. Para cada banda, se calcula el nombre del granulo con el prefijo recibido y el año y mes de la banda (por ejemplo,
+#     "SPI_scale_3_202410.tif"), y se leen sus valores ya decodificados (aplicando el factor de escala y reemplazando el "nodata" por
+#     NaN si el archivo usa la codificacion "int16"), ya que los estilos de GeoServer se aplican sobre los valores originales.
+#  2. Si el granulo ya existe y tiene los mismos valores, no se escribe. Caso contrario, se escribe junto al granulo, con el sufijo
+#     ".TMP", y se agrega a la lista de granulos pendientes de publicar, que se retorna como pares (archivo temporal, archivo final).
+
+def write_mosaic_granules(all_bands_tif, granule_dir, prefix):
+    pending_granules = []
+    if all_bands_tif is None:
+        return pending_granules
+
+    with rasterio.open(all_bands_tif) as src:
+        profile = {
+            'driver': 'GTiff', 'height': src.height, 'width': src.width, 'count': 1, 'dtype': 'float32', 'crs': src.crs,
+            'transform': src.transform, 'nodata': np.nan, 'compress': 'DEFLATE', 'tiled': True
+        }
+        for band in range(1, src.count + 1):
+            band_date = MOSAIC_START_DATE + relativedelta(months=band - 1)
+            granule_file = os.path.join(granule_dir, f"{prefix}_{band_date.strftime('%Y%m')}.tif")
+
+            values = src.read(band, masked=True).astype('float32') * src.scales[band - 1] + src.offsets[band - 1]
+            values = values.filled(np.nan).astype('float32')
+
+            if os.path.exists(granule_file):
+                with rasterio.open(granule_file) as granule:
+                    if granule.shape == values.shape and np.array_equal(granule.read(1), values, equal_nan=True):
+                        continue
+
+            temp_file = granule_file + '.TMP'
+            with rasterio.open(temp_file, 'w', **profile) as dst:
+                dst.write(values, 1)
+                dst.update_tags(**src.tags())
+            pending_granules.append((temp_file, granule_file))
+
+    return pending_granules
+
+###################################################################################################################################
+
+## Funcion create_mosaic_store: Sirve para crear un mosaico en GeoServer, con todos sus granulos, y dejarlo listo para ser consultado.
+#  1. Se arma un archivo ZIP con los archivos de configuracion del indice y todos los granulos, y se envia a GeoServer en una sola
+#     solicitud, que crea el almacen, el indice y la capa ("configure=all").
+#  2. Se habilitan las dimensiones de la capa: la temporal, cuyo valor por defecto es el ultimo mes, y las adicionales (la escala
+#     del SPI), mediante "enable_mosaic_dimensions()".
+#  3. Se asigna el estilo por defecto de la capa, y se espera a que la capa tenga dicho estilo.
+
+def create_mosaic_store(session, url, workspace_name, mosaic, granules):
+    store_name = mosaic['store_name']
+    store_url = f"{url}/rest/workspaces/{workspace_name}/coveragestores/{store_name}"
+
+    zip_file = os.path.join(mosaic['granule_dir'], f'{store_name}.zip.TMP')
+    try:
+        with zipfile.ZipFile(zip_file, 'w', zipfile.ZIP_STORED) as zf:
+            for config_name, config_content in mosaic['config_files'].items():
+                zf.writestr(config_name, config_content)
+            for temp_file, granule_file in granules:
+                zf.write(temp_file, os.path.basename(granule_file))
+
+        with open(zip_file, 'rb') as f:
+            response = session.put(
+                f"{store_url}/file.imagemosaic", params={'configure': 'all'}, data=f,
+                headers={'Content-Type': 'application/zip'}, timeout=600
+            )
+        response.raise_for_status()
+    finally:
+        if os.path.exists(zip_file):
+            os.remove(zip_file)
+
+    enable_mosaic_dimensions(session, store_url, store_name, mosaic['custom_dimensions'])
+
+    response = session.put(
+        f"{url}/rest/layers/{workspace_name}:{store_name}", json={'layer': {'defaultStyle': {'name': mosaic['style_name']}}}, timeout=30
+    )
+    response.raise_for_status()
+
+    def has_style(layer_json):
+        default_style = layer_json.get('layer', {}).get('defaultStyle', {}).get('name', '')
+        return default_style.split(':')[-1] == mosaic['style_name']
+
+    wait_for_geoserver_resource(f"{url}/rest/layers/{workspace_name}:{store_name}.json", check=has_style, session=session)
+
+###################################################################################################################################
+
+## Funcion enable_mosaic_dimensions: Sirve para habilitar en la capa del mosaico la dimension temporal, presentada como lista y con
+#  el ultimo mes como valor por defecto, y las dimensiones adicionales recibidas (por ejemplo, "SCALE"), con el menor valor como
+#  valor por defecto.
+
+def enable_mosaic_dimensions(session, store_url, store_name, custom_dimensions):
+    entries = [{
+        '@key': 'time',
+        'dimensionInfo': {'enabled': True, 'presentation': 'LIST', 'units': 'ISO8601', 'defaultValue': {'strategy': 'MAXIMUM'}},
+    }]
+    for dimension in custom_dimensions:
+        entries.append({
+            '@key': f'custom_dimension_{dimension}',
+            'dimensionInfo': {'enabled': True, 'presentation': 'LIST', 'defaultValue': {'strategy': 'MINIMUM'}},
+        })
+
+    response = session.put(
+        f"{store_url}/coverages/{store_name}.json", json={'coverage': {'enabled': True, 'metadata': {'entry': entries}}}, timeout=30
+    )
+    response.raise_for_status()
+
+###################################################################################################################################
+
+## Funcion harvest_mosaic_granules: Sirve para agregar granulos a un mosaico existente con una sola solicitud a GeoServer.
+#  1. Los granulos que ya estan en el indice (es decir, los que cambiaron) se quitan previamente del mismo, para que no queden
+#     registrados dos veces.
+#  2. Se arma un archivo ZIP con los granulos, y se envia a GeoServer, que los guarda en la carpeta del mosaico y los agrega a su
+#     indice, recalculando la extension de la capa.
+
+def harvest_mosaic_granules(session, store_url, store_name, granules, indexed_granules):
+    for _, granule_file in granules:
+        granule_name = os.path.basename(granule_file)
+        if granule_name in indexed_granules:
+            response = session.delete(
+                f"{store_url}/coverages/{store_name}/index/granules", params={'filter': f"location = '{granule_name}'"}, timeout=30
+            )
+            response.raise_for_status()
+
+    zip_file = os.path.join(os.path.dirname(granules[0][1]), f'{store_name}.zip.TMP')
+    try:
+        with zipfile.ZipFile(zip_file, 'w', zipfile.ZIP_STORED) as zf:
+            for temp_file, granule_file in granules:
+                zf.write(temp_file, os.path.basename(granule_file))
+
+        with open(zip_file, 'rb') as f:
+            response = session.post(
+                f"{store_url}/file.imagemosaic", params={'recalculate': 'nativebbox,latlonbbox'}, data=f,
+                headers={'Content-Type': 'application/zip'}, timeout=600
+            )
+        response.raise_for_status()
+    finally:
+        if os.path.exists(zip_file):
+            os.remove(zip_file)
+
+###################################################################################################################################
+
+## Funciones get_indexed_granules, get_mosaic_granules y get_all_bands_tif:
+#  - get_indexed_granules: Sirve para obtener los nombres de los granulos registrados en el indice de un mosaico de GeoServer.
+#  - get_mosaic_granules: Sirve para obtener todos los granulos de un mosaico, como pares (archivo a enviar, archivo final), donde el
+#    archivo a enviar es el temporal para los granulos pendientes y el propio granulo para los ya publicados.
+#  - get_all_bands_tif: Sirve para obtener el archivo de todas las bandas que coincide con el patron recibido, o None si no existe.
+
+def get_indexed_granules(session, store_url, store_name):
+    response = session.get(f"{store_url}/coverages/{store_name}/index/granules.json", timeout=60)
+    response.raise_for_status()
+    features = response.json().get('features', [])
+    return {os.path.basename(feature.get('properties', {}).get('location', '')) for feature in features}
+
+
+def get_mosaic_granules(granule_dir, pending_granules):
+    pending = {granule_file: temp_file for temp_file, granule_file in pending_granules}
+    granule_files = set(glob.glob(os.path.join(granule_dir, '*.tif'))) | set(pending)
+    return [(pending.get(granule_file, granule_file), granule_file) for granule_file in sorted(granule_files)]
+
+
+def get_all_bands_tif(tif_dir, pattern):
+    tif_files = sorted(glob.glob(os.path.join(tif_dir, pattern)))
+    return tif_files[-1] if tif_files else None
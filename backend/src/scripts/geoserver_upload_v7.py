@@ -1,21 +1,33 @@
 import os
+import hashlib
 import requests
 from dotenv import load_dotenv
-from requests.auth import HTTPBasicAuth
-from geo.Geoserver import Geoserver, GeoserverException  
+from requests.adapters import HTTPAdapter
+from concurrent.futures import ThreadPoolExecutor
 
 try:
-    from sleep_for_a_bit_v7 import sleep_for_a_bit 
+    from wait_until_v7 import wait_for_geoserver_resource
 except ModuleNotFoundError:
-    from src.scripts.sleep_for_a_bit_v7 import sleep_for_a_bit
+    from src.scripts.wait_until_v7 import wait_for_geoserver_resource
+
+try:
+    from geoserver_mosaic_v7 import geoserver_mosaic_upload
+except ModuleNotFoundError:
+    from src.scripts.geoserver_mosaic_v7 import geoserver_mosaic_upload
 
 ###################################################################################################################################
 
-## Funcion concat_reord: Sirve para efectuar la autenticacion y conexion con GeoServer para crear y publicar las capas raster de 
-#  Precipitación Total Mensual (PTM) y del Indice de Precipitación Estandarizado (SPI) de todas las escalas, en el espacio de 
+## Funcion concat_reord: Sirve para efectuar la autenticacion y conexion con GeoServer para crear y publicar las capas raster de
+#  Precipitación Total Mensual (PTM) y del Indice de Precipitación Estandarizado (SPI) de todas las escalas, en el espacio de
 #  trabajo definido en el servidor, y aplicando para cada el estilo correspondiente.
+#  - La funcion recibe el parametro "upload_mode", que indica el modo de publicacion:
+#    - "layers": Se crea una capa por cada archivo de la ultima banda (PTM y cada escala del SPI), como se detalla en el PASO 2.
+#    - "mosaic": Se publican el PTM y el SPI como dos capas ImageMosaic con dimension temporal, mediante "geoserver_mosaic_upload()",
+#      a las que la publicacion diaria solo agrega los granulos (meses) nuevos o modificados.
+#    Si no se indica, se toma de la variable "GEOSERVER_UPLOAD_MODE" del archivo ".env", y si esta no existe, se usa "layers".
+#  - Y recibe el parametro "max_workers", que indica la cantidad de capas que se sincronizan al mismo tiempo en el modo "layers".
 
-def geoserver_upload():
+def geoserver_upload(upload_mode=None, max_workers=4):
 
     ## Distribucion de carpetas/directorios:
     #
@@ -30,75 +42,178 @@ def geoserver_upload():
 
     ###################################################################################################################################
 
-    ## PASO 1: Proceso de autenticacion en GeoServer y creacion de espacio de trabajo para almacenar los datos. 
-    #  1. Como primera medida, extraemos del archivo ."env" las credenciales necesarias para realizar la autencion y conexion con 
-    #     GeoServer. Creamos un objeto de tipo "Geoserver" para poder interactuar con la API del mismo, pasandole como parametro las 
-    #     credenciales. 
+    ## PASO 1: Proceso de autenticacion en GeoServer y creacion de espacio de trabajo para almacenar los datos.
+    #  1. Como primera medida, extraemos del archivo ."env" las credenciales necesarias para realizar la autencion y conexion con
+    #     GeoServer. Creamos una sesion HTTP ("requests.Session") autenticada con dichas credenciales mediante "get_geoserver_session()",
+    #     que se reutiliza en todas las solicitudes a la API REST de GeoServer.
     #  2. Luego, definimos el espacio de trabajo a nombre de "EHCPA", y realizamos la siguiente comprobacion:
     #     - Si el espacio de trabajo ya existe, se informa y continua el proceso.
     #     - Si el espacio de trabajo no existe, se informa, se lo crea, se lo establece por defecto, y continua el proceso.
+    #  3. Antes de continuar, se espera a que el espacio de trabajo este disponible en la API REST de GeoServer mediante
+    #     "wait_for_geoserver_resource()".
+    #  4. En el modo "mosaic", se publican los mosaicos mediante "geoserver_mosaic_upload()" y finaliza el proceso, sin crear las capas
+    #     del PASO 2.
 
     dotenv_path = os.path.expanduser(os.path.join('~', 'EHCPA_SPI', 'backend', 'src', 'credentials', '.env'))
     load_dotenv(dotenv_path)
     url = os.getenv('GEOSERVER_URL')
     username = os.getenv('GEOSERVER_USERNAME')
     password = os.getenv('GEOSERVER_PASSWORD')
+    upload_mode = upload_mode or os.getenv('GEOSERVER_UPLOAD_MODE') or 'layers'
 
-    geo = Geoserver(url, username=username, password=password)
+    session = get_geoserver_session(username, password, max_workers)
 
     workspace_name = 'EHCPA'
 
-    try:
-        geo.get_workspace(workspace_name)
+    response = session.get(f"{url}/rest/workspaces/{workspace_name}.json", timeout=30)
+    if response.status_code == 404:
+        print(f"El workspace '{workspace_name}' no existe. Creando...")
+        session.post(f"{url}/rest/workspaces", json={'workspace': {'name': workspace_name}}, timeout=30).raise_for_status()
+        print(f"El workspace '{workspace_name}' se creo con exito")
+        session.put(f"{url}/rest/workspaces/default", json={'workspace': {'name': workspace_name}}, timeout=30).raise_for_status()
+        print(f"El workspace '{workspace_name}' ha sido creado y establecido por defecto.")
+    else:
+        response.raise_for_status()
         print(f"El workspace '{workspace_name}' ya existe.")
-    except GeoserverException as e:
-        if 'No such workspace' in str(e):
-            print(f"El workspace '{workspace_name}' no existe. Creando...")
-            geo.create_workspace(workspace_name)
-            print(f"El workspace '{workspace_name}' se creo con exito")
-            geo.set_default_workspace(workspace_name)
-            print(f"El workspace '{workspace_name}' ha sido creado y establecido por defecto.")
-            sleep_for_a_bit(20)
-    sleep_for_a_bit(40)
-
-    ###################################################################################################################################
+    wait_for_geoserver_resource(f"{url}/rest/workspaces/{workspace_name}.json", session=session)
 
-    ## PASO 2: Proceso de creacion de capas y asignacion de estilos. 
-    #  1. Para el archivo de "PTM", definimos el nombre de la capa y el nombre del estilo que se va a aplicar en dicha capa. Posteriormente, 
-    #     creamos la capa asignando el nombre de la misa, el archivo de "PTM" y el espacio de trabajo. Luego se publica en la capa creada, 
-    #     el estilo definido.
-    #  2. Para los archivos de "SPI" de todas las escalas, definimos el nombre de la capa para cada uno y el nombre del estilo que se 
-    #     va a aplicar a las mismas. Posteriormente, iteramos cada escala para crear su correspondiente capa asignando el nombre de la 
-    #     misma, el archivo de "SPI" y el espacio de trabajo. Luego para cada capa creada, se publica el estilo definido.  
+    if upload_mode == 'mosaic':
+        geoserver_mosaic_upload(session, url, workspace_name)
+        session.close()
+        return
 
-    PTM_layer_name = "PTM_Raster"
-    PTM_style_name = 'PTM_Style'
+    ###################################################################################################################################
 
-    print(f"Creando coveragestore para la capa: {PTM_layer_name}")
-    geo.create_coveragestore(layer_name=PTM_layer_name, path=PTM_tif_file, workspace=workspace_name)
-    sleep_for_a_bit(60)
-    print(f"Publicando estilo para la capa: {PTM_layer_name}")
-    geo.publish_style(layer_name=PTM_layer_name, style_name=PTM_style_name, workspace=workspace_name)
-    sleep_for_a_bit(60)
+    ## PASO 2: Proceso de sincronizacion de capas y asignacion de estilos.
+    #  1. Para el archivo de "PTM", definimos el nombre de la capa y el nombre del estilo que se va a aplicar en dicha capa. Y para los
+    #     archivos de "SPI" de todas las escalas, definimos el nombre de la capa para cada uno y el nombre del estilo que se va a
+    #     aplicar a las mismas.
+    #  2. Las capas son independientes entre si, por lo que se sincronizan al mismo tiempo en un grupo de "max_workers" hilos
+    #     ("ThreadPoolExecutor") que comparten la sesion HTTP. Cada capa se sincroniza mediante "sync_geoserver_layer()", que solo
+    #     vuelve a subir el archivo si su contenido cambio respecto del publicado, y solo publica el estilo si no es el estilo por
+    #     defecto de la capa.
+    #  3. Se informa cuantas capas se actualizaron y cuantas no tenian cambios. Si la sincronizacion de alguna capa falla, el error se
+    #     relanza al obtener su resultado.
 
+    layers = [('PTM_Raster', PTM_tif_file, 'PTM_Style')]
 
     spi_scales = ['1', '2', '3', '6', '9', '12', '24', '36', '48', '60', '72']
-    SPI_style_name = 'SPI_Style'
 
     for scale in spi_scales:
-        
         SPI_tif_file = os.path.join(geoserver_SPI_dir, f'SPI_jun_2000_present_scale_{scale}_last_band_ARG_cropped.tif')
+        layers.append((f"SPI_scale_{scale}_Raster", SPI_tif_file, 'SPI_Style'))
+
+    with session, ThreadPoolExecutor(max_workers=max_workers) as executor:
+        futures = [
+            executor.submit(sync_geoserver_layer, session, url, workspace_name, layer_name, tif_file, style_name)
+            for layer_name, tif_file, style_name in layers
+        ]
+        results = [future.result() for future in futures]
+
+    print(f"Capas actualizadas: {results.count('updated')}, sin cambios: {results.count('unchanged')}")
+
+###################################################################################################################################
+
+## Funcion get_geoserver_session: Sirve para crear la sesion HTTP autenticada con la que se realizan todas las solicitudes a la API
+#  REST de GeoServer, con un pool de "max_workers" conexiones para que los hilos de sincronizacion reutilicen las conexiones abiertas.
+
+def get_geoserver_session(username, password, max_workers=4):
+    session = requests.Session()
+    session.auth = (username, password)
+    adapter = HTTPAdapter(pool_connections=max_workers, pool_maxsize=max_workers)
+    session.mount('https://', adapter)
+    session.mount('http://', adapter)
+    return session
+
+###################################################################################################################################
+
+## Funcion sync_geoserver_layer: Sirve para sincronizar una capa de GeoServer con su archivo GeoTiff local, sin volver a subirlo si
+#  no cambio.
+#  1. Se calcula el hash SHA-256 del archivo local, y se obtiene el hash del archivo publicado, que se guarda en la descripcion del
+#     almacen de la capa ("coverageStore") con el formato "sha256:<hash>", junto con el estilo por defecto de la capa, mediante
+#     "get_geoserver_layer_state()".
+#  2. Si los hashes no coinciden (o la capa no existe), se sube el archivo creando o reemplazando el almacen de la capa, se espera a
+#     que la capa exista, y se guarda el nuevo hash en la descripcion del almacen.
+#  3. Si se subio el archivo o el estilo por defecto de la capa no es el indicado, se publica el estilo y se espera a que la capa lo
+#     tenga por defecto.
+#  - Se retorna "updated" si se subio el archivo o se publico el estilo, o "unchanged" si la capa ya estaba al dia.
+
+def sync_geoserver_layer(session, url, workspace_name, layer_name, tif_file, style_name):
+    store_url = f"{url}/rest/workspaces/{workspace_name}/coveragestores/{layer_name}"
+    layer_url = f"{url}/rest/layers/{workspace_name}:{layer_name}"
+
+    local_hash = f"sha256:{get_file_sha256(tif_file)}"
+    remote_hash, remote_style = get_geoserver_layer_state(session, store_url, layer_url)
+
+    uploaded = remote_hash != local_hash
+    if uploaded:
+        print(f"Creando coveragestore para la capa: {layer_name}")
+        with open(tif_file, 'rb') as f:
+            response = session.put(
+                f"{store_url}/file.geotiff", params={'coverageName': layer_name}, data=f,
+                headers={'Content-Type': 'image/tiff'}, timeout=300
+            )
+        response.raise_for_status()
+        wait_for_geoserver_layer(session, url, workspace_name, layer_name)
+
+        response = session.put(f"{store_url}.json", json={'coverageStore': {'description': local_hash}}, timeout=30)
+        response.raise_for_status()
+
+    if uploaded or remote_style != style_name:
+        print(f"Publicando estilo para la capa: {layer_name}")
+        response = session.put(layer_url, json={'layer': {'defaultStyle': {'name': style_name}}}, timeout=30)
+        response.raise_for_status()
+        wait_for_geoserver_layer(session, url, workspace_name, layer_name, style_name)
+        return 'updated'
+
+    print(f"La capa {layer_name} no tiene cambios.")
+    return 'unchanged'
+
+###################################################################################################################################
+
+## Funcion get_geoserver_layer_state: Sirve para obtener el hash del archivo publicado en una capa (de la descripcion de su almacen)
+#  y el nombre de su estilo por defecto. Si el almacen o la capa no existen, se retorna None en su lugar.
+
+def get_geoserver_layer_state(session, store_url, layer_url):
+    remote_hash = remote_style = None
+
+    response = session.get(f"{store_url}.json", timeout=30)
+    if response.status_code == 200:
+        remote_hash = response.json().get('coverageStore', {}).get('description')
+    elif response.status_code != 404:
+        response.raise_for_status()
+
+    response = session.get(f"{layer_url}.json", timeout=30)
+    if response.status_code == 200:
+        remote_style = response.json().get('layer', {}).get('defaultStyle', {}).get('name', '').split(':')[-1] or None
+    elif response.status_code != 404:
+        response.raise_for_status()
+
+    return remote_hash, remote_style
+
+###################################################################################################################################
+
+## Funcion get_file_sha256: Sirve para calcular el hash SHA-256 de un archivo, leyendolo por bloques.
+
+def get_file_sha256(file_path, chunk_size=1024 * 1024):
+    sha256 = hashlib.sha256()
+    with open(file_path, 'rb') as f:
+        for chunk in iter(lambda: f.read(chunk_size), b''):
+            sha256.update(chunk)
+    return sha256.hexdigest()
+
+###################################################################################################################################
+
+## Funcion wait_for_geoserver_layer: Sirve para esperar a que una capa exista en la API REST de GeoServer y, si se indica el nombre
+#  de un estilo, a que dicho estilo sea el estilo por defecto de la capa.
+
+def wait_for_geoserver_layer(session, url, workspace_name, layer_name, style_name=None):
+    def has_style(layer_json):
+        default_style = layer_json.get('layer', {}).get('defaultStyle', {}).get('name', '')
+        return style_name is None or default_style.split(':')[-1] == style_name
 
-        SPI_layer_name = f"SPI_scale_{scale}_Raster"
-        
-        print(f"Creando coveragestore para la capa: {SPI_layer_name}")
-        geo.create_coveragestore(layer_name=SPI_layer_name, path=SPI_tif_file, workspace=workspace_name)
-        sleep_for_a_bit(60)
+    return wait_for_geoserver_resource(f"{url}/rest/layers/{workspace_name}:{layer_name}.json", check=has_style, session=session)
 
-        print(f"Publicando estilo para la capa: {SPI_layer_name}")
-        geo.publish_style(layer_name=SPI_layer_name, style_name=SPI_style_name, workspace=workspace_name)
-        sleep_for_a_bit(60)
-    
 
 
 
@@ -1,10 +1,29 @@
 import os
 import re
+import json
+import threading
 from datetime import datetime
 from dateutil.relativedelta import relativedelta
 
 ###################################################################################################################################
 
+## Nombres de los meses en español, completos y abreviados (como los genera "strftime('%b')" con el idioma "es_ES"), para formatear
+#  las fechas sin depender del idioma configurado en el sistema ni modificarlo con "locale.setlocale()", que afecta a todo el 
+#  proceso y no es seguro cuando el backend atiende varias solicitudes a la vez.
+
+MONTH_NAMES = [
+    'enero', 'febrero', 'marzo', 'abril', 'mayo', 'junio',
+    'julio', 'agosto', 'septiembre', 'octubre', 'noviembre', 'diciembre',
+]
+MONTH_ABBREVIATIONS = ['ene', 'feb', 'mar', 'abr', 'may', 'jun', 'jul', 'ago', 'sep', 'oct', 'nov', 'dic']
+
+## dates_index_cache: Ultimo indice de fechas leido por el proceso ("entry"), junto con la fecha de modificacion del archivo del que 
+#  se leyo.
+
+dates_index_cache = {}
+
+###################################################################################################################################
+
 ## Funcion get_today_date: Sirve para obtener la fecha actual. 
 #  1. Obtenemos la fecha y hora actual del sistema.
 #  2. Se convierte la fecha actual en una cadena con el formato "Año-Mes-Día".
@@ -127,44 +146,121 @@ def get_calibration_date():
     if today_date.date() < comparison_next_month_third_day.date():
         if(today_date.date() >= comparison_next_year_first_day.date() and today_date.date() < comparison_next_year_third_day.date()):
             calibration_end_year = today_date.year - 1
-            calibration_end_month = (today_date - relativedelta(months=1)).strftime('%b').lower()
+            calibration_end_month = get_month_name((today_date - relativedelta(months=1)).month, abbreviated=True)
         else:
             calibration_end_year = today_date.year
-            calibration_end_month = (today_date - relativedelta(months=1)).strftime('%b').lower()
+            calibration_end_month = get_month_name((today_date - relativedelta(months=1)).month, abbreviated=True)
     else:
         calibration_end_year = today_date.year
-        calibration_end_month = today_date.strftime('%b').lower()
+        calibration_end_month = get_month_name(today_date.month, abbreviated=True)
     
     return calibration_end_year, calibration_end_month
 
 
+###################################################################################################################################
+
+## Funcion get_data_download_dates: Sirve para obtener el mes (abreviado, en minusculas) y el año de los datos descargables, es decir, 
+#  del archivo IMERG de precipitacion mensual acumulada mas reciente, a partir del indice de fechas ("get_dates_index()"). Si no hay
+#  archivos, se retorna "No disponible" en ambos.
+
 def get_data_download_dates():
-    # Definir el directorio donde se almacenan los archivos
+    data_version = get_dates_index()['data_version']
+
+    if data_version is None:
+        return "No disponible", "No disponible"
+
+    year, month = data_version.split('_')
+    return get_month_name(int(month), abbreviated=True), year
+
+###################################################################################################################################
+
+## Funcion get_data_version: Sirve para obtener la version de los datos procesados, que es el año y mes ("YYYY_MM") del archivo 
+#  IMERG de precipitacion mensual acumulada mas reciente en "IMERG_late_month". Si no hay archivos, se retorna None.
+
+def get_data_version():
     imerg_late_month_dir = os.path.expanduser(os.path.join('~', 'EHCPA_SPI', 'backend', 'src', 'IMERG_late_month'))
-    
-    # Listar los archivos en el directorio
-    files = [f for f in os.listdir(imerg_late_month_dir) if os.path.isfile(os.path.join(imerg_late_month_dir, f))]
-    
-    # Definir el patrón de búsqueda de archivos con el formato IMERG_monthly_accumulated_precip_YYYY_MM.nc4
+
     pattern = r'IMERG_monthly_accumulated_precip_(\d{4})_(\d{2})\.nc4'
-    
-    # Filtrar archivos que cumplan con el patrón
-    dated_files = [f for f in files if re.search(pattern, f)]
-    
-    if dated_files:
-        # Ordenar los archivos para obtener el más reciente
-        latest_file = sorted(dated_files)[-1]
-        
-        # Extraer el año y el mes del nombre del archivo
-        match = re.search(pattern, latest_file)
-        if match:
-            year = match.group(1)
-            month_num = int(match.group(2))
-            month_str = datetime(1900, month_num, 1).strftime('%b').lower()
-            
-            return month_str, year
-    
-    return "No disponible", "No disponible"
+    matches = [re.fullmatch(pattern, f) for f in os.listdir(imerg_late_month_dir)]
+    versions = sorted(f"{match.group(1)}_{match.group(2)}" for match in matches if match)
+
+    return versions[-1] if versions else None
+
+###################################################################################################################################
+
+## Funcion get_month_name: Sirve para obtener el nombre en español del mes "month" (de 1 a 12), completo o abreviado.
+
+def get_month_name(month, abbreviated=False):
+    return (MONTH_ABBREVIATIONS if abbreviated else MONTH_NAMES)[month - 1]
+
+###################################################################################################################################
+
+## Funcion update_dates_index: Sirve para actualizar el indice de fechas, que guarda la fecha del ultimo archivo de "ARG_late" y la 
+#  version de los datos de "IMERG_late_month", para que los endpoints del backend no tengan que recorrer dichas carpetas en cada 
+#  solicitud. El proceso la ejecuta cada vez que descarga archivos o genera los acumulados mensuales.
+#  1. Se obtiene la fecha de modificacion de ambas carpetas, que cambia cuando se agregan o eliminan archivos, y luego se recorren 
+#     las carpetas mediante "get_ARG_late_last_date()" y "get_data_version()".
+#  2. El indice se guarda en "input/dates_index.json" (carpeta ignorada por git, que se crea si no existe), primero con un nombre 
+#     temporal propio de cada proceso e hilo y luego se renombra, para que nunca quede a medio escribir. Se retorna el indice.
+
+def update_dates_index():
+    dates_index_file = os.path.expanduser(os.path.join('~', 'EHCPA_SPI', 'backend', 'src', 'input', 'dates_index.json'))
+
+    dates_index = {
+        'signature': get_dates_index_signature(),
+        'ARG_late_last_date': get_ARG_late_last_date(),
+        'data_version': get_data_version(),
+    }
+
+    os.makedirs(os.path.dirname(dates_index_file), exist_ok=True)
+    temp_file = f'{dates_index_file}.{os.getpid()}.{threading.get_ident()}.TMP'
+    with open(temp_file, 'w') as f:
+        json.dump(dates_index, f, indent=2)
+    os.replace(temp_file, dates_index_file)
+
+    return dates_index
+
+###################################################################################################################################
+
+## Funcion get_dates_index: Sirve para obtener el indice de fechas sin recorrer las carpetas "ARG_late" e "IMERG_late_month".
+#  1. Si el archivo del indice no cambio desde la ultima lectura, se usa el indice guardado en memoria ("dates_index_cache"), y si 
+#     cambio (porque el proceso lo actualizo), se vuelve a leer.
+#  2. Si la fecha de modificacion de las carpetas no coincide con la registrada en el indice (por ejemplo, porque se copiaron 
+#     archivos manualmente), o si el indice no existe o esta corrupto, se actualiza mediante "update_dates_index()".
+#  De esta manera, cada solicitud solo consulta la fecha de modificacion de tres rutas, sin importar la cantidad de archivos.
+
+def get_dates_index():
+    dates_index_file = os.path.expanduser(os.path.join('~', 'EHCPA_SPI', 'backend', 'src', 'input', 'dates_index.json'))
+
+    try:
+        index_mtime = os.stat(dates_index_file).st_mtime_ns
+        cached_mtime, dates_index = dates_index_cache.get('entry', (None, None))
+        if cached_mtime != index_mtime:
+            with open(dates_index_file, 'r') as f:
+                dates_index = json.load(f)
+            dates_index_cache['entry'] = (index_mtime, dates_index)
+    except (OSError, ValueError):
+        dates_index = {}
+
+    if dates_index.get('signature') != get_dates_index_signature():
+        dates_index = update_dates_index()
+
+    return dates_index
+
+###################################################################################################################################
+
+## Funcion get_dates_index_signature: Sirve para obtener la fecha de modificacion (en nanosegundos) de las carpetas "ARG_late" e 
+#  "IMERG_late_month". Si alguna no existe, su fecha es None.
+
+def get_dates_index_signature():
+    signature = []
+    for folder in ['ARG_late', 'IMERG_late_month']:
+        folder_dir = os.path.expanduser(os.path.join('~', 'EHCPA_SPI', 'backend', 'src', folder))
+        try:
+            signature.append(os.stat(folder_dir).st_mtime_ns)
+        except FileNotFoundError:
+            signature.append(None)
+    return signature
     
 
 
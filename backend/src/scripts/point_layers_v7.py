@@ -0,0 +1,109 @@
+import os
+import re
+import numpy as np
+import rasterio
+
+###################################################################################################################################
+
+## Configuracion de las capas del endpoint "/point":
+#  - LAYER_PATTERNS: Carpeta (dentro de "output/geoserver") y expresion regular de los GeoTiff de la ultima banda de cada producto,
+#    de la que se obtiene el nombre de la capa ("PTM" o "SPI_<escala>"), el mismo que utiliza el frontend.
+#  - point_layers_cache: Capas leidas por el proceso del backend. Por cada carpeta se guarda su fecha de modificacion y, por cada
+#    archivo, su fecha de modificacion y tamaño, junto con la matriz de valores, la transformacion y el valor "nodata" del mismo.
+
+LAYER_PATTERNS = [
+    ('PTM', re.compile(r'^PTM_jun_2000_present_last_band_ARG_cropped\.tif$'), lambda match: 'PTM'),
+    ('SPI', re.compile(r'^SPI_jun_2000_present_scale_(\d+)_last_band_ARG_cropped\.tif$'), lambda match: f'SPI_{match.group(1)}'),
+]
+
+point_layers_cache = {'dirs': {}, 'files': {}}
+
+###################################################################################################################################
+
+## Funcion get_point_values: Sirve para obtener, en una sola consulta, el valor de todas las capas de la ultima banda (PTM y SPI de
+#  todas las escalas) en el pixel que contiene una coordenada, sin consultar a GeoServer.
+#  1. Obtenemos las capas mediante "load_point_layers()", que las mantiene en memoria y solo vuelve a leer las que cambiaron.
+#  2. Por cada capa se calcula la fila y columna del pixel con su transformacion. Si la coordenada esta fuera de la grilla se lanza
+#     un "ValueError" con el mensaje que se informa al usuario.
+#  3. Se retorna un diccionario con la latitud y longitud consultadas y el valor de cada capa, con None en los pixeles sin datos
+#     (fuera de Argentina o "nodata").
+#  - Si todavia no existe ninguna capa, se lanza un "FileNotFoundError".
+
+def get_point_values(lat, lon):
+    layers = load_point_layers()
+    if not layers:
+        raise FileNotFoundError('No se encontraron las capas de la ultima banda del PTM y del SPI')
+
+    values = {}
+    for name, (data, transform, nodata) in layers.items():
+        col, row = ~transform * (lon, lat)
+        row, col = int(np.floor(row)), int(np.floor(col))
+        if not (0 <= row < data.shape[0] and 0 <= col < data.shape[1]):
+            raise ValueError(f"La coordenada ({lat}, {lon}) esta fuera del area de Argentina.")
+        value = float(data[row, col])
+        values[name] = None if np.isnan(value) or value == nodata else round(value, 4)
+
+    return {'lat': lat, 'lon': lon, 'values': values}
+
+###################################################################################################################################
+
+## Funcion load_point_layers: Sirve para obtener las capas de la ultima banda desde "point_layers_cache", volviendo a leer del disco
+#  solo lo que cambio desde la ultima consulta.
+#  1. Si la fecha de modificacion de una carpeta no cambio, se reutilizan sus capas sin listar la carpeta. Como los GeoTiff se
+#     escriben con un nombre temporal que luego se renombra, cualquier archivo nuevo o actualizado cambia la fecha de la carpeta.
+#  2. Caso contrario se lista la carpeta, y solo se leen los archivos cuya fecha de modificacion o tamaño cambio. Cada capa es una
+#     unica banda de la grilla de Argentina (menos de 1 MB), por lo que se guarda completa en memoria como float32.
+#  3. Las capas cuyo archivo ya no existe se eliminan del cache.
+
+def load_point_layers():
+    geoserver_dir = os.path.expanduser(os.path.join('~', 'EHCPA_SPI', 'backend', 'src', 'output', 'geoserver'))
+
+    layers = {}
+    for folder, pattern, get_name in LAYER_PATTERNS:
+        layers_dir = os.path.join(geoserver_dir, folder)
+        try:
+            dir_mtime = os.stat(layers_dir).st_mtime_ns
+        except FileNotFoundError:
+            point_layers_cache['dirs'].pop(folder, None)
+            continue
+
+        cached_mtime, cached_layers = point_layers_cache['dirs'].get(folder, (None, None))
+        if cached_mtime == dir_mtime:
+            layers.update(cached_layers)
+            continue
+
+        folder_layers = {}
+        for file in os.listdir(layers_dir):
+            match = pattern.match(file)
+            if not match:
+                continue
+            folder_layers[get_name(match)] = read_point_layer(os.path.join(layers_dir, file))
+
+        for file_path in [path for path in point_layers_cache['files'] if os.path.dirname(path) == layers_dir]:
+            if not os.path.exists(file_path):
+                del point_layers_cache['files'][file_path]
+
+        point_layers_cache['dirs'][folder] = (dir_mtime, folder_layers)
+        layers.update(folder_layers)
+
+    return layers
+
+###################################################################################################################################
+
+## Funcion read_point_layer: Sirve para leer la primera banda de un GeoTiff, su transformacion y su valor "nodata", reutilizando la
+#  lectura anterior si el archivo no cambio (misma fecha de modificacion y tamaño).
+
+def read_point_layer(file_path):
+    stat = os.stat(file_path)
+    signature = (stat.st_mtime_ns, stat.st_size)
+
+    cached_signature, layer = point_layers_cache['files'].get(file_path, (None, None))
+    if cached_signature == signature:
+        return layer
+
+    with rasterio.open(file_path) as src:
+        layer = (src.read(1).astype('float32'), src.transform, src.nodata)
+
+    point_layers_cache['files'][file_path] = (signature, layer)
+    return layer
+
@@ -1,16 +1,7 @@
 import os
-import shutil
-import platform
+import glob
 import xarray as xr
 import rioxarray
-import subprocess
-import numpy as np
-import fiona
-import locale
-import rasterio
-import rasterio.mask
-from datetime import datetime
-from dateutil.relativedelta import relativedelta
 
 try:
     from get_dates_v7 import get_calibration_date 
@@ -18,22 +9,37 @@ except ModuleNotFoundError:
     from src.scripts.get_dates_v7 import get_calibration_date
 
 try:
-    from sleep_for_a_bit_v7 import sleep_for_a_bit 
+    from clip_mask_v7 import load_clip_mask, clip_with_mask
 except ModuleNotFoundError:
-    from src.scripts.sleep_for_a_bit_v7 import sleep_for_a_bit
+    from src.scripts.clip_mask_v7 import load_clip_mask, clip_with_mask
+
+try:
+    from wait_until_v7 import wait_for_path
+except ModuleNotFoundError:
+    from src.scripts.wait_until_v7 import wait_for_path
+
+try:
+    from raster_blocks_v7 import write_clipped_bands_tif, write_raster_tif, get_output_profile
+except ModuleNotFoundError:
+    from src.scripts.raster_blocks_v7 import write_clipped_bands_tif, write_raster_tif, get_output_profile
 
 ###################################################################################################################################
 
 ## Funcion ptm_convertion_and_crop: Sirve para convertir el archivo de Precipitación Total Mensual (PTM) de formato netCDF a GeoTiff, 
 #  para luego obtener el archivo PTM de todas las bandas para la descarga, y el de la ultima banda para ser subido al servidor de 
 #  GeoServer, aplicando ademas en ambos archivos el corte sobre Argentina.
+#  - La funcion recibe el parametro "block_size", que indica la cantidad de bandas que se leen, cortan y escriben a la vez en el 
+#    archivo de todas las bandas, por lo que la memoria utilizada no crece con la longitud de la serie.
+#  - Y recibe el parametro "output_profile", que indica el perfil de salida de ambos archivos ("gtiff" o COG, ver 
+#    "OUTPUT_PROFILES"). Si no se indica, se toma del archivo ".env" mediante "get_output_profile()".
 
-def ptm_convertion_and_crop():
+def ptm_convertion_and_crop(block_size=12, output_profile=None):
     
     ## Distribucion de carpetas/directorios:
     #
     #   - input_PTM_dir: Carpeta donde se encuentra el archivo PTM en formato netCDF.
     #   - ARG_ShapeFiles_dir: Carpeta donde se encuentra el archivo shape de Argentina para realizar el corte.
+    #   - clip_mask_file: Archivo donde se guarda la mascara de corte de Argentina para la grilla IMERG, compartida con el SPI.
     #   - output_dir: Carpeta donde se guardan todos los archivos resultantes.
     #   - downloable_data_dir: Carpeta donde se guardan todos los archivos resultantes de PTM y SPI para ser descargados.
     #   - downloable_data_PTM_dir: Carpeta donde se va a guardar el archivo PTM cortado con todas las bandas, para poder 
@@ -43,9 +49,11 @@ def ptm_convertion_and_crop():
     #   - geoserver_PTM_dir: Carpeta dentro del programa GeoServer donde se va a guardar el archivo PTM cortado con la 
     #     ultima banda, para poder ser subido al servidor.
     #
-    #   - Si las carpetas output_dir, downloable_data_dir y geoserver_EHCPA_dir no existen, se crean.
-    #   - Para las carpetas downloable_data_PTM_dir y geoserver_PTM_dir, en caso de que estas existan, al momento de 
-    #     ejecutar el proceso, estas se borran y vuelven a crear vacias, y en caso de que no existan, solo se crean.
+    #   - Si las carpetas output_dir, downloable_data_dir, downloable_data_PTM_dir, geoserver_EHCPA_dir y geoserver_PTM_dir no 
+    #     existen, se crean. Las carpetas existentes no se borran, ya que los archivos se escriben con un nombre temporal y luego 
+    #     reemplazan a los anteriores, de forma que siempre hay una version completa disponible para la descarga y GeoServer.
+    #   - Luego de crear cada carpeta, en lugar de pausar el proceso un tiempo fijo, se espera a que la carpeta exista mediante 
+    #     "wait_for_path()".
 
     input_PTM_dir = os.path.expanduser(os.path.join('~', 'EHCPA_SPI', 'backend', 'src', 'input', 'PTM'))
     PTM_nc4_file = os.path.join(input_PTM_dir, 'PTM.nc4')
@@ -53,49 +61,43 @@ def ptm_convertion_and_crop():
     ARG_ShapeFiles_dir = os.path.expanduser(os.path.join('~', 'EHCPA_SPI', 'backend', 'src', 'ShapeFiles', 'Argentina'))
     shp_file = os.path.join(ARG_ShapeFiles_dir, 'Argentina.shp')
 
+    clip_mask_file = os.path.expanduser(os.path.join('~', 'EHCPA_SPI', 'backend', 'src', 'input', 'clip_mask', 'ARG_IMERG_clip_mask.npz'))
+
     output_dir = os.path.expanduser(os.path.join('~', 'EHCPA_SPI', 'backend', 'src', 'output'))
 
     if not os.path.exists(output_dir):
         os.makedirs(output_dir)
-    sleep_for_a_bit(20)
+    wait_for_path(output_dir)
 
     downloable_data_dir = os.path.expanduser(os.path.join('~', 'EHCPA_SPI', 'backend', 'src', 'output', 'downloable_data'))
 
     if not os.path.exists(downloable_data_dir):
         os.makedirs(downloable_data_dir)
-    sleep_for_a_bit(20)
+    wait_for_path(downloable_data_dir)
 
     downloable_data_PTM_dir = os.path.expanduser(os.path.join('~', 'EHCPA_SPI', 'backend', 'src', 'output', 'downloable_data', 'PTM'))
 
-    if os.path.exists(downloable_data_PTM_dir):
-        shutil.rmtree(downloable_data_PTM_dir)
-        sleep_for_a_bit(20)
+    if not os.path.exists(downloable_data_PTM_dir):
         os.makedirs(downloable_data_PTM_dir)
-    else:
-        os.makedirs(downloable_data_PTM_dir)
-    sleep_for_a_bit(20)
+    wait_for_path(downloable_data_PTM_dir)
 
     geoserver_dir = os.path.expanduser(os.path.join('~', 'EHCPA_SPI', 'backend', 'src', 'output', 'geoserver'))
 
     if not os.path.exists(geoserver_dir):
         os.makedirs(geoserver_dir)
-    sleep_for_a_bit(20)
+    wait_for_path(geoserver_dir)
 
     geoserver_PTM_dir = os.path.join(geoserver_dir, 'PTM')
 
-    if os.path.exists(geoserver_PTM_dir):
-        shutil.rmtree(geoserver_PTM_dir)
-        sleep_for_a_bit(20)
+    if not os.path.exists(geoserver_PTM_dir):
         os.makedirs(geoserver_PTM_dir)
-    else:
-        os.makedirs(geoserver_PTM_dir)  
-    sleep_for_a_bit(20)
+    wait_for_path(geoserver_PTM_dir)
 
     ###################################################################################################################################
 
     ## PASO 1: Proceso de conversion de archivo "PTM" en formato netCDF a GeoTiff, generando dos archivos, uno que incluya todas las 
     #  bandas para ser descargado, y otro con solo la ultima banda para su implementacion en GeoServer.
-    #  1. Inicializamos el archivo PTM, seleccionamos la variable de interes que es "precipitation". 
+    #  1. Inicializamos el archivo PTM, sin cargarlo en memoria, y seleccionamos la variable de interes que es "precipitation". 
     #  2. Para el caso del archivo tif con todas las bandas, unicamente se configuran las dimensiones espaciales y se aplica el CRS 
     #     (sistema de referencia de coordenadas). Y para el archivo tif de la ultima banda, se aplica la misma configuaracion solo que 
     #     previamente seleccionamos para este justamente la ultima banda a traves de "isel". 
@@ -116,7 +118,8 @@ def ptm_convertion_and_crop():
     ###################################################################################################################################
 
     ## PASO 2: Proceso de corte de ambos archivos tif generados, sobre el archivo shape de Argentina.
-    #  1. Se abre el shapefile que contiene el contorno de Argentina. Ahora, para asignar el mes y año de calibracion del PTM de todas 
+    #  1. Se obtiene la mascara de corte de Argentina mediante "load_clip_mask()", que solo vuelve a leer y rasterizar el shapefile 
+    #     si cambio el mismo o la grilla del PTM. Ahora, para asignar el mes y año de calibracion del PTM de todas 
     #     las bandas, extraemos dichos valores de la funcion "get_calibration_date()". Por otro lado, calculamos el tercer dia del proximo 
     #     año, le restamos 1 al año, del tercer dia del proximo año, para la comparacion. Ahora bien, para la asignacion del final del 
     #     año de calibracion:
@@ -125,27 +128,33 @@ def ptm_convertion_and_crop():
     #     - Si la fecha actual es mayor o igual al primer dia del proximo año de la comparacion, y menor al tercer dia del proximo año 
     #       de comparacion, se asigna el año actual menos uno.
     #     - Caso contrario, se asigna el año actual.
-    #   2. Finalmente hacemos el corte espacial en ambos archivos. Para ambos casos se recortan utilizando el contorno geografico de 
-    #      Argentina y se almacenan en las variables "pr_cropped_...", luego se define el nombre y la ubicacion de donde seran guardados 
-    #      ambos archivos, y por utlimo los archivos tif cortados se guardan en la ruta especificada. 
+    #   2. Finalmente hacemos el corte espacial en ambos archivos. Para ambos casos se recortan con "clip_with_mask()", utilizando la 
+    #      mascara del contorno geografico de Argentina, luego se define el nombre y la ubicacion de donde seran guardados ambos 
+    #      archivos, y por utlimo los archivos tif cortados se guardan en la ruta especificada. El archivo de todas las bandas se corta
+    #      y se guarda de a "block_size" bandas mediante "write_clipped_bands_tif()", y el de la ultima banda con "write_raster_tif()",
+    #      ambos con el perfil de salida "output_profile". Como el nombre del archivo de todas las bandas incluye el mes y año de 
+    #      calibracion, una vez escrito se eliminan los archivos de todas las bandas de meses anteriores.
 
-    with fiona.open(shp_file, "r") as shapefile:
-        shapes = [feature["geometry"] for feature in shapefile]
+    clip_mask = load_clip_mask(pr_all_bands, shp_file, clip_mask_file)
 
-    locale.setlocale(locale.LC_TIME, 'es_ES.UTF-8')
-    
     calibration_end_year, calibration_end_month = get_calibration_date()
-    
 
-    pr_cropped_all_bands = pr_all_bands.rio.clip(shapes, pr.rio.crs)
+    if output_profile is None:
+        output_profile, _ = get_output_profile()
+
     PTM_all_bands_cropped_tif = os.path.join(downloable_data_PTM_dir, f'PTM_jun_2000_{calibration_end_month.rstrip(".")}_{calibration_end_year}_all_bands_ARG_cropped.tif')
-    pr_cropped_all_bands.rio.to_raster(PTM_all_bands_cropped_tif)
+    write_clipped_bands_tif(pr_all_bands, clip_mask, PTM_all_bands_cropped_tif, block_size, output_profile)
 
+    for previous_tif in glob.glob(os.path.join(downloable_data_PTM_dir, 'PTM_jun_2000_*_all_bands_ARG_cropped.tif')):
+        if previous_tif != PTM_all_bands_cropped_tif:
+            os.remove(previous_tif)
 
-    pr_cropped_last_band = pr_last_band.rio.clip(shapes, pr.rio.crs)
+
+    pr_cropped_last_band = clip_with_mask(pr_last_band, clip_mask)
     PTM_last_band_cropped_tif = os.path.join(geoserver_PTM_dir, f'PTM_jun_2000_present_last_band_ARG_cropped.tif')
-    pr_cropped_last_band.rio.to_raster(PTM_last_band_cropped_tif)
-    
+    write_raster_tif(pr_cropped_last_band, PTM_last_band_cropped_tif, output_profile)
+
+    nc_PTM_file.close()
 
 
 
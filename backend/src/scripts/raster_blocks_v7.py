@@ -0,0 +1,246 @@
+import os
+import numpy as np
+import rasterio
+import rasterio.shutil
+from dotenv import load_dotenv
+from xarray.conventions import encode_cf_variable
+
+try:
+    from clip_mask_v7 import clip_with_mask
+except ModuleNotFoundError:
+    from src.scripts.clip_mask_v7 import clip_with_mask
+
+###################################################################################################################################
+
+## Perfiles de salida de los archivos GeoTiff:
+#  - OUTPUT_PROFILES: Perfiles disponibles. "gtiff" es el GeoTiff sin comprimir y organizado por filas que genera "rio.to_raster",
+#    y "cog_deflate" y "cog_zstd" generan Cloud Optimized GeoTiff (COG), organizados en bloques de "blocksize" pixeles, comprimidos
+#    con DEFLATE o ZSTD con predictor (horizontal para enteros y de punto flotante para decimales), y con vistas reducidas
+#    ("overviews") internas, lo que reduce el tamaño de los archivos y abarata las lecturas de GeoServer.
+#  - SPI_ENCODINGS: Codificaciones disponibles para los archivos SPI de todas las bandas. "float32" guarda los valores tal cual,
+#    "float16" los guarda con media precision (16 bits, suficiente para un indice que varia entre -3.09 y 3.09), e "int16" los guarda
+#    como enteros escalados por "INT16_SCALE", con "INT16_NODATA" como valor sin dato. En ambos casos, GDAL y "rioxarray" (con
+#    "mask_and_scale=True") devuelven los valores originales al leer los archivos.
+
+OUTPUT_PROFILES = {
+    'gtiff': None,
+    'cog_deflate': {'compress': 'DEFLATE', 'predictor': 'YES', 'blocksize': 256, 'overviews': 'AUTO', 'overview_resampling': 'NEAREST'},
+    'cog_zstd': {'compress': 'ZSTD', 'predictor': 'YES', 'blocksize': 256, 'overviews': 'AUTO', 'overview_resampling': 'NEAREST'},
+}
+
+SPI_ENCODINGS = ['float32', 'float16', 'int16']
+
+INT16_SCALE = 0.001
+INT16_NODATA = -32768
+
+###################################################################################################################################
+
+## Funcion get_output_profile: Sirve para obtener el perfil de salida de los GeoTiff y la codificacion de los archivos SPI de todas
+#  las bandas, a partir de las variables "RASTER_OUTPUT_PROFILE" y "SPI_OUTPUT_ENCODING" del archivo ".env". Si no estan definidas,
+#  se utilizan "gtiff" y "float32", es decir, los mismos archivos que genera "rio.to_raster". Si el valor de alguna variable no es
+#  valido, se lanza un "ValueError".
+
+def get_output_profile():
+    dotenv_path = os.path.expanduser(os.path.join('~', 'EHCPA_SPI', 'backend', 'src', 'credentials', '.env'))
+    load_dotenv(dotenv_path)
+    output_profile = os.getenv('RASTER_OUTPUT_PROFILE') or 'gtiff'
+    spi_encoding = os.getenv('SPI_OUTPUT_ENCODING') or 'float32'
+
+    if output_profile not in OUTPUT_PROFILES:
+        raise ValueError(f"Perfil de salida no valido: {output_profile}")
+    if spi_encoding not in SPI_ENCODINGS:
+        raise ValueError(f"Codificacion de SPI no valida: {spi_encoding}")
+
+    return output_profile, spi_encoding
+
+###################################################################################################################################
+
+## Funcion write_clipped_bands_tif: Sirve para cortar sobre Argentina y guardar en GeoTiff un raster con todas las bandas (toda la
+#  serie temporal), procesando las bandas por bloques, de modo que nunca se carga la serie completa en memoria.
+#  1. La funcion recibe como parametros el raster (DataArray sin cargar en memoria, con las dimensiones espaciales y el CRS ya
+#     configurados), la mascara de corte de "load_clip_mask()", la ruta del archivo tif y la cantidad de bandas por bloque
+#     ("block_size"). La memoria utilizada queda acotada por "block_size" bandas, sin importar la longitud de la serie. Ademas
+#     recibe el perfil de salida ("output_profile") y la codificacion de los valores ("encoding").
+#  2. Se corta la primera banda con "clip_with_mask()" para obtener la grilla, el tipo de dato y el "nodata" del resultado, y se crea
+#     el archivo tif con la cantidad total de bandas, escribiendo los mismos metadatos que "rio.to_raster" mediante
+#     "write_raster_metadata()". Con la codificacion "int16" el archivo se crea con enteros y con el factor de escala "INT16_SCALE",
+#     y con "float16" se crea con 16 bits por valor ("nbits").
+#  3. Luego, para cada bloque de bandas, se leen unicamente dichas bandas del archivo netCDF, se cortan con "clip_with_mask()" y se
+#     escriben en su posicion del archivo tif.
+#  - El archivo se escribe primero con un nombre temporal y luego se renombra (o se convierte a COG) mediante "finish_tif()", para
+#    que nunca quede a medio escribir.
+
+def write_clipped_bands_tif(data_array, clip_mask, tif_file, block_size=12, output_profile='gtiff', encoding='float32'):
+    num_bands = data_array.sizes['time']
+
+    template = clip_with_mask(select_bands(data_array, 0, 1), clip_mask)
+    rasterio_dtype, _ = get_raster_dtypes(template)
+
+    nodata = template.rio.encoded_nodata
+    if nodata is None:
+        nodata = template.rio.nodata
+
+    creation_options = {}
+    if encoding == 'int16':
+        rasterio_dtype, nodata = 'int16', INT16_NODATA
+    elif encoding == 'float16':
+        creation_options['nbits'] = 16
+
+    temp_file = tif_file + '.TMP'
+    with rasterio.open(
+        temp_file, 'w', driver='GTiff', height=template.rio.height, width=template.rio.width, count=num_bands,
+        dtype=rasterio_dtype, crs=template.rio.crs, transform=template.rio.transform(), nodata=nodata, **creation_options
+    ) as dst:
+        write_raster_metadata(dst, template)
+        if encoding == 'int16':
+            dst.scales = (INT16_SCALE,) * num_bands
+            dst.offsets = (0.0,) * num_bands
+        write_clipped_bands(dst, data_array, clip_mask, 0, block_size)
+    finish_tif(temp_file, tif_file, output_profile)
+
+###################################################################################################################################
+
+## Funcion patch_clipped_bands_tif: Sirve para reescribir, en un GeoTiff de todas las bandas existente, las bandas a partir del
+#  indice "start_index" (base 0), cortandolas sobre Argentina por bloques de "block_size" bandas, igual que
+#  "write_clipped_bands_tif()". El raster recibido debe tener la serie completa, y solo se leen las bandas desde "start_index".
+#  - Con el perfil "gtiff" las bandas se reescriben sobre el mismo archivo. Un COG no se puede modificar sin perder su organizacion,
+#    por lo que se copia a un GeoTiff temporal, se reescriben las bandas sobre el mismo, y se vuelve a convertir a COG. La
+#    codificacion de los valores se mantiene, ya que se toma del archivo existente.
+
+def patch_clipped_bands_tif(data_array, clip_mask, tif_file, start_index, block_size=12, output_profile='gtiff'):
+    if OUTPUT_PROFILES[output_profile] is None:
+        with rasterio.open(tif_file, 'r+') as dst:
+            write_clipped_bands(dst, data_array, clip_mask, start_index, block_size)
+        return
+
+    temp_file = tif_file + '.TMP'
+    rasterio.shutil.copy(tif_file, temp_file, driver='GTiff')
+    with rasterio.open(temp_file, 'r+') as dst:
+        write_clipped_bands(dst, data_array, clip_mask, start_index, block_size)
+    finish_tif(temp_file, tif_file, output_profile)
+
+###################################################################################################################################
+
+## Funcion write_clipped_bands: Sirve para cortar y escribir en un archivo tif abierto las bandas del raster desde "start_index"
+#  hasta el final, de a "block_size" bandas. Los valores se codifican igual que en "rio.to_raster" (por ejemplo, reemplazando NaN
+#  por el "_FillValue" del archivo netCDF), y si el archivo es de enteros con factor de escala (codificacion "int16"), se dividen
+#  por dicho factor y se redondean, guardando el "nodata" del archivo en los pixeles sin dato.
+
+def write_clipped_bands(dst, data_array, clip_mask, start_index, block_size):
+    num_bands = data_array.sizes['time']
+    numpy_dtype = np.dtype(dst.dtypes[0])
+    scale = dst.scales[0]
+    block_size = max(1, int(block_size))
+
+    for block_start in range(start_index, num_bands, block_size):
+        block_end = min(block_start + block_size, num_bands)
+        cropped_block = clip_with_mask(select_bands(data_array, block_start, block_end), clip_mask)
+
+        if np.issubdtype(numpy_dtype, np.integer) and not np.issubdtype(cropped_block.dtype, np.integer):
+            values = cropped_block.values
+            invalid = ~np.isfinite(values)
+            if cropped_block.rio.nodata is not None and not np.isnan(cropped_block.rio.nodata):
+                invalid |= values == cropped_block.rio.nodata
+            limits = np.iinfo(numpy_dtype)
+            values = np.clip(np.round(np.where(invalid, 0, values) / scale), limits.min + 1, limits.max)
+            values = np.where(invalid, dst.nodata, values)
+        else:
+            values = encode_cf_variable(cropped_block.variable).values
+
+        dst.write(values.astype(numpy_dtype, copy=False), indexes=list(range(block_start + 1, block_end + 1)))
+
+###################################################################################################################################
+
+## Funcion write_raster_tif: Sirve para guardar en GeoTiff un raster pequeño (por ejemplo, el de la ultima banda), con el perfil de
+#  salida indicado. Se guarda con "rio.to_raster" en un archivo temporal, que luego reemplaza al final mediante "finish_tif()" 
+#  (convirtiendolo antes si el perfil es COG), para que quien lee la carpeta (por ejemplo, el endpoint "/point") nunca encuentre el 
+#  archivo a medio escribir.
+
+def write_raster_tif(data_array, tif_file, output_profile='gtiff'):
+    temp_file = tif_file + '.TMP'
+    data_array.rio.to_raster(temp_file, driver='GTiff')
+    finish_tif(temp_file, tif_file, output_profile)
+
+###################################################################################################################################
+
+## Funcion finish_tif: Sirve para reemplazar el archivo tif final por el archivo temporal ya escrito. Si el perfil es COG, el archivo
+#  temporal se convierte con el driver "COG" de GDAL (que lee el archivo por bloques, sin cargarlo completo en memoria) a un segundo
+#  archivo temporal, que luego reemplaza al final, y se elimina el primero.
+
+def finish_tif(temp_file, tif_file, output_profile):
+    cog_options = OUTPUT_PROFILES[output_profile]
+    if cog_options is None:
+        os.replace(temp_file, tif_file)
+        return
+
+    cog_temp_file = tif_file + '.COG.TMP'
+    try:
+        rasterio.shutil.copy(temp_file, cog_temp_file, driver='COG', **cog_options)
+        os.replace(cog_temp_file, tif_file)
+    finally:
+        for path in [temp_file, cog_temp_file]:
+            if os.path.exists(path):
+                os.remove(path)
+
+###################################################################################################################################
+
+## Funcion is_output_profile: Sirve para verificar si un GeoTiff existente fue generado con el perfil de salida y la codificacion
+#  indicados, comparando su organizacion (COG o no), su compresion y su tipo de dato. Si no coinciden, el archivo se debe regenerar.
+
+def is_output_profile(tif_file, output_profile, encoding='float32'):
+    cog_options = OUTPUT_PROFILES[output_profile]
+
+    with rasterio.open(tif_file) as src:
+        layout = src.tags(ns='IMAGE_STRUCTURE').get('LAYOUT')
+        compression = src.compression.name.upper() if src.compression else None
+        nbits = src.tags(1, ns='IMAGE_STRUCTURE').get('NBITS')
+        dtype = src.dtypes[0]
+
+    if cog_options is None:
+        layout_ok = layout != 'COG' and compression is None
+    else:
+        layout_ok = layout == 'COG' and compression == cog_options['compress']
+
+    if encoding == 'int16':
+        encoding_ok = dtype == 'int16'
+    elif encoding == 'float16':
+        encoding_ok = dtype == 'float32' and nbits == '16'
+    else:
+        encoding_ok = dtype != 'int16' and nbits is None
+
+    return layout_ok and encoding_ok
+
+###################################################################################################################################
+
+## Funcion select_bands: Sirve para seleccionar las bandas desde "start" hasta "end" (sin incluir) del raster, conservando las
+#  dimensiones espaciales y el CRS configurados, que "isel" no conserva.
+
+def select_bands(data_array, start, end):
+    bands = data_array.isel(time=slice(start, end)).rio.set_spatial_dims(data_array.rio.x_dim, data_array.rio.y_dim)
+    return bands.rio.write_crs(data_array.rio.crs)
+
+###################################################################################################################################
+
+## Funciones get_raster_dtypes y write_raster_metadata: Sirven para obtener el tipo de dato con el que se guarda el raster (el de
+#  su codificacion en el archivo netCDF, si existe), y para escribir en el archivo tif los atributos del raster como etiquetas y su
+#  "long_name" como descripcion de cada banda, con el mismo criterio que "rio.to_raster".
+
+def get_raster_dtypes(data_array):
+    rasterio_dtype = data_array.encoding.get('rasterio_dtype', data_array.encoding.get('dtype', str(data_array.dtype)))
+    return str(rasterio_dtype), np.dtype(rasterio_dtype)
+
+
+def write_raster_metadata(dst, data_array):
+    skip_tags = (
+        '_FillValue', 'missing_value', 'fill_value', 'nodata', 'nodatavals', 'is_tiled', 'res',
+        'crs', 'transform', 'scales', 'scale_factor', 'add_offset', 'offsets', 'grid_mapping'
+    )
+    tags = {key: value for key, value in data_array.attrs.items() if key not in skip_tags}
+    if not isinstance(tags.get('long_name'), str):
+        tags.pop('long_name', None)
+    dst.update_tags(**tags)
+
+    band_description = data_array.attrs.get('long_name') or data_array.name
+    if isinstance(band_description, str) and band_description:
+        for band in range(1, dst.count + 1):
+            dst.set_band_description(band, band_description)
@@ -1,15 +1,11 @@
 import os
+import glob
+import json
 import shutil
-import locale
-import platform
 import xarray as xr
 import rioxarray
-import numpy as np
-import fiona
 import rasterio
-import rasterio.mask
-from datetime import datetime
-from dateutil.relativedelta import relativedelta
+from concurrent.futures import ProcessPoolExecutor
 
 try:
     from get_dates_v7 import get_calibration_date 
@@ -17,22 +13,45 @@ except ModuleNotFoundError:
     from src.scripts.get_dates_v7 import get_calibration_date
 
 try:
-    from sleep_for_a_bit_v7 import sleep_for_a_bit 
+    from clip_mask_v7 import load_clip_mask, clip_with_mask
 except ModuleNotFoundError:
-    from src.scripts.sleep_for_a_bit_v7 import sleep_for_a_bit
+    from src.scripts.clip_mask_v7 import load_clip_mask, clip_with_mask
+
+try:
+    from wait_until_v7 import wait_for_path, wait_for_path_removed
+except ModuleNotFoundError:
+    from src.scripts.wait_until_v7 import wait_for_path, wait_for_path_removed
+
+try:
+    from raster_blocks_v7 import write_clipped_bands_tif, patch_clipped_bands_tif, write_raster_tif, get_output_profile, is_output_profile
+except ModuleNotFoundError:
+    from src.scripts.raster_blocks_v7 import write_clipped_bands_tif, patch_clipped_bands_tif, write_raster_tif, get_output_profile, is_output_profile
 
 ###################################################################################################################################
 
 ## Funcion spi_convertion_and_crop: Sirve para convertir los archivos del Indice de Precipitación Estandarizado (SPI) de formato 
 #  netCDF a GeoTiff, para luego obtener los archivos de SPI de todas las bandas para la descarga, y los archivos con la ultima banda 
 #  para ser subidos al servidor de GeoServer, aplicando ademas para todos los archivos el corte sobre Argentina.
-
-def spi_convertion_and_crop():
+#  - La funcion recibe como parametro "incremental", que por defecto es "True", e indica que los archivos de todas las bandas 
+#    existentes no se regeneran, sino que solo se reescriben las bandas que "spi_process()" registro como modificadas en 
+#    "spi_state.json". Si la cantidad de bandas cambio (un mes nuevo) o no hay registro de cambios, el archivo se regenera completo.
+#  - Y recibe el parametro "max_workers", que indica la cantidad de escalas que se procesan en paralelo, cada una en un proceso 
+#    separado. Con "max_workers=1" las escalas se procesan una despues de la otra, en el mismo proceso.
+#  - Y recibe el parametro "block_size", que indica la cantidad de bandas que se leen, cortan y escriben a la vez en los archivos de 
+#    todas las bandas, por lo que la memoria utilizada por cada escala no crece con la longitud de la serie.
+#  - Y recibe los parametros "output_profile" y "spi_encoding", que indican el perfil de salida de todos los archivos ("gtiff" o 
+#    COG, ver "OUTPUT_PROFILES") y la codificacion de los valores de los archivos de todas las bandas ("float32", "float16" o 
+#    "int16", ver "SPI_ENCODINGS"). Los archivos de la ultima banda siempre se guardan en "float32", ya que los estilos de GeoServer
+#    se aplican sobre los valores originales. Si no se indican, se toman del archivo ".env" mediante "get_output_profile()".
+
+def spi_convertion_and_crop(incremental=True, max_workers=4, block_size=12, output_profile=None, spi_encoding=None):
 
     ## Distribucion de carpetas/directorios:
     #
     #   - SPI_gamma_reord_dir: Carpeta donde se encuentran todos los archivos SPI reordenados en formato netCDF.
+    #   - SPI_state_file: Archivo donde "spi_process()" registra, por escala, desde que banda cambio el SPI.
     #   - ARG_ShapeFiles_dir: Carpeta donde se encuentra el archivo shape de Argentina para realizar el corte.
+    #   - clip_mask_file: Archivo donde se guarda la mascara de corte de Argentina para la grilla IMERG, compartida con el PTM.
     #   - output_dir: Carpeta donde se guardan todos los archivos resultantes.
     #   - downloable_data_dir: Carpeta donde se guardan todos los archivos resultantes de PTM y SPI para ser descargados.
     #   - downloable_data_SPI_dir: Carpeta donde se van a guardar todos los archivo SPI cortados con todas las bandas, 
@@ -44,108 +63,212 @@ def spi_convertion_and_crop():
     #
     #   - Si la carpeta output, downloable_data y geoserver_EHCPA_dir no existen, se crean.
     #   - Para las carpetas downloable_data_SPI_dir y geoserver_SPI_dir, en caso de que estas existan, al momento de 
-    #     ejecutar el proceso, estas se borran y vuelven a crear vacias, y en caso de que no existan, solo se crean.
+    #     ejecutar el proceso, estas se borran y vuelven a crear vacias, y en caso de que no existan, solo se crean. En el 
+    #     modo incremental estas carpetas no se borran, ya que se actualizan los archivos existentes.
+    #   - Luego de crear o borrar cada carpeta, en lugar de pausar el proceso un tiempo fijo, se espera a que la carpeta exista
+    #     (o deje de existir) mediante "wait_for_path()" y "wait_for_path_removed()".
 
     SPI_gamma_reord_dir = os.path.expanduser(os.path.join('~', 'EHCPA_SPI', 'backend', 'src', 'input', 'SPI', 'SPI_gamma_reord'))
 
+    SPI_state_file = os.path.expanduser(os.path.join('~', 'EHCPA_SPI', 'backend', 'src', 'input', 'SPI', 'SPI_params', 'spi_state.json'))
+
     ARG_ShapeFiles_dir = os.path.expanduser(os.path.join('~', 'EHCPA_SPI', 'backend', 'src', 'ShapeFiles', 'Argentina'))
     shp_file = os.path.join(ARG_ShapeFiles_dir, 'Argentina.shp')
 
+    clip_mask_file = os.path.expanduser(os.path.join('~', 'EHCPA_SPI', 'backend', 'src', 'input', 'clip_mask', 'ARG_IMERG_clip_mask.npz'))
+
     output_dir = os.path.expanduser(os.path.join('~', 'EHCPA_SPI', 'backend', 'src', 'output'))
 
     if not os.path.exists(output_dir):
         os.makedirs(output_dir)
-    sleep_for_a_bit(20)
+    wait_for_path(output_dir)
 
     downloable_data_dir = os.path.expanduser(os.path.join('~', 'EHCPA_SPI', 'backend', 'src', 'output', 'downloable_data'))
 
     if not os.path.exists(downloable_data_dir):
         os.makedirs(downloable_data_dir)
-    sleep_for_a_bit(20)
+    wait_for_path(downloable_data_dir)
 
     downloable_data_SPI_dir = os.path.expanduser(os.path.join('~', 'EHCPA_SPI', 'backend', 'src', 'output', 'downloable_data', 'SPI'))
 
-    if os.path.exists(downloable_data_SPI_dir):
+    if os.path.exists(downloable_data_SPI_dir) and not incremental:
         shutil.rmtree(downloable_data_SPI_dir)
-        sleep_for_a_bit(20) 
+        wait_for_path_removed(downloable_data_SPI_dir)
         os.makedirs(downloable_data_SPI_dir)
-    else:
+    elif not os.path.exists(downloable_data_SPI_dir):
         os.makedirs(downloable_data_SPI_dir)
-    sleep_for_a_bit(20)
+    wait_for_path(downloable_data_SPI_dir)
 
     geoserver_dir = os.path.expanduser(os.path.join('~', 'EHCPA_SPI', 'backend', 'src', 'output', 'geoserver'))
 
     if not os.path.exists(geoserver_dir):
         os.makedirs(geoserver_dir)
-    sleep_for_a_bit(20)
+    wait_for_path(geoserver_dir)
 
     geoserver_SPI_dir = os.path.join(geoserver_dir, 'SPI')
 
-    if os.path.exists(geoserver_SPI_dir):
+    if os.path.exists(geoserver_SPI_dir) and not incremental:
         shutil.rmtree(geoserver_SPI_dir)
-        sleep_for_a_bit(20)
+        wait_for_path_removed(geoserver_SPI_dir)
         os.makedirs(geoserver_SPI_dir)
-    else:
+    elif not os.path.exists(geoserver_SPI_dir):
         os.makedirs(geoserver_SPI_dir)
-    sleep_for_a_bit(20)
+    wait_for_path(geoserver_SPI_dir)
 
     ###################################################################################################################################
 
-    ## PASO 1: Proceso de conversion de archivos "SPI" en formato netCDF a GeoTiff, generando dos archivos, uno que incluya todas las 
-    #  bandas para ser descargado, y otro con solo la ultima banda para su implementacion en GeoServer.
-    #  1. Inicializamos los archivos SPI a traves de un bucle ya que debemos seleccionar todos y los identificamos a traves de las 
-    #     escalas. Para todas las escalas seleccionamos la variable de interes que es "spi_gamma_{scale}_month". 
-    #  2. Para el caso de los archivos tif con todas las bandas, unicamente se configuran las dimensiones espaciales y se aplica el CRS 
-    #     (sistema de referencia de coordenadas). Y para los archivos tif de la ultima banda, es lo mismo solo que seleccionamos 
-    #     justamente la ultima banda a traves de "isel". 
+    ## PASO 1: Preparacion del corte y de los cambios pendientes.
+    #  1. Se obtiene la mascara de corte de Argentina mediante "load_clip_mask()", a partir de la grilla del SPI de la primera escala 
+    #     (todas las escalas comparten la grilla IMERG), que solo vuelve a leer y rasterizar el shapefile si cambio el mismo o la 
+    #     grilla. La misma mascara se aplica a todas las bandas de todas las escalas.
+    #  2. Para asignar el mes y año de calibracion del SPI de todas las bandas, extraemos dichos valores de la funcion 
+    #     "get_calibration_date()".
+    #  3. En el modo incremental, leemos de "spi_state.json" el indice de la primera banda modificada de cada escala. Si el archivo no
+    #     existe (por ejemplo, porque "spi_process()" se ejecuto con el motor "cli", que lo elimina), se regeneran todas las escalas.
 
     spi_scales = ['1', '2', '3', '6', '9', '12', '24', '36', '48', '60', '72']
-    
-    for scale in spi_scales:
-        spi_nc_file = os.path.join(SPI_gamma_reord_dir, f'spi_gamma_{scale}_reord.nc4')
-        
-        nc_spi_file = xr.open_dataset(spi_nc_file)
-        spi_data = nc_spi_file[f'spi_gamma_{scale}_month'] 
 
-        spi_all_bands = spi_data.rio.set_spatial_dims('lon', 'lat')
-        spi_all_bands.rio.write_crs("epsg:4326", inplace=True)
+    with xr.open_dataset(os.path.join(SPI_gamma_reord_dir, f'spi_gamma_{spi_scales[0]}_reord.nc4')) as nc_spi_file:
+        spi_grid = nc_spi_file[f'spi_gamma_{spi_scales[0]}_month'].isel(time=-1).rio.set_spatial_dims('lon', 'lat')
+        spi_grid = spi_grid.rio.write_crs("epsg:4326")
+        clip_mask = load_clip_mask(spi_grid, shp_file, clip_mask_file)
+
+    calibration_end_year, calibration_end_month = get_calibration_date()
 
-        spi_last_band = spi_data.isel(time=-1)
-        spi_last_band = spi_last_band.rio.set_spatial_dims('lon', 'lat')
-        spi_last_band.rio.write_crs("epsg:4326", inplace=True)
+    default_output_profile, default_spi_encoding = get_output_profile()
+    output_profile = output_profile or default_output_profile
+    spi_encoding = spi_encoding or default_spi_encoding
+
+    spi_state = read_spi_state(SPI_state_file) if incremental else None
+    pending_changes = spi_state.get('scales', {}) if spi_state else None
 
     ###################################################################################################################################
 
-    ## PASO 2: Proceso de corte de ambos archivos tif generados, sobre el archivo shape de Argentina.
-    #  1. Se abre el shapefile que contiene el contorno de Argentina. Ahora, para asignar el mes y año de calibracion del SPI de todas 
-    #     las bandas, extraemos dichos valores de la funcion "get_calibration_date()". Por otro lado, calculamos el tercer dia del proximo 
-    #     año, le restamos 1 al año, del tercer dia del proximo año, para la comparacion. Ahora bien, para la asignacion del final del 
-    #     año de calibracion:
-    #     - Si la fecha actual es mayor o igual al tercer dia del proximo año de la comparacion, se asigna el año del tercer dia de 
-    #       comparacion.
-    #     - Si la fecha actual es mayor o igual al primer dia del proximo año de la comparacion, y menor al tercer dia del proximo año 
-    #       de comparacion, se asigna el año actual menos uno.
-    #     - Caso contrario, se asigna el año actual.
-    #  2. Finalmente hacemos el corte espacial en ambos archivos. Para ambos casos se recortan utilizando el contorno geografico de 
-    #     Argentina y se almacenan en las variables "spi_cropped_...", luego se define el nombre y la ubicacion de donde seran guardados 
-    #     ambos archivos, y por utlimo los archivos tif cortados se guardan en la ruta especificada. 
-
-        with fiona.open(shp_file, "r") as shapefile:
-            shapes = [feature["geometry"] for feature in shapefile]
-        
-        locale.setlocale(locale.LC_TIME, 'es_ES.UTF-8')
-
-        calibration_end_year, calibration_end_month = get_calibration_date()
-
-        spi_cropped_all_bands = spi_all_bands.rio.clip(shapes, spi_data.rio.crs)
-        SPI_all_bands_cropped_tif = os.path.join(downloable_data_SPI_dir, f'SPI_jun_2000_{calibration_end_month.rstrip(".")}_{calibration_end_year}_scale_{scale}_all_bands_ARG_cropped.tif')
-        spi_cropped_all_bands.rio.to_raster(SPI_all_bands_cropped_tif)
-
-        spi_cropped_last_band = spi_last_band.rio.clip(shapes, spi_data.rio.crs)
-        SPI_last_band_cropped_tif = os.path.join(geoserver_SPI_dir, f'SPI_jun_2000_present_scale_{scale}_last_band_ARG_cropped.tif')
-        spi_cropped_last_band.rio.to_raster(SPI_last_band_cropped_tif)
-
-        print(f"Conversión y recorte completados para escala SPI {scale}")
+    ## PASO 2: Proceso de conversion y corte de cada escala mediante "spi_scale_convertion_and_crop()".
+    #  1. Las escalas son independientes entre si, ya que cada una lee y escribe sus propios archivos. Por lo tanto, si "max_workers" 
+    #     es mayor a 1, se reparten entre un grupo de procesos ("ProcessPoolExecutor"), y se espera a que finalicen todas. Los errores 
+    #     de una escala se relanzan al obtener su resultado.
+    #  2. Una vez procesadas todas las escalas, en el modo incremental se vacian los cambios pendientes de "spi_state.json", ya que 
+    #     fueron aplicados.
+
+    scale_args = [
+        (scale, SPI_gamma_reord_dir, downloable_data_SPI_dir, geoserver_SPI_dir, clip_mask,
+         calibration_end_month, calibration_end_year, 0 if pending_changes is None else pending_changes.get(scale), block_size,
+         output_profile, spi_encoding)
+        for scale in spi_scales
+    ]
+
+    if max_workers > 1:
+        with ProcessPoolExecutor(max_workers=min(max_workers, len(spi_scales))) as executor:
+            futures = [executor.submit(spi_scale_convertion_and_crop, *args) for args in scale_args]
+            for future in futures:
+                future.result()
+    else:
+        for args in scale_args:
+            spi_scale_convertion_and_crop(*args)
+
+    if spi_state is not None:
+        spi_state['scales'] = {}
+        write_spi_state(SPI_state_file, spi_state)
+
+###################################################################################################################################
+
+## Funcion spi_scale_convertion_and_crop: Sirve para convertir y cortar el SPI de una escala.
+#
+#  PASO 1: Proceso de conversion del archivo "SPI" en formato netCDF a GeoTiff, generando dos archivos, uno que incluya todas las 
+#  bandas para ser descargado, y otro con solo la ultima banda para su implementacion en GeoServer.
+#  1. Inicializamos el archivo SPI de la escala, sin cargarlo en memoria, y seleccionamos la variable de interes que es 
+#     "spi_gamma_{scale}_month". 
+#  2. Para el caso del archivo tif con todas las bandas, unicamente se configuran las dimensiones espaciales y se aplica el CRS 
+#     (sistema de referencia de coordenadas). Y para el archivo tif de la ultima banda, es lo mismo solo que seleccionamos 
+#     justamente la ultima banda a traves de "isel". 
+#
+#  PASO 2: Proceso de corte de ambos archivos tif generados, sobre el archivo shape de Argentina, mediante "clip_with_mask()" con la 
+#  mascara de corte "clip_mask" recibida por parametro.
+#  1. Para el archivo de todas las bandas, recibimos por parametro "pending_index", que es el indice de la primera banda modificada:
+#     - Si es None y ya existe el archivo de la escala con la misma cantidad de bandas, no se reescribe (solo se renombra si cambio 
+#       el mes de calibracion).
+#     - Si es mayor a 0 y ya existe el archivo de la escala con la misma cantidad de bandas, se cortan unicamente las bandas desde 
+#       dicho indice y se escriben sobre el archivo existente mediante "patch_clipped_bands_tif()".
+#     - Caso contrario, se corta la serie completa y se regenera el archivo mediante "write_clipped_bands_tif()", eliminando el 
+#       archivo anterior de la escala.
+#     En ambos casos las bandas se leen, cortan y escriben de a "block_size" bandas.
+#     Si el archivo existente no fue generado con el perfil de salida y la codificacion actuales (ver "is_output_profile()"), 
+#     siempre se regenera completo.
+#  2. El archivo de la ultima banda siempre se corta y se guarda, ya que es pequeño.
+
+def spi_scale_convertion_and_crop(scale, SPI_gamma_reord_dir, downloable_data_SPI_dir, geoserver_SPI_dir, clip_mask,
+                                  calibration_end_month, calibration_end_year, pending_index=0, block_size=12,
+                                  output_profile='gtiff', spi_encoding='float32'):
+
+    spi_nc_file = os.path.join(SPI_gamma_reord_dir, f'spi_gamma_{scale}_reord.nc4')
+    
+    nc_spi_file = xr.open_dataset(spi_nc_file)
+    spi_data = nc_spi_file[f'spi_gamma_{scale}_month'] 
+
+    spi_all_bands = spi_data.rio.set_spatial_dims('lon', 'lat')
+    spi_all_bands.rio.write_crs("epsg:4326", inplace=True)
+
+    spi_last_band = spi_data.isel(time=-1)
+    spi_last_band = spi_last_band.rio.set_spatial_dims('lon', 'lat')
+    spi_last_band.rio.write_crs("epsg:4326", inplace=True)
+
+    SPI_all_bands_cropped_tif = os.path.join(downloable_data_SPI_dir, f'SPI_jun_2000_{calibration_end_month.rstrip(".")}_{calibration_end_year}_scale_{scale}_all_bands_ARG_cropped.tif')
+
+    previous_tifs = glob.glob(os.path.join(downloable_data_SPI_dir, f'SPI_jun_2000_*_scale_{scale}_all_bands_ARG_cropped.tif'))
+    previous_tif = previous_tifs[0] if len(previous_tifs) == 1 else None
+
+    num_bands = spi_data.sizes['time']
+    previous_bands = get_band_count(previous_tif) if previous_tif else None
+    if previous_bands is not None and not is_output_profile(previous_tif, output_profile, spi_encoding):
+        previous_bands = None
+
+    if previous_bands == num_bands and pending_index is None:
+        os.replace(previous_tif, SPI_all_bands_cropped_tif)
+        print(f"SPI escala {scale} sin cambios, se conserva el archivo de todas las bandas")
+    elif previous_bands == num_bands and pending_index > 0:
+        patch_clipped_bands_tif(spi_all_bands, clip_mask, previous_tif, pending_index, block_size, output_profile)
+        os.replace(previous_tif, SPI_all_bands_cropped_tif)
+        print(f"SPI escala {scale}: actualizadas {num_bands - pending_index} banda(s) del archivo de todas las bandas")
+    else:
+        for previous in previous_tifs:
+            os.remove(previous)
+        write_clipped_bands_tif(spi_all_bands, clip_mask, SPI_all_bands_cropped_tif, block_size, output_profile, spi_encoding)
+
+    spi_cropped_last_band = clip_with_mask(spi_last_band, clip_mask)
+    SPI_last_band_cropped_tif = os.path.join(geoserver_SPI_dir, f'SPI_jun_2000_present_scale_{scale}_last_band_ARG_cropped.tif')
+    write_raster_tif(spi_cropped_last_band, SPI_last_band_cropped_tif, output_profile)
+
+    nc_spi_file.close()
+
+    print(f"Conversión y recorte completados para escala SPI {scale}")
+
+###################################################################################################################################
+
+## Funcion get_band_count: Sirve para obtener la cantidad de bandas de un GeoTiff.
+
+def get_band_count(tif_file):
+    with rasterio.open(tif_file) as src:
+        return src.count
+
+###################################################################################################################################
+
+## Funciones read_spi_state y write_spi_state: Sirven para leer y guardar el archivo "spi_state.json" generado por "spi_process()". 
+#  Si el archivo no existe, se retorna None y todas las escalas se regeneran completas.
+
+def read_spi_state(SPI_state_file):
+    try:
+        with open(SPI_state_file, 'r') as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return None
+
+
+def write_spi_state(SPI_state_file, spi_state):
+    temp_state_file = SPI_state_file + '.TMP'
+    with open(temp_state_file, 'w') as f:
+        json.dump(spi_state, f, indent=2)
+    os.replace(temp_state_file, SPI_state_file)
 
 
 
@@ -0,0 +1,420 @@
+import os
+import json
+import warnings
+import netCDF4
+import numpy as np
+import xarray as xr
+import scipy.special
+
+###################################################################################################################################
+
+## Funcion spi_native_process: Sirve para calcular el Indice de Precipitacion Estandarizado (SPI) Gamma en Python, con NumPy/SciPy,
+#  sobre el archivo "IMERG_reord_lat_fix.nc4" (lat,lon,time), sin utilizar el comando externo "spi".
+#  1. La funcion recibe como parametros el archivo reordenado, la carpeta donde se guardan los SPI reordenados (time,lat,lon), la
+#     carpeta donde se guardan los parametros Gamma ajustados, la lista de escalas, el año de inicio y fin de calibracion, el
+#     manifiesto de "concat_reord" y la bandera "incremental".
+#  2. Obtenemos el año y el mes calendario de cada paso de tiempo. Comparando los acumulados mensuales del manifiesto de
+#     "concat_reord" con los registrados en "spi_state.json" en la ultima ejecucion, obtenemos el indice del primer mes que cambio.
+#  3. Para cada escala, si el modo es incremental y existen el SPI anterior y los parametros Gamma del periodo de calibracion actual,
+#     se calculan unicamente los pasos de tiempo desde el primer mes que cambio mediante "update_spi_scale()". Caso contrario (por
+#     ejemplo, cuando cambia el año de calibracion) se recalcula la serie completa mediante "compute_spi_scale()".
+#  4. Finalmente se guarda "spi_state.json" con los acumulados mensuales procesados y, por escala, el indice del primer paso de
+#     tiempo pendiente de convertir (0 si se recalculo completo, o None si no cambio), para que "spi_convertion_and_crop()" solo 
+#     actualice las bandas modificadas. Si la conversion todavia no consumio los cambios de una ejecucion anterior, se conserva 
+#     el menor de ambos indices.
+
+def spi_native_process(reord_file, SPI_gamma_reord_dir, SPI_params_dir, spi_scales, calibration_start_year, calibration_end_year,
+                       cube_manifest_file=None, incremental=True):
+
+    state_file = os.path.join(SPI_params_dir, 'spi_state.json')
+
+    cube_files = read_json_key(cube_manifest_file, 'monthly_files') if cube_manifest_file else None
+    previous_files = read_json_key(state_file, 'monthly_files')
+    pending_changes = read_json_key(state_file, 'scales') or {}
+
+    first_changed_index = get_first_changed_index(previous_files, cube_files)
+
+    if os.path.exists(state_file):
+        os.remove(state_file)
+
+    scale_changes = {}
+
+    with xr.open_dataset(reord_file) as ds:
+        precip = ds['precipitation'].transpose('lat', 'lon', 'time')
+        coords = {'time': ds['time'].load(), 'lat': ds['lat'].load(), 'lon': ds['lon'].load()}
+        time_encoding = {k: v for k, v in ds['time'].encoding.items() if k in ('units', 'calendar', 'dtype')}
+
+        years = coords['time'].dt.year.values
+        months = coords['time'].dt.month.values - 1
+        precip_values = None
+
+        for scale in spi_scales:
+            scale = int(scale)
+            output_spi_file = os.path.join(SPI_gamma_reord_dir, f'spi_gamma_{scale}_reord.nc4')
+
+            start_index = None
+            if incremental:
+                start_index = update_spi_scale(
+                    precip, output_spi_file, scale, months, first_changed_index,
+                    calibration_start_year, calibration_end_year, SPI_params_dir
+                )
+
+            if start_index == 0 or not incremental:
+                if precip_values is None:
+                    precip_values = precip.values.astype(np.float64)
+
+                compute_spi_scale(
+                    precip_values, output_spi_file, scale, years, months, coords, time_encoding,
+                    calibration_start_year, calibration_end_year, SPI_params_dir
+                )
+                start_index = 0
+
+            if start_index is None:
+                print(f"SPI escala {scale} sin cambios")
+            else:
+                print(f"SPI escala {scale} calculado desde el paso de tiempo {start_index}")
+
+            pending_index = pending_changes.get(str(scale))
+            if pending_index is not None:
+                start_index = pending_index if start_index is None else min(start_index, pending_index)
+
+            scale_changes[str(scale)] = start_index
+
+    temp_state_file = state_file + '.TMP'
+    with open(temp_state_file, 'w') as f:
+        json.dump({'monthly_files': cube_files, 'scales': scale_changes}, f, indent=2)
+    os.replace(temp_state_file, state_file)
+
+    return scale_changes
+
+###################################################################################################################################
+
+## Funcion compute_spi_scale: Sirve para calcular la serie completa de SPI de una escala.
+#  1. Calculamos las sumas moviles de precipitacion, obtenemos los parametros Gamma de cada mes calendario y pixel mediante
+#     "load_or_fit_gamma_params()", que solo ajusta la distribucion si los parametros guardados no corresponden al periodo de
+#     calibracion actual, y transformamos las sumas a SPI con "gamma_to_spi()".
+#  2. Se guarda el SPI con el mismo nombre de archivo y variable que generaba el reordenamiento con "ncpdq", es decir,
+#     "spi_gamma_{scale}_reord.nc4" con la variable "spi_gamma_{scale}_month", y se guardan las ultimas sumas moviles para las
+#     actualizaciones incrementales.
+
+def compute_spi_scale(precip_values, output_spi_file, scale, years, months, coords, time_encoding,
+                      calibration_start_year, calibration_end_year, SPI_params_dir):
+
+    sums = compute_rolling_sums(precip_values, scale)
+
+    alphas, betas, probs_zero = load_or_fit_gamma_params(
+        sums, years, months, scale, calibration_start_year, calibration_end_year, SPI_params_dir
+    )
+
+    spi_values = gamma_to_spi(sums, months, alphas, betas, probs_zero)
+
+    write_spi_file(output_spi_file, spi_values, scale, coords, time_encoding, calibration_start_year, calibration_end_year)
+
+    num_steps = sums.shape[-1]
+    save_rolling_sums(SPI_params_dir, scale, {t: sums[..., t] for t in range(max(0, num_steps - ROLLING_SUMS_CACHED_STEPS), num_steps)})
+
+###################################################################################################################################
+
+## Funcion update_spi_scale: Sirve para calcular unicamente los pasos de tiempo de SPI de una escala que pueden haber cambiado.
+#  1. Si no existe el SPI anterior, si fue calibrado con otro periodo, si no hay parametros Gamma guardados para el periodo actual,
+#     o si cambio el primer mes, se retorna 0 para indicar que debe recalcularse la serie completa.
+#  2. Los pasos a recalcular van desde el primer mes que cambio (o desde el final del SPI anterior si no cambio ningun mes) hasta el
+#     final de la serie. Si no hay pasos para recalcular, se retorna None.
+#  3. Las sumas moviles de dichos pasos se obtienen con "compute_trailing_rolling_sums()", se transforman a SPI con los parametros
+#     guardados, y se escriben sobre el archivo de SPI existente, agregando los pasos nuevos al final de la dimension "time".
+#  4. Se retorna el indice del primer paso recalculado.
+
+def update_spi_scale(precip, output_spi_file, scale, months, first_changed_index,
+                     calibration_start_year, calibration_end_year, SPI_params_dir):
+
+    num_steps = precip.sizes['time']
+
+    if not os.path.exists(output_spi_file):
+        return 0
+
+    with netCDF4.Dataset(output_spi_file, 'r') as spi_ds:
+        spi_var = spi_ds.variables[f'spi_gamma_{scale}_month']
+        previous_steps = len(spi_ds.dimensions['time'])
+        same_calibration = (
+            getattr(spi_var, 'calibration_start_year', None) == calibration_start_year
+            and getattr(spi_var, 'calibration_end_year', None) == calibration_end_year
+        )
+
+    params = load_gamma_params(SPI_params_dir, scale, calibration_start_year, calibration_end_year, precip.shape[:2])
+
+    if not same_calibration or params is None or previous_steps > num_steps:
+        return 0
+
+    start_index = previous_steps if first_changed_index is None else min(first_changed_index, previous_steps)
+
+    if start_index >= num_steps:
+        return None
+    if start_index == 0:
+        return 0
+
+    sums = compute_trailing_rolling_sums(precip, scale, start_index, SPI_params_dir)
+
+    alphas, betas, probs_zero = params
+    spi_values = gamma_to_spi(sums, months[start_index:], alphas, betas, probs_zero)
+
+    with netCDF4.Dataset(output_spi_file, 'a') as spi_ds:
+        spi_var = spi_ds.variables[f'spi_gamma_{scale}_month']
+        time_var = spi_ds.variables['time']
+        time_values = precip['time'].values[start_index:].astype('datetime64[s]').tolist()
+
+        spi_var[start_index:num_steps, :, :] = np.moveaxis(spi_values, -1, 0).astype(np.float32)
+        time_var[start_index:num_steps] = netCDF4.date2num(time_values, time_var.units, getattr(time_var, 'calendar', 'standard'))
+
+    return start_index
+
+###################################################################################################################################
+
+## Funcion compute_trailing_rolling_sums: Sirve para calcular las sumas moviles desde el paso "start_index" hasta el final.
+#  1. Si entre las sumas moviles guardadas esta la del paso anterior a "start_index" (que no cambio) y no tiene valores faltantes,
+#     cada suma nueva se obtiene como la anterior, mas la precipitacion del mes que entra, menos la del mes que sale de la ventana.
+#     De esta forma solo se leen del archivo los meses que entran y salen, y no la ventana completa de cada escala.
+#  2. Caso contrario, se leen los ultimos meses necesarios para completar la ventana de la escala y se calculan las sumas con
+#     "compute_rolling_sums()".
+#  3. Se guardan las ultimas sumas moviles para la proxima actualizacion, y se retornan las sumas con dimensiones (lat,lon,time).
+
+def compute_trailing_rolling_sums(precip, scale, start_index, SPI_params_dir):
+    num_steps = precip.sizes['time']
+    cached_sums = load_rolling_sums(SPI_params_dir, scale)
+    previous_sum = cached_sums.get(start_index - 1)
+
+    if previous_sum is not None and not np.isnan(previous_sum).any():
+        needed = sorted({t for t in range(start_index, num_steps)} | {t - scale for t in range(start_index, num_steps) if t >= scale})
+        precip_needed = dict(zip(needed, np.moveaxis(precip.isel(time=needed).values.astype(np.float64), -1, 0)))
+
+        sums = []
+        running_sum = previous_sum
+        for t in range(start_index, num_steps):
+            running_sum = running_sum + precip_needed[t]
+            if t >= scale:
+                running_sum = running_sum - precip_needed[t - scale]
+            sums.append(running_sum)
+        sums = np.stack(sums, axis=-1)
+    else:
+        window_start = max(0, start_index - scale + 1)
+        window = precip.isel(time=slice(window_start, num_steps)).values.astype(np.float64)
+        sums = compute_rolling_sums(window, scale)[..., start_index - window_start:]
+
+    cached_sums = {t: s for t, s in cached_sums.items() if t < start_index}
+    cached_sums.update({start_index + i: sums[..., i] for i in range(sums.shape[-1])})
+    save_rolling_sums(SPI_params_dir, scale, {t: cached_sums[t] for t in sorted(cached_sums)[-ROLLING_SUMS_CACHED_STEPS:]})
+
+    return sums
+
+###################################################################################################################################
+
+## Funciones load_rolling_sums y save_rolling_sums: Sirven para leer y guardar las ultimas sumas moviles de una escala en
+#  "spi_rolling_sums_scale_{scale}.npz", como un diccionario {indice del paso de tiempo: suma (lat,lon)}. Se guardan los ultimos
+#  "ROLLING_SUMS_CACHED_STEPS" pasos, ya que normalmente solo cambia el mes en curso y se agrega, a lo sumo, un mes nuevo.
+
+ROLLING_SUMS_CACHED_STEPS = 3
+
+
+def load_rolling_sums(SPI_params_dir, scale):
+    sums_file = os.path.join(SPI_params_dir, f'spi_rolling_sums_scale_{scale}.npz')
+    try:
+        with np.load(sums_file) as cached:
+            return dict(zip(cached['indexes'].tolist(), cached['sums']))
+    except (OSError, KeyError, ValueError):
+        return {}
+
+
+def save_rolling_sums(SPI_params_dir, scale, sums_by_index):
+    sums_file = os.path.join(SPI_params_dir, f'spi_rolling_sums_scale_{scale}.npz')
+    temp_sums_file = sums_file + '.TMP.npz'
+    indexes = sorted(sums_by_index)
+    np.savez(temp_sums_file, indexes=np.array(indexes, dtype=np.int64), sums=np.stack([sums_by_index[t] for t in indexes]))
+    os.replace(temp_sums_file, sums_file)
+
+###################################################################################################################################
+
+## Funciones read_json_key y get_first_changed_index: Sirven para leer una clave de un archivo JSON (None si no existe), y para
+#  obtener el indice del primer acumulado mensual que cambio entre dos listas [nombre, tamaño, fecha de modificacion].
+#  - Si alguna de las listas no existe, se retorna 0, es decir, se considera que cambio toda la serie.
+#  - Si las listas son iguales, se retorna None.
+
+def read_json_key(json_file, key):
+    try:
+        with open(json_file, 'r') as f:
+            return json.load(f)[key]
+    except (OSError, ValueError, KeyError, TypeError):
+        return None
+
+
+def get_first_changed_index(previous_files, current_files):
+    if previous_files is None or current_files is None:
+        return 0
+
+    for index, (previous, current) in enumerate(zip(previous_files, current_files)):
+        if previous != current:
+            return index
+
+    if len(previous_files) == len(current_files):
+        return None
+    return min(len(previous_files), len(current_files))
+
+###################################################################################################################################
+
+## Funcion compute_rolling_sums: Sirve para calcular las sumas moviles de precipitacion de "scale" meses sobre la ultima dimension.
+#  1. Se calcula con sumas acumuladas, reemplazando los valores faltantes por cero, y se cuentan los faltantes de cada ventana de
+#     la misma manera. Las ventanas con algun valor faltante, y los primeros "scale - 1" meses, quedan como faltantes (NaN).
+
+def compute_rolling_sums(precip_values, scale):
+    missing = np.isnan(precip_values)
+    zero_pad = np.zeros(precip_values.shape[:-1] + (1,))
+
+    cumulative = np.concatenate([zero_pad, np.cumsum(np.where(missing, 0.0, precip_values), axis=-1)], axis=-1)
+    cumulative_missing = np.concatenate([zero_pad, np.cumsum(missing, axis=-1)], axis=-1)
+
+    sums = np.full(precip_values.shape, np.nan)
+    sums[..., scale - 1:] = cumulative[..., scale:] - cumulative[..., :-scale]
+    window_missing = cumulative_missing[..., scale:] - cumulative_missing[..., :-scale]
+    sums[..., scale - 1:][window_missing > 0] = np.nan
+
+    return sums
+
+###################################################################################################################################
+
+## Funcion fit_gamma_params: Sirve para ajustar la distribucion Gamma de las sumas moviles para cada mes calendario y pixel.
+#  1. Se toman las sumas de los años del periodo de calibracion correspondientes a cada mes calendario. La probabilidad de cero es la
+#     proporcion de sumas iguales a cero, sobre las sumas validas.
+#  2. Los parametros alfa (forma) y beta (escala) se estiman con la aproximacion de Thom a partir de las sumas positivas, como en la
+#     libreria "climate_indices": A = ln(media) - media(ln(x)), alfa = (1 + raiz(1 + 4A/3)) / 4A y beta = media / alfa.
+#  3. Se retornan los arreglos de alfas, betas y probabilidades de cero con dimensiones (mes, lat, lon).
+
+def fit_gamma_params(sums, years, months, calibration_start_year, calibration_end_year):
+    num_lat, num_lon = sums.shape[:2]
+    alphas = np.full((12, num_lat, num_lon), np.nan)
+    betas = np.full((12, num_lat, num_lon), np.nan)
+    probs_zero = np.full((12, num_lat, num_lon), np.nan)
+
+    calibration = (years >= calibration_start_year) & (years <= calibration_end_year)
+
+    with warnings.catch_warnings(), np.errstate(divide='ignore', invalid='ignore'):
+        warnings.simplefilter('ignore', category=RuntimeWarning)
+
+        for month in range(12):
+            values = sums[..., calibration & (months == month)]
+            if values.shape[-1] == 0:
+                continue
+
+            valid_count = np.sum(~np.isnan(values), axis=-1)
+            probs_zero[month] = np.sum(values == 0, axis=-1) / valid_count
+
+            positive = np.where(values > 0, values, np.nan)
+            means = np.nanmean(positive, axis=-1)
+            a = np.log(means) - np.nanmean(np.log(positive), axis=-1)
+
+            alphas[month] = (1 + np.sqrt(1 + 4 * a / 3)) / (4 * a)
+            betas[month] = means / alphas[month]
+
+    return alphas, betas, probs_zero
+
+###################################################################################################################################
+
+## Funcion load_or_fit_gamma_params: Sirve para reutilizar los parametros Gamma ya ajustados de una escala.
+#  1. Los parametros de cada escala se guardan en "spi_gamma_params_scale_{scale}.npz", junto con el periodo de calibracion con el
+#     que se ajustaron.
+#  2. Si "load_gamma_params()" encuentra parametros del periodo de calibracion actual y de la misma grilla, se retornan. Caso
+#     contrario, se ajustan nuevamente con "fit_gamma_params()" y se guardan, lo que ocurre cuando cambia el año de fin de
+#     calibracion.
+
+def load_or_fit_gamma_params(sums, years, months, scale, calibration_start_year, calibration_end_year, SPI_params_dir):
+    params = load_gamma_params(SPI_params_dir, scale, calibration_start_year, calibration_end_year, sums.shape[:2])
+
+    if params is not None:
+        print(f"Reutilizando parametros Gamma de la escala {scale} ({calibration_start_year}-{calibration_end_year})")
+        return params
+
+    print(f"Ajustando parametros Gamma de la escala {scale} ({calibration_start_year}-{calibration_end_year})")
+    alphas, betas, probs_zero = fit_gamma_params(sums, years, months, calibration_start_year, calibration_end_year)
+
+    params_file = os.path.join(SPI_params_dir, f'spi_gamma_params_scale_{scale}.npz')
+    temp_params_file = params_file + '.TMP.npz'
+    np.savez(
+        temp_params_file,
+        alphas=alphas,
+        betas=betas,
+        probs_zero=probs_zero,
+        calibration_start_year=calibration_start_year,
+        calibration_end_year=calibration_end_year,
+    )
+    os.replace(temp_params_file, params_file)
+
+    return alphas, betas, probs_zero
+
+###################################################################################################################################
+
+## Funcion load_gamma_params: Sirve para leer los parametros Gamma guardados de una escala. Se retorna None si no existen, o si
+#  fueron ajustados con otro periodo de calibracion u otra grilla.
+
+def load_gamma_params(SPI_params_dir, scale, calibration_start_year, calibration_end_year, grid_shape):
+    params_file = os.path.join(SPI_params_dir, f'spi_gamma_params_scale_{scale}.npz')
+
+    try:
+        with np.load(params_file) as params:
+            if (int(params['calibration_start_year']) == calibration_start_year
+                    and int(params['calibration_end_year']) == calibration_end_year
+                    and params['alphas'].shape[1:] == tuple(grid_shape)):
+                return params['alphas'], params['betas'], params['probs_zero']
+    except (OSError, KeyError, ValueError):
+        pass
+
+    return None
+
+###################################################################################################################################
+
+## Funcion gamma_to_spi: Sirve para transformar las sumas moviles en valores de SPI.
+#  1. Para cada paso de tiempo se toman los parametros de su mes calendario, y se calcula la probabilidad acumulada mixta, es decir,
+#     la probabilidad de cero mas la probabilidad Gamma de las sumas positivas: q + (1 - q) * G(x).
+#  2. La probabilidad se transforma a la distribucion normal estandar, y el resultado se limita al rango [-3.09, 3.09].
+#  3. La funcion recibe las sumas con dimensiones (lat,lon,time) y retorna el SPI con las mismas dimensiones.
+
+def gamma_to_spi(sums, months, alphas, betas, probs_zero):
+    alphas = np.moveaxis(alphas[months], 0, -1)
+    betas = np.moveaxis(betas[months], 0, -1)
+    probs_zero = np.moveaxis(probs_zero[months], 0, -1)
+
+    with np.errstate(divide='ignore', invalid='ignore'):
+        gamma_probs = scipy.special.gammainc(alphas, np.maximum(sums, 0) / betas)
+        gamma_probs = np.where(sums > 0, gamma_probs, 0.0)
+        probs = probs_zero + (1.0 - probs_zero) * gamma_probs
+        spi_values = scipy.special.ndtri(probs)
+
+    spi_values = np.clip(spi_values, -3.09, 3.09)
+    spi_values[np.isnan(sums)] = np.nan
+
+    return spi_values
+
+###################################################################################################################################
+
+## Funcion write_spi_file: Sirve para guardar el SPI de una escala con dimensiones (time,lat,lon) en formato netCDF.
+#  1. La variable se guarda como "spi_gamma_{scale}_month", con las coordenadas y unidades de tiempo del archivo de precipitacion, y
+#     registrando en sus atributos el periodo de calibracion. La dimension "time" se guarda como ilimitada.
+#  2. El archivo se escribe con un nombre temporal y luego se renombra, para no dejar archivos incompletos.
+
+def write_spi_file(output_spi_file, spi_values, scale, coords, time_encoding, calibration_start_year, calibration_end_year):
+    spi_data = xr.DataArray(
+        np.moveaxis(spi_values, -1, 0).astype(np.float32),
+        dims=('time', 'lat', 'lon'),
+        coords=coords,
+        attrs={
+            'long_name': f'SPI (Gamma), {scale}-month',
+            'valid_min': -3.09,
+            'valid_max': 3.09,
+            'calibration_start_year': calibration_start_year,
+            'calibration_end_year': calibration_end_year,
+        },
+    )
+
+    ds_out = xr.Dataset({f'spi_gamma_{scale}_month': spi_data})
+
+    encoding = {f'spi_gamma_{scale}_month': {'_FillValue': np.float32(np.nan)}, 'time': time_encoding}
+
+    temp_spi_file = output_spi_file + '.TMP'
+    ds_out.to_netcdf(temp_spi_file, encoding=encoding, unlimited_dims=['time'])
+    os.replace(temp_spi_file, output_spi_file)
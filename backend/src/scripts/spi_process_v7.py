@@ -5,17 +5,28 @@ from datetime import datetime
 from dateutil.relativedelta import relativedelta
 
 try:
-    from sleep_for_a_bit_v7 import sleep_for_a_bit 
+    from wait_until_v7 import wait_for_path, wait_for_path_removed, wait_for_file_released
 except ModuleNotFoundError:
-    from src.scripts.sleep_for_a_bit_v7 import sleep_for_a_bit
+    from src.scripts.wait_until_v7 import wait_for_path, wait_for_path_removed, wait_for_file_released
 
+try:
+    from spi_native_v7 import spi_native_process
+except ModuleNotFoundError:
+    from src.scripts.spi_native_v7 import spi_native_process
 
 ###################################################################################################################################
 
 ## Funcion spi_process: Sirve para calcular el Indice de Precipitacion Estandarizado (SPI) en escalas 1 2 3 6 9 12 24 36 48 60 72,
 #  mediante el procesamiento de los archivos de precipitacion mensual acumulada.
+#  - La funcion recibe como parametro "engine", que indica el motor utilizado:
+#    - "native" (por defecto): Se calcula el SPI en Python mediante "spi_native_process()", reutilizando los parametros Gamma 
+#      ajustados mientras no cambie el periodo de calibracion, y se generan directamente los archivos reordenados.
+#    - "cli": Se utiliza el comando externo "spi" y luego el reordenamiento con "ncpdq" de los pasos 1 y 2.
+#  - Y recibe el parametro "incremental", que por defecto es "True" y solo aplica al motor "native". Indica que solo se calculan 
+#    los pasos de tiempo afectados por los acumulados mensuales nuevos o modificados, registrados en el manifiesto de 
+#    "concat_reord". Cuando cambia el año de calibracion se recalcula la serie completa.
 
-def spi_process():
+def spi_process(engine='native', incremental=True):
 
     ## Distribucion de carpetas/directorios:
     #
@@ -23,10 +34,15 @@ def spi_process():
     #   - SPI_dir: Carpeta donde se van a guardar todos los resultados relacionados son el SPI.
     #   - SPI_gp_dir: Carpeta donde se van a guardar los SPI tanto Gamma como Pearson, crudos.
     #   - SPI_gamma_reord_dir: Carpeta donde se van a guardar los SPI gamma reordenados en time,lat,lon.
+    #   - SPI_params_dir: Carpeta donde se guardan los parametros Gamma ajustados por escala, para el motor "native".
     #
     #   - Si la carpeta SPI no existe, se la crea.
     #   - Para las carpetas SPI_gamma_pearson y SPI_gamma_reord, en caso de que estas existan, al momento de ejecutar 
     #     el proceso, estas se borran y vuelven a crear vacias, y en caso de que no existan, solo se crean.
+    #   - Con el motor "native" no se utiliza la carpeta SPI_gamma_pearson, y las carpetas SPI_gamma_reord y SPI_params 
+    #     no se borran, ya que cada archivo se reemplaza al escribirse y los parametros ajustados se reutilizan.
+    #   - Luego de crear o borrar cada carpeta, en lugar de pausar el proceso un tiempo fijo, se espera a que la carpeta exista
+    #     (o deje de existir) mediante "wait_for_path()" y "wait_for_path_removed()".
 
     concat_reord_dir = os.path.expanduser(os.path.join('~', 'EHCPA_SPI', 'backend', 'src', 'input', 'concat_reord'))
     reord_file = os.path.join(concat_reord_dir, 'IMERG_reord_lat_fix.nc4')
@@ -35,17 +51,44 @@ def spi_process():
 
     if not os.path.exists(SPI_dir):
         os.makedirs(SPI_dir)
-    sleep_for_a_bit(20)
+    wait_for_path(SPI_dir)
+
+    spi_scales = ['1', '2', '3', '6', '9', '12', '24', '36', '48', '60', '72']
+
+    if engine == 'native':
+        SPI_gamma_reord_dir = os.path.join(SPI_dir, 'SPI_gamma_reord')
+        SPI_params_dir = os.path.join(SPI_dir, 'SPI_params')
+
+        for directory in [SPI_gamma_reord_dir, SPI_params_dir]:
+            if not os.path.exists(directory):
+                os.makedirs(directory)
+
+        calibration_end_year = get_spi_calibration_end_year()
+
+        cube_manifest_file = os.path.join(concat_reord_dir, 'concat_reord_manifest.json')
+
+        return spi_native_process(
+            reord_file, SPI_gamma_reord_dir, SPI_params_dir, spi_scales, 2000, calibration_end_year,
+            cube_manifest_file=cube_manifest_file, incremental=incremental
+        )
+
+    ## Con el motor "cli" se regeneran todos los archivos del SPI, por lo que se elimina "spi_state.json" (que solo actualiza el motor
+    #  "native"). Asi, "spi_convertion_and_crop()" regenera completos los archivos de todas las bandas, en lugar de reutilizarlos con
+    #  los cambios pendientes de una ejecucion anterior, y la proxima ejecucion del motor "native" recalcula la serie completa.
+
+    SPI_state_file = os.path.join(SPI_dir, 'SPI_params', 'spi_state.json')
+    if os.path.exists(SPI_state_file):
+        os.remove(SPI_state_file)
 
     SPI_gp_dir = os.path.join(SPI_dir, 'SPI_gamma_pearson')
 
     if os.path.exists(SPI_gp_dir):
         shutil.rmtree(SPI_gp_dir)
-        sleep_for_a_bit(20)
+        wait_for_path_removed(SPI_gp_dir)
         os.makedirs(SPI_gp_dir)
     else:
         os.makedirs(SPI_gp_dir)
-    sleep_for_a_bit(160)
+    wait_for_path(SPI_gp_dir)
 
     SPI_gamma_reord_dir = os.path.join(SPI_dir, 'SPI_gamma_reord')
 
@@ -63,47 +106,23 @@ def spi_process():
                 # Eliminar el archivo renombrado
                 os.remove(temp_path)
                 print(f"Archivo eliminado: {file_path}")
-                sleep_for_a_bit(100)
+                wait_for_path_removed(temp_path)
             except Exception as e:
                 print(f"No se pudo eliminar el archivo {file_path}: {e}")
         shutil.rmtree(SPI_gamma_reord_dir)  # Elimina el directorio vacío
         os.makedirs(SPI_gamma_reord_dir)
     else:
         os.makedirs(SPI_gamma_reord_dir)
-    sleep_for_a_bit(60)
+    wait_for_path(SPI_gamma_reord_dir)
 
     ###################################################################################################################################
 
     ## PASO 1: Proceso de calculo de SPI.
-    #  1. Para determinar el final del año de calibracion, como primera medida obtenemos la fecha de actual, luego calculamos el primer 
-    #     dia del proximo año, y restamos 1 al año, del primer dia del proximo año, para la comparacion. Por otro lado, calculamos el 
-    #     tercer dia del proximo año, le restamos 1 al año, del tercer dia del proximo año, para la comparacion. Ahora bien, para la 
-    #     asignacion del final del año de calibracion:
-    #     - Si la fecha actual es mayor o igual al tercer dia del proximo año de la comparacion, se asigna el año del tercer dia de 
-    #       comparacion.
-    #     - Si la fecha actual es mayor o igual al primer dia del proximo año de la comparacion, y menor al tercer dia del proximo año 
-    #       de comparacion, se asigna el año actual menos uno.
-    #     - Caso contrario, se asigna el año actual.
+    #  1. Obtenemos el final del año de calibracion mediante "get_spi_calibration_end_year()".
     #  2. Luego, se ejecuta el comando del SPI, en funcion de sus parametros, lo que genera los archivos crudos del SPI en funcion de 
     #     Gamma y Pearson. Se ejecuta con "Popen" y el proceso espera hasta que finalice con "wait()".
 
-    today_date = datetime.today()
-
-    next_year_first_day = (today_date + relativedelta(years=1)).replace(day=1).replace(month=1)
-
-    comparison_first_day = next_year_first_day - relativedelta(years=1)
-
-    next_year_third_day = (today_date + relativedelta(years=1)).replace(day=3).replace(month=1)
-
-    comparison_third_day = next_year_third_day - relativedelta(years=1)
-
-    if today_date.date() >= comparison_third_day.date():
-        calibration_end_year = comparison_third_day.year
-    elif today_date.date() >= comparison_first_day.date() and today_date.date() < comparison_third_day.date():
-        calibration_end_year = today_date.year - 1
-        calibration_end_year = "dec"
-    else:
-        calibration_end_year = today_date.year
+    calibration_end_year = get_spi_calibration_end_year()
 
     spi_command = (
         f"spi --periodicity monthly --netcdf_precip {reord_file} "
@@ -120,9 +139,8 @@ def spi_process():
 
     ## PASO 2: Proceso de reordenamiento de las dimensiones time, lat, lon de los archivos "nclimgrid_gamma.nc4".  
     #  1. Se define una lista con las escalas del SPI que generamos en el paso anterior. Para cada escala se genera un archivo reordenado 
-    #     mediante el comando "ncpdq". Este comando se ejecuta con "Popen" y el proceso espera hasta que finalice con "wait()".
-
-    spi_scales = ['1', '2', '3', '6', '9', '12', '24', '36', '48', '60', '72']
+    #     mediante el comando "ncpdq". Este comando se ejecuta con "Popen" y el proceso espera hasta que finalice con "wait()". Luego 
+    #     se espera a que el archivo reordenado este completo y liberado mediante "wait_for_file_released()".
 
     for scale in spi_scales:
         input_spi_file = os.path.join(SPI_gp_dir, f'nclimgrid_spi_gamma_{scale}_month.nc')
@@ -130,10 +148,42 @@ def spi_process():
         
         reorder_command = f'ncpdq -a time,lat,lon {input_spi_file} {output_spi_file}'
         Popen(reorder_command, shell=True).wait()
-        sleep_for_a_bit(20)
+        wait_for_file_released(output_spi_file)
 
         print(f"Reordenamiento de dimensiones para escala SPI {scale} completado")
 
+###################################################################################################################################
+
+## Funcion get_spi_calibration_end_year: Sirve para determinar el final del año de calibracion del SPI.
+#  1. Como primera medida obtenemos la fecha de actual, luego calculamos el primer dia del proximo año, y restamos 1 al año, del 
+#     primer dia del proximo año, para la comparacion. Por otro lado, calculamos el tercer dia del proximo año, le restamos 1 al 
+#     año, del tercer dia del proximo año, para la comparacion. Ahora bien, para la asignacion del final del año de calibracion:
+#     - Si la fecha actual es mayor o igual al tercer dia del proximo año de la comparacion, se asigna el año del tercer dia de 
+#       comparacion.
+#     - Si la fecha actual es mayor o igual al primer dia del proximo año de la comparacion, y menor al tercer dia del proximo año 
+#       de comparacion, se asigna el año actual menos uno.
+#     - Caso contrario, se asigna el año actual.
+
+def get_spi_calibration_end_year():
+    today_date = datetime.today()
+
+    next_year_first_day = (today_date + relativedelta(years=1)).replace(day=1).replace(month=1)
+
+    comparison_first_day = next_year_first_day - relativedelta(years=1)
+
+    next_year_third_day = (today_date + relativedelta(years=1)).replace(day=3).replace(month=1)
+
+    comparison_third_day = next_year_third_day - relativedelta(years=1)
+
+    if today_date.date() >= comparison_third_day.date():
+        calibration_end_year = comparison_third_day.year
+    elif today_date.date() >= comparison_first_day.date() and today_date.date() < comparison_third_day.date():
+        calibration_end_year = today_date.year - 1
+    else:
+        calibration_end_year = today_date.year
+
+    return calibration_end_year
+
 
 
 
@@ -0,0 +1,254 @@
+import os
+import json
+import time
+import hashlib
+from concurrent.futures import ProcessPoolExecutor, FIRST_COMPLETED, wait
+
+try:
+    from wait_until_v7 import wait_for_path, reset_wait_metrics, get_total_wait_time
+except ModuleNotFoundError:
+    from src.scripts.wait_until_v7 import wait_for_path, reset_wait_metrics, get_total_wait_time
+
+###################################################################################################################################
+
+## Funcion run_stage_graph: Sirve para ejecutar las etapas del proceso respetando sus dependencias, ejecutando en paralelo las
+#  etapas que no dependen entre si (por ejemplo, la conversion del PTM y el calculo del SPI, que solo dependen de "concat_reord").
+#  - La funcion recibe como parametros la lista de etapas y la cantidad maxima de etapas que se ejecutan al mismo tiempo. Cada etapa
+#    es un diccionario con:
+#    - name: Nombre de la etapa.
+#    - function: Funcion que ejecuta la etapa, sin parametros. Debe estar definida a nivel de modulo, ya que se ejecuta en un
+#      proceso separado.
+#    - depends_on: Lista con los nombres de las etapas que deben finalizar antes de ejecutar esta etapa.
+#    - inputs: Lista de archivos o carpetas que la etapa lee.
+#    - outputs: Lista de todos los archivos o carpetas que la etapa genera o modifica. Dos etapas pueden declarar la misma salida, o
+#      una carpeta que contiene la salida de otra (por ejemplo, la mascara de corte compartida, o un archivo de estado que una etapa
+#      genera y otra actualiza).
+#    - params: Lista opcional de valores que, ademas de las entradas, determinan el resultado de la etapa (por ejemplo, el año de 
+#      calibracion del SPI).
+#    - always_run: Opcional, si es "True" la etapa se ejecuta siempre, aunque sus entradas no hayan cambiado (por ejemplo, la 
+#      publicacion en GeoServer, cuyo resultado esta en un servidor externo que pudo haberse reiniciado).
+#  - Si se indica "state_file", se registra en dicho archivo la firma de cada etapa ejecutada con exito, y las etapas que estan al 
+#    dia se omiten (ver "is_stage_up_to_date()"), al estilo de "make".
+#  - Se retorna la lista de tiempos de cada etapa ejecutada u omitida, en el orden en que finalizaron, para ser informados en el email.
+#    Para cada etapa ejecutada se informa tambien el tiempo total que espero a que sus archivos o recursos esten disponibles.
+#
+#  PROCEDIMIENTO:
+#  1. Se verifica que todas las dependencias declaradas existan y que no haya ciclos, mediante "get_stage_order()".
+#  2. Creamos un grupo de procesos ("ProcessPoolExecutor"), ya que cada etapa abre y escribe archivos netCDF y GeoTIFF, y las
+#     librerias que los manejan no son seguras para usarse desde varios hilos a la vez. Cada etapa se ejecuta en un proceso separado
+#     mediante "run_stage()", que retorna el tiempo que tardo y el tiempo total de sus esperas. Las metricas de espera del proceso 
+#     principal se vacian al comenzar, para que no crezcan entre ejecuciones.
+#  3. Se envian a ejecutar todas las etapas cuyas dependencias ya finalizaron, y se espera a que finalice alguna de las etapas en
+#     ejecucion. Si una etapa lista para ejecutar esta al dia, no se ejecuta y se marca como finalizada. Al finalizar una etapa se 
+#     espera a que sus salidas esten disponibles mediante "wait_for_path()", se registra su tiempo y su firma, y se vuelven a buscar 
+#     etapas listas para ejecutar, hasta que no queden etapas pendientes. Ademas, se vuelve a registrar la firma de las etapas ya 
+#     finalizadas que comparten alguna salida con la etapa finalizada (ver "share_outputs()"), ya que dicha salida fue modificada 
+#     por el propio proceso, y de lo contrario se volverian a ejecutar en la proxima ejecucion.
+#  4. Si una etapa falla, no se envian a ejecutar nuevas etapas, se espera a que finalicen las que estan en ejecucion y se relanza
+#     el error, para que sea capturado y notificado por el proceso principal.
+
+def run_stage_graph(stages, max_workers=2, state_file=None):
+    get_stage_order(stages)
+    reset_wait_metrics()
+
+    stage_state = read_stage_state(state_file) if state_file else {}
+
+    stages_by_name = {stage['name']: stage for stage in stages}
+    pending = [stage['name'] for stage in stages]
+    finished = set()
+    running = {}
+    stage_timings = []
+    stage_error = None
+
+    with ProcessPoolExecutor(max_workers=max_workers) as executor:
+        while pending or running:
+            if stage_error is None:
+                ready = [name for name in pending if all(dep in finished for dep in stages_by_name[name].get('depends_on', []))]
+                while ready:
+                    for name in ready:
+                        pending.remove(name)
+                        if state_file and is_stage_up_to_date(stages_by_name[name], stage_state.get(name)):
+                            print(f"Etapa {name} sin cambios, se omite.")
+                            finished.add(name)
+                            stage_timings.append({'name': name, 'elapsed_s': 0.0, 'skipped': True})
+                        else:
+                            print(f"Iniciando etapa: {name}")
+                            stage_state.pop(name, None)
+                            running[executor.submit(run_stage, stages_by_name[name]['function'])] = name
+                    ready = [name for name in pending if all(dep in finished for dep in stages_by_name[name].get('depends_on', []))]
+
+            if not running:
+                break
+
+            done, _ = wait(running, return_when=FIRST_COMPLETED)
+
+            for future in done:
+                name = running.pop(future)
+                try:
+                    elapsed, wait_s = future.result()
+                except Exception as e:
+                    print(f"La etapa {name} finalizo con errores: {e}")
+                    stage_error = stage_error or e
+                    continue
+
+                for output in stages_by_name[name].get('outputs', []):
+                    wait_for_path(output)
+
+                finished.add(name)
+                stage_timings.append({'name': name, 'elapsed_s': elapsed, 'wait_s': wait_s, 'skipped': False})
+                print(f"Etapa {name} finalizada en {elapsed:.1f} segundo(s)")
+
+                if state_file:
+                    stage_state[name] = get_stage_signature(stages_by_name[name])
+                    for other in finished:
+                        if other != name and other in stage_state and share_outputs(stages_by_name[name], stages_by_name[other]):
+                            stage_state[other] = get_stage_signature(stages_by_name[other])
+                    write_stage_state(state_file, stage_state)
+
+    if stage_error is not None:
+        raise stage_error
+
+    return stage_timings
+
+###################################################################################################################################
+
+## Funcion run_stage: Sirve para ejecutar la funcion de una etapa y medir el tiempo que tarda, en segundos, junto con el tiempo total
+#  de las esperas realizadas durante la misma. Como los procesos del grupo se reutilizan entre etapas, las metricas de espera se 
+#  vacian antes de ejecutar cada etapa.
+
+def run_stage(function):
+    reset_wait_metrics()
+    start_time = time.monotonic()
+    function()
+    return time.monotonic() - start_time, get_total_wait_time()
+
+###################################################################################################################################
+
+## Funcion get_stage_order: Sirve para validar el grafo de etapas y obtener un orden de ejecucion en serie que respete las
+#  dependencias. Si una etapa depende de una etapa que no existe, o si hay dependencias circulares, se lanza un "ValueError".
+
+def get_stage_order(stages):
+    stages_by_name = {stage['name']: stage for stage in stages}
+    order = []
+    visiting = set()
+
+    def visit(name):
+        if name in order:
+            return
+        if name in visiting:
+            raise ValueError(f"Dependencia circular en la etapa: {name}")
+        if name not in stages_by_name:
+            raise ValueError(f"La etapa {name} no existe")
+        visiting.add(name)
+        for dep in stages_by_name[name].get('depends_on', []):
+            visit(dep)
+        visiting.remove(name)
+        order.append(name)
+
+    for stage in stages:
+        visit(stage['name'])
+
+    return order
+
+###################################################################################################################################
+
+## Funcion format_stage_timings: Sirve para armar el texto con los tiempos de cada etapa, para ser incluido en el email.
+
+def format_stage_timings(stage_timings):
+    lines = []
+    for timing in stage_timings:
+        if timing.get('skipped'):
+            lines.append(f" {timing['name']}: sin cambios, omitida")
+        elif timing.get('wait_s'):
+            lines.append(f" {timing['name']}: {timing['elapsed_s']:.1f} segundo(s), {timing['wait_s']:.1f} en esperas")
+        else:
+            lines.append(f" {timing['name']}: {timing['elapsed_s']:.1f} segundo(s)")
+    return '\n'.join(lines) + '\n'
+
+###################################################################################################################################
+
+## Funcion is_stage_up_to_date: Sirve para determinar si una etapa esta al dia, y por lo tanto no es necesario volver a ejecutarla.
+#  - Una etapa marcada con "always_run" nunca esta al dia.
+#  - Una etapa esta al dia si todas sus salidas existen, tiene una firma registrada de su ultima ejecucion exitosa, y dicha firma 
+#    coincide con la firma actual, es decir, que desde entonces no cambiaron sus entradas, sus parametros, ni sus salidas.
+#  - Una etapa sin salidas declaradas (por ejemplo, la pre-generacion de los ZIP de descarga) solo depende de sus entradas y 
+#    parametros.
+
+def is_stage_up_to_date(stage, recorded_signature):
+    if stage.get('always_run') or recorded_signature is None:
+        return False
+    if not all(os.path.exists(output) for output in stage.get('outputs', [])):
+        return False
+    return get_stage_signature(stage) == recorded_signature
+
+###################################################################################################################################
+
+## Funcion share_outputs: Sirve para determinar si dos etapas comparten alguna salida, es decir, si declaran la misma ruta, o si una
+#  de ellas declara una carpeta que contiene una salida de la otra.
+
+def share_outputs(stage_1, stage_2):
+    outputs_2 = [os.path.abspath(output) for output in stage_2.get('outputs', [])]
+    for output_1 in [os.path.abspath(output) for output in stage_1.get('outputs', [])]:
+        for output_2 in outputs_2:
+            if os.path.commonpath([output_1, output_2]) in (output_1, output_2):
+                return True
+    return False
+
+###################################################################################################################################
+
+## Funcion get_stage_signature: Sirve para calcular la firma de una etapa, a partir de la firma de cada entrada y salida, y de sus 
+#  parametros. La firma se guarda como un hash SHA-1, para que el archivo de estado no crezca con la cantidad de archivos.
+
+def get_stage_signature(stage):
+    signature = {
+        'inputs': {path: get_path_signature(path) for path in stage.get('inputs', [])},
+        'outputs': {path: get_path_signature(path) for path in stage.get('outputs', [])},
+        'params': [str(param) for param in stage.get('params', [])],
+    }
+    return hashlib.sha1(json.dumps(signature, sort_keys=True).encode('utf-8')).hexdigest()
+
+###################################################################################################################################
+
+## Funcion get_path_signature: Sirve para obtener la firma de un archivo o carpeta, a partir del tamaño y la fecha de modificacion 
+#  (en nanosegundos) de cada archivo. Para una carpeta se recorren todos sus archivos, incluidas las subcarpetas. Si el archivo o 
+#  carpeta no existe, la firma es None.
+
+def get_path_signature(path):
+    if os.path.isfile(path):
+        stat = os.stat(path)
+        return [stat.st_size, stat.st_mtime_ns]
+
+    if not os.path.isdir(path):
+        return None
+
+    signature = []
+    for root, dirs, files in os.walk(path):
+        dirs.sort()
+        for file in sorted(files):
+            file_path = os.path.join(root, file)
+            stat = os.stat(file_path)
+            signature.append([os.path.relpath(file_path, path), stat.st_size, stat.st_mtime_ns])
+    return signature
+
+###################################################################################################################################
+
+## Funciones read_stage_state y write_stage_state: Sirven para leer y guardar el archivo de estado, es decir, el diccionario con la 
+#  firma de la ultima ejecucion exitosa de cada etapa.
+#  - Si el archivo no existe o esta corrupto, se retorna un diccionario vacio, lo que provoca que todas las etapas se ejecuten.
+#  - El archivo se escribe primero con un nombre temporal y luego se renombra, para que nunca quede a medio escribir. Si la carpeta
+#    del archivo no existe, se crea.
+
+def read_stage_state(state_file):
+    try:
+        with open(state_file, 'r') as f:
+            return json.load(f).get('stages', {})
+    except (OSError, ValueError):
+        return {}
+
+
+def write_stage_state(state_file, stage_state):
+    os.makedirs(os.path.dirname(state_file), exist_ok=True)
+    temp_file = state_file + '.TMP'
+    with open(temp_file, 'w') as f:
+        json.dump({'stages': stage_state}, f, indent=2, sort_keys=True)
+    os.replace(temp_file, state_file)
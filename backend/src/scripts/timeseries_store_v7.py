@@ -0,0 +1,205 @@
+import os
+import json
+import time
+import numpy as np
+import xarray as xr
+import rioxarray
+
+try:
+    from clip_mask_v7 import load_clip_mask
+except ModuleNotFoundError:
+    from src.scripts.clip_mask_v7 import load_clip_mask
+
+###################################################################################################################################
+
+## Configuracion del almacen de series temporales:
+#  - SPI_SCALES: Escalas del SPI que se guardan en el almacen, ademas del PTM.
+#  - timeseries_cache: Indice del almacen leido por el proceso del backend ("index", junto con la fecha de modificacion del archivo
+#    del que se leyo), y los archivos de cada producto abiertos como "memmap" ("arrays"), para no volver a abrirlos en cada solicitud.
+
+SPI_SCALES = ['1', '2', '3', '6', '9', '12', '24', '36', '48', '60', '72']
+
+timeseries_cache = {}
+
+###################################################################################################################################
+
+## Funcion build_timeseries_store: Sirve para generar el almacen de series temporales por pixel del PTM y del SPI de todas las
+#  escalas, del que el endpoint "/timeseries" lee la serie completa de un pixel sin cargar los cubos en memoria.
+#  - La funcion recibe el parametro "block_size", que indica la cantidad de filas (latitudes) que se leen y escriben a la vez, por lo
+#    que la memoria utilizada no crece con el tamaño de la grilla ni la longitud de la serie.
+#
+#  PROCEDIMIENTO:
+#  1. Cada producto se guarda en un archivo ".npy" de tipo float32 con las dimensiones (lat, lon, time), es decir, con los valores de
+#     cada pixel contiguos en el disco, de modo que la serie de un pixel se lee de un solo bloque. Solo se guarda la ventana de la
+#     mascara de corte de Argentina ("load_clip_mask()", la misma de los GeoTiff), y los pixeles fuera de la mascara quedan en NaN.
+#  2. El PTM se lee de "IMERG_reord_lat_fix.nc4", que "concat_reord()" ya genera con el orden (lat, lon, time), y el SPI de los
+#     archivos "spi_gamma_<escala>_reord.nc4" (time, lat, lon), que se transponen por bloques de filas.
+#  3. Los archivos de cada ejecucion llevan en su nombre la fecha de generacion, y el indice "timeseries_index.json" (latitudes,
+#     longitudes, fechas y archivo de cada producto) se escribe al final, con un nombre temporal que luego se renombra. Asi, el
+#     backend sigue leyendo los archivos anteriores hasta que el indice cambia. Por ultimo se eliminan los archivos de ejecuciones
+#     anteriores, que el backend puede seguir leyendo hasta recargar el indice, ya que los tiene abiertos.
+
+def build_timeseries_store(block_size=64):
+
+    ## Distribucion de carpetas/directorios:
+    #
+    #   - reord_file: Archivo de precipitacion mensual con el orden (lat, lon, time), generado por "concat_reord()".
+    #   - SPI_gamma_reord_dir: Carpeta donde se encuentran los archivos SPI de todas las escalas.
+    #   - shp_file y clip_mask_file: Shapefile de Argentina y archivo donde se guarda la mascara de corte, compartida con el PTM y el
+    #     SPI.
+    #   - timeseries_dir: Carpeta donde se guarda el almacen de series temporales. Si no existe, se crea.
+
+    src_dir = os.path.expanduser(os.path.join('~', 'EHCPA_SPI', 'backend', 'src'))
+    reord_file = os.path.join(src_dir, 'input', 'concat_reord', 'IMERG_reord_lat_fix.nc4')
+    SPI_gamma_reord_dir = os.path.join(src_dir, 'input', 'SPI', 'SPI_gamma_reord')
+    shp_file = os.path.join(src_dir, 'ShapeFiles', 'Argentina', 'Argentina.shp')
+    clip_mask_file = os.path.join(src_dir, 'input', 'clip_mask', 'ARG_IMERG_clip_mask.npz')
+    timeseries_dir = os.path.join(src_dir, 'output', 'timeseries')
+
+    os.makedirs(timeseries_dir, exist_ok=True)
+
+    products = [('PTM', reord_file, 'precipitation')]
+    for scale in SPI_SCALES:
+        products.append((f'SPI_{scale}', os.path.join(SPI_gamma_reord_dir, f'spi_gamma_{scale}_reord.nc4'), f'spi_gamma_{scale}_month'))
+
+    with xr.open_dataset(reord_file) as nc_reord_file:
+        grid = nc_reord_file['precipitation'].isel(time=-1).rio.set_spatial_dims('lon', 'lat')
+        grid = grid.rio.write_crs("epsg:4326")
+        clip_mask = load_clip_mask(grid, shp_file, clip_mask_file)
+        row_off, col_off, height, width = clip_mask['window']
+        lat = nc_reord_file['lat'].values[row_off:row_off + height]
+        lon = nc_reord_file['lon'].values[col_off:col_off + width]
+        dates = [str(date)[:7] for date in nc_reord_file['time'].values.astype('datetime64[M]')]
+
+    stamp = time.strftime('%Y%m%d%H%M%S')
+    index = {'lat': lat.astype('float64').round(4).tolist(), 'lon': lon.astype('float64').round(4).tolist(), 'dates': dates, 'products': {}}
+
+    for product, nc_file, variable in products:
+        if not os.path.exists(nc_file):
+            continue
+        store_file = f'{product}_{stamp}.npy'
+        write_timeseries_array(nc_file, variable, clip_mask, len(dates), os.path.join(timeseries_dir, store_file), block_size)
+        index['products'][product] = store_file
+
+    index_file = os.path.join(timeseries_dir, 'timeseries_index.json')
+    temp_file = index_file + '.TMP'
+    with open(temp_file, 'w') as f:
+        json.dump(index, f)
+    os.replace(temp_file, index_file)
+
+    for file in os.listdir(timeseries_dir):
+        if file.endswith('.npy') and file not in index['products'].values():
+            os.remove(os.path.join(timeseries_dir, file))
+
+    print(f"Almacen de series temporales generado: {', '.join(index['products'])}")
+
+###################################################################################################################################
+
+## Funcion write_timeseries_array: Sirve para escribir el archivo ".npy" (lat, lon, time) de un producto, de a "block_size" filas.
+#  - La variable se lee sin cargarla en memoria, y de cada bloque de filas solo se leen las columnas de la ventana de corte. El
+#    bloque se lee en el orden del archivo y recien despues se transpone a (lat, lon, time), ya que transponer la variable antes de
+#    leerla hace que la lectura del NetCDF sea mucho mas lenta. Por ultimo se reemplazan por NaN los pixeles fuera de la mascara.
+#  - Si la cantidad de fechas del producto no coincide con la del PTM se lanza un "ValueError", ya que todos los productos comparten
+#    el eje de fechas del indice.
+#  - El archivo se escribe con un nombre temporal, que se renombra al finalizar.
+
+def write_timeseries_array(nc_file, variable, clip_mask, n_dates, store_file, block_size=64):
+    row_off, col_off, height, width = clip_mask['window']
+    mask = clip_mask['mask']
+
+    with xr.open_dataset(nc_file) as nc_data:
+        data_array = nc_data[variable]
+        if data_array.sizes['time'] != n_dates:
+            raise ValueError(f"La variable {variable} tiene {data_array.sizes['time']} fechas, y el PTM tiene {n_dates}")
+
+        temp_file = store_file + '.TMP.npy'
+        store = np.lib.format.open_memmap(temp_file, mode='w+', dtype='float32', shape=(height, width, n_dates))
+
+        for start in range(0, height, block_size):
+            stop = min(start + block_size, height)
+            block = data_array.isel(
+                lat=slice(row_off + start, row_off + stop), lon=slice(col_off, col_off + width)
+            ).load().transpose('lat', 'lon', 'time').values.astype('float32')
+            block[~mask[start:stop]] = np.nan
+            store[start:stop] = block
+
+        store.flush()
+        del store
+
+    os.replace(temp_file, store_file)
+
+###################################################################################################################################
+
+## Funcion get_pixel_timeseries: Sirve para obtener la serie temporal completa del pixel mas cercano a una coordenada, para los
+#  productos indicados ("PTM" y/o "SPI_<escala>"), desde el almacen generado por "build_timeseries_store()".
+#  1. El indice del almacen se vuelve a leer solo si cambio su fecha de modificacion (por ejemplo, porque el proceso diario genero
+#     un nuevo almacen), y en ese caso se vuelven a abrir los archivos de los productos. Caso contrario se reutilizan los archivos
+#     ya abiertos como "memmap", de los que el sistema operativo solo lee las paginas del pixel solicitado.
+#  2. Se busca la fila y columna mas cercanas a la latitud y longitud. Si la coordenada esta a mas de medio pixel de la ventana de
+#     Argentina, o si algun producto no existe, se lanza un "ValueError" con el mensaje que se informa al usuario.
+#  3. Se retorna un diccionario con la latitud y longitud del centro del pixel, las fechas ("YYYY-MM"), y la serie de cada producto,
+#     con None en lugar de NaN (pixeles fuera de Argentina o meses sin datos).
+#  - Si el almacen no existe, se lanza un "FileNotFoundError".
+
+def get_pixel_timeseries(lat, lon, products=None):
+    index, arrays = load_timeseries_store()
+
+    products = products or list(index['products'])
+    missing = [product for product in products if product not in index['products']]
+    if missing:
+        raise ValueError(f"Los siguientes productos no son correctos: {', '.join(missing)}")
+
+    row, pixel_lat = find_nearest_pixel(index['lat'], lat)
+    col, pixel_lon = find_nearest_pixel(index['lon'], lon)
+    if row is None or col is None:
+        raise ValueError(f"La coordenada ({lat}, {lon}) esta fuera del area de Argentina.")
+
+    values = {}
+    for product in products:
+        series = np.asarray(arrays[product][row, col], dtype='float64').round(4)
+        values[product] = [None if np.isnan(value) else value for value in series.tolist()]
+
+    return {'lat': pixel_lat, 'lon': pixel_lon, 'dates': index['dates'], 'values': values}
+
+###################################################################################################################################
+
+## Funcion load_timeseries_store: Sirve para obtener el indice del almacen de series temporales y sus archivos abiertos como
+#  "memmap", desde "timeseries_cache" si el indice no cambio desde la ultima lectura. Si al abrir los archivos alguno ya no existe
+#  (porque el proceso genero un nuevo almacen mientras tanto), se vuelve a leer el indice una vez.
+
+def load_timeseries_store():
+    timeseries_dir = os.path.expanduser(os.path.join('~', 'EHCPA_SPI', 'backend', 'src', 'output', 'timeseries'))
+    index_file = os.path.join(timeseries_dir, 'timeseries_index.json')
+
+    for attempt in range(2):
+        index_mtime = os.stat(index_file).st_mtime_ns
+        cached_mtime, index, arrays = timeseries_cache.get('entry', (None, None, None))
+        if cached_mtime == index_mtime:
+            return index, arrays
+
+        try:
+            with open(index_file, 'r') as f:
+                index = json.load(f)
+            arrays = {
+                product: np.load(os.path.join(timeseries_dir, store_file), mmap_mode='r')
+                for product, store_file in index['products'].items()
+            }
+        except FileNotFoundError:
+            if attempt:
+                raise
+            continue
+
+        timeseries_cache['entry'] = (index_mtime, index, arrays)
+        return index, arrays
+
+###################################################################################################################################
+
+## Funcion find_nearest_pixel: Sirve para obtener la posicion y el valor de la coordenada mas cercana a "value" en una lista de
+#  coordenadas equiespaciadas. Si "value" esta a mas de medio pixel de los extremos, se retorna None en ambos.
+
+def find_nearest_pixel(coordinates, value):
+    position = int(np.abs(np.asarray(coordinates) - value).argmin())
+    step = abs(coordinates[1] - coordinates[0]) if len(coordinates) > 1 else 0
+    if abs(coordinates[position] - value) > step / 2 + 1e-6:
+        return None, None
+    return position, coordinates[position]
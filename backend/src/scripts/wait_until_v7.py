@@ -0,0 +1,127 @@
+import os
+import time
+import requests
+
+###################################################################################################################################
+
+## Metricas de espera:
+#  - wait_metrics: Lista donde se registra cada espera realizada, con su descripcion, el tiempo que realmente tardo en segundos y
+#    si la condicion se cumplio ("ready") o se agoto el tiempo de espera. Guarda como maximo las ultimas "WAIT_METRICS_MAX" esperas,
+#    ya que el proceso del backend se ejecuta de forma continua, y se vacia al comenzar cada ejecucion del proceso y cada etapa 
+#    mediante "reset_wait_metrics()". El tiempo total de espera de cada etapa se informa en el resumen de etapas del email.
+#  - wait_metrics_hook: Funcion que se ejecuta al finalizar cada espera, recibiendo el registro de la misma. Por defecto agrega el
+#    registro a "wait_metrics", y se puede reemplazar mediante "set_wait_metrics_hook()".
+
+WAIT_METRICS_MAX = 1000
+
+wait_metrics = []
+
+
+def record_wait_metric(metric):
+    wait_metrics.append(metric)
+    del wait_metrics[:-WAIT_METRICS_MAX]
+
+
+def reset_wait_metrics():
+    wait_metrics.clear()
+
+
+def get_total_wait_time():
+    return sum(metric['elapsed_s'] for metric in wait_metrics)
+
+
+wait_metrics_hook = record_wait_metric
+
+
+def set_wait_metrics_hook(hook):
+    global wait_metrics_hook
+    wait_metrics_hook = hook if hook is not None else record_wait_metric
+
+###################################################################################################################################
+
+## Funcion wait_until: Sirve para esperar a que se cumpla una condicion, en lugar de pausar el proceso durante un tiempo fijo.
+#  1. La funcion recibe como parametros la condicion a verificar (una funcion sin parametros que retorna "True" o "False"), una
+#     descripcion de la espera, el tiempo maximo de espera en segundos ("timeout") y el intervalo entre verificaciones.
+#  2. Se verifica la condicion inmediatamente, y mientras no se cumpla, se vuelve a verificar cada "interval" segundos, hasta que
+#     se cumpla o se supere el "timeout".
+#  3. Al finalizar, se registra el tiempo real de espera mediante "wait_metrics_hook", y se retorna "True" si la condicion se
+#     cumplio, o "False" si se agoto el tiempo de espera, en cuyo caso se imprime un mensaje y el proceso continua.
+
+def wait_until(condition, description, timeout=30, interval=0.5):
+    start_time = time.monotonic()
+
+    ready = condition()
+    while not ready and time.monotonic() - start_time < timeout:
+        time.sleep(interval)
+        ready = condition()
+
+    elapsed = time.monotonic() - start_time
+    wait_metrics_hook({'description': description, 'elapsed_s': round(elapsed, 3), 'ready': ready})
+
+    if not ready:
+        print(f"Tiempo de espera agotado ({timeout} segundo(s)): {description}")
+
+    return ready
+
+###################################################################################################################################
+
+## Funciones wait_for_path y wait_for_path_removed: Sirven para esperar a que un archivo o carpeta exista, o deje de existir, por
+#  ejemplo, luego de crear o borrar una carpeta.
+
+def wait_for_path(path, timeout=30):
+    return wait_until(lambda: os.path.exists(path), f"Creacion de {path}", timeout)
+
+
+def wait_for_path_removed(path, timeout=30):
+    return wait_until(lambda: not os.path.exists(path), f"Borrado de {path}", timeout)
+
+###################################################################################################################################
+
+## Funcion wait_for_file_released: Sirve para esperar a que un archivo este completo y liberado por el proceso que lo escribe.
+#  - Se considera liberado cuando existe, su tamaño no cambia entre dos verificaciones consecutivas, y se puede renombrar sobre si
+#    mismo (en Windows esta operacion falla mientras otro proceso tenga el archivo abierto).
+
+def wait_for_file_released(path, timeout=30):
+    last_size = [None]
+
+    def is_file_released():
+        if not os.path.exists(path):
+            return False
+        size = os.path.getsize(path)
+        stable = size == last_size[0]
+        last_size[0] = size
+        if not stable:
+            return False
+        try:
+            os.rename(path, path)
+        except OSError:
+            return False
+        return True
+
+    return wait_until(is_file_released, f"Liberacion de {path}", timeout)
+
+###################################################################################################################################
+
+## Funcion wait_for_geoserver_resource: Sirve para esperar a que un recurso exista en la API REST de GeoServer.
+#  - La funcion recibe la URL del recurso en la API REST (por ejemplo, la de una capa), las credenciales de autenticacion, el tiempo
+#    maximo de espera, y opcionalmente una funcion "check" que recibe el JSON del recurso y verifica una propiedad del mismo (por
+#    ejemplo, el estilo asignado a la capa).
+#  - Si se indica "session" (una sesion HTTP ya autenticada), las consultas se realizan con dicha sesion, reutilizando sus conexiones,
+#    en lugar de las credenciales "auth".
+#  - El recurso esta disponible cuando la API responde con codigo de estado 200 y, si se indico, "check" retorna "True". Los errores
+#    de conexion se consideran como recurso no disponible.
+
+def wait_for_geoserver_resource(resource_url, auth=None, timeout=60, check=None, session=None):
+    def is_resource_ready():
+        try:
+            if session is not None:
+                response = session.get(resource_url, headers={'Accept': 'application/json'}, timeout=10)
+            else:
+                response = requests.get(resource_url, auth=auth, headers={'Accept': 'application/json'}, timeout=10)
+        except requests.exceptions.RequestException:
+            return False
+        if response.status_code != 200:
+            return False
+        return check is None or check(response.json())
+
+    return wait_until(is_resource_ready, f"Recurso de GeoServer {resource_url}", timeout, interval=1)
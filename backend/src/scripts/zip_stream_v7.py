@@ -0,0 +1,85 @@
+import os
+import time
+import zipfile
+
+###################################################################################################################################
+
+## Clase ZipStreamBuffer: Sirve como destino de escritura del archivo ZIP que se genera por partes. No permite "seek", por lo que
+#  "zipfile" escribe el ZIP de forma secuencial (con descriptores de datos despues de cada archivo), y cada vez que se llama a
+#  "pop()" se retorna y descarta lo escrito hasta el momento, de modo que el buffer nunca guarda mas que un bloque.
+
+class ZipStreamBuffer:
+
+    def __init__(self):
+        self.chunks = []
+        self.position = 0
+
+    def write(self, data):
+        self.chunks.append(bytes(data))
+        self.position += len(data)
+        return len(data)
+
+    def tell(self):
+        return self.position
+
+    def flush(self):
+        pass
+
+    def pop(self):
+        data = b''.join(self.chunks)
+        self.chunks = []
+        return data
+
+###################################################################################################################################
+
+## Funcion stream_zip: Sirve para generar un archivo ZIP por bloques a partir de una lista de archivos, sin armarlo completo en
+#  memoria ni en disco, para enviarlo como respuesta HTTP a medida que se genera (transferencia "chunked").
+#  1. Se abren todos los archivos antes de comenzar, para que si alguno deja de existir (por ejemplo, porque el proceso diario
+#     vuelve a generar las carpetas de descarga) la respuesta falle antes de enviar el primer byte, y no a mitad del ZIP.
+#  2. Cada archivo se agrega al ZIP solo con su nombre (sin la ruta completa) y en modo "ZIP_STORED", es decir, sin comprimir, ya
+#     que los GeoTiff ya se encuentran comprimidos y volver a comprimirlos solo consume CPU. El archivo se copia de a "chunk_size"
+#     bytes, y despues de cada bloque se retorna lo escrito en el ZIP, por lo que la memoria utilizada no depende del tamaño de los
+#     archivos.
+#  3. Al cerrar el ZIP se retorna el directorio central del mismo, que es el ultimo bloque de la respuesta.
+
+def stream_zip(files, chunk_size=1024 * 1024):
+    open_files = []
+    try:
+        for file_path in files:
+            open_files.append((open(file_path, 'rb'), os.path.basename(file_path)))
+    except OSError:
+        for src, _ in open_files:
+            src.close()
+        raise
+
+    def generate():
+        buffer = ZipStreamBuffer()
+        try:
+            with zipfile.ZipFile(buffer, 'w', compression=zipfile.ZIP_STORED, allowZip64=True) as zip_file:
+                for src, arcname in open_files:
+                    stat = os.fstat(src.fileno())
+                    zip_info = zipfile.ZipInfo(arcname, time.localtime(stat.st_mtime)[:6])
+                    zip_info.file_size = stat.st_size
+                    zip_info.external_attr = 0o644 << 16
+                    zip_info.compress_type = zipfile.ZIP_STORED
+                    with zip_file.open(zip_info, 'w') as dst:
+                        for chunk in iter(lambda: src.read(chunk_size), b''):
+                            dst.write(chunk)
+                            yield from pop_chunk(buffer)
+                    yield from pop_chunk(buffer)
+            yield from pop_chunk(buffer)
+        finally:
+            for src, _ in open_files:
+                src.close()
+
+    return generate()
+
+###################################################################################################################################
+
+## Funcion pop_chunk: Sirve para retornar lo escrito en el buffer del ZIP, solo si no esta vacio, ya que un bloque vacio en una 
+#  respuesta "chunked" indica el fin de la misma.
+
+def pop_chunk(buffer):
+    data = buffer.pop()
+    if data:
+        yield data
@@ -0,0 +1,187 @@
+import io
+import re
+import json
+import zipfile
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import urlsplit, parse_qs
+
+###################################################################################################################################
+
+## Clase MockGeoServer: Servidor local que imita la parte de la API REST de GeoServer que utilizan "geoserver_upload()" y
+#  "geoserver_mosaic_upload()": espacios de trabajo, almacenes GeoTiff ("file.geotiff"), mosaicos ("file.imagemosaic" y el indice
+#  de granulos), y el estilo por defecto de las capas.
+#  - Se inicia en un puerto libre de "127.0.0.1", y su URL esta en "url".
+#  - Cada solicitud se registra en "requests" como (metodo, ruta), para verificar que solicitudes realizo la sincronizacion.
+#  - "reset()" borra todo el contenido, como si GeoServer se hubiera reiniciado sin su configuracion.
+
+class MockGeoServer:
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.requests = []
+        self.reset()
+
+        self.server = ThreadingHTTPServer(('127.0.0.1', 0), self.get_handler())
+        self.url = f'http://127.0.0.1:{self.server.server_address[1]}'
+        self.thread = threading.Thread(target=self.server.serve_forever, daemon=True)
+        self.thread.start()
+
+    def reset(self):
+        with self.lock:
+            self.workspaces = set()
+            self.stores = {}
+            self.layers = {}
+
+    def close(self):
+        self.server.shutdown()
+        self.server.server_close()
+
+    def clear_requests(self):
+        with self.lock:
+            self.requests.clear()
+
+    def get_methods(self):
+        with self.lock:
+            return [method for method, _ in self.requests]
+
+    def get_uploads(self):
+        with self.lock:
+            return [path for method, path in self.requests if method in ('PUT', 'POST') and '/file.' in path]
+
+    ###############################################################################################################################
+
+    ## Rutas de la API REST: Cada ruta es (metodo, expresion regular de la ruta, funcion), y la funcion recibe los grupos de la
+    #  expresion, los parametros de la consulta y el cuerpo de la solicitud, y retorna (codigo de estado, JSON de respuesta o None).
+
+    def get_routes(self):
+        store = r'/rest/workspaces/([^/]+)/coveragestores/([^/]+)'
+        return [
+            ('GET', r'/rest/workspaces/([^/]+)\.json', self.get_workspace),
+            ('POST', r'/rest/workspaces', self.create_workspace),
+            ('PUT', r'/rest/workspaces/default', lambda groups, query, body: (200, None)),
+            ('GET', store + r'\.json', self.get_store),
+            ('PUT', store + r'\.json', self.update_store),
+            ('PUT', store + r'/file\.geotiff', self.upload_geotiff),
+            ('PUT', store + r'/file\.imagemosaic', self.create_mosaic),
+            ('POST', store + r'/file\.imagemosaic', self.harvest_mosaic),
+            ('PUT', store + r'/coverages/([^/]+)\.json', lambda groups, query, body: self.check_store(groups)),
+            ('GET', store + r'/coverages/([^/]+)/index/granules\.json', self.get_granules),
+            ('DELETE', store + r'/coverages/([^/]+)/index/granules', self.delete_granules),
+            ('GET', r'/rest/layers/([^/]+)\.json', self.get_layer),
+            ('PUT', r'/rest/layers/([^/]+)', self.update_layer),
+        ]
+
+    def get_workspace(self, groups, query, body):
+        if groups[0] not in self.workspaces:
+            return 404, None
+        return 200, {'workspace': {'name': groups[0]}}
+
+    def create_workspace(self, groups, query, body):
+        self.workspaces.add(json.loads(body)['workspace']['name'])
+        return 201, None
+
+    def check_store(self, groups):
+        return (200, None) if (groups[0], groups[1]) in self.stores else (404, None)
+
+    def get_store(self, groups, query, body):
+        if (groups[0], groups[1]) not in self.stores:
+            return 404, None
+        return 200, {'coverageStore': {'name': groups[1], 'description': self.stores[(groups[0], groups[1])].get('description')}}
+
+    def update_store(self, groups, query, body):
+        if (groups[0], groups[1]) not in self.stores:
+            return 404, None
+        self.stores[(groups[0], groups[1])]['description'] = json.loads(body)['coverageStore'].get('description')
+        return 200, None
+
+    def upload_geotiff(self, groups, query, body):
+        workspace, store_name = groups
+        self.stores[(workspace, store_name)] = {'data': body}
+        self.layers[f"{workspace}:{query.get('coverageName', [store_name])[0]}"] = 'raster'
+        return 201, None
+
+    def create_mosaic(self, groups, query, body):
+        workspace, store_name = groups
+        self.stores[(workspace, store_name)] = {'granules': set(get_zip_granules(body))}
+        self.layers[f'{workspace}:{store_name}'] = 'raster'
+        return 201, None
+
+    def harvest_mosaic(self, groups, query, body):
+        if (groups[0], groups[1]) not in self.stores:
+            return 404, None
+        granules = get_zip_granules(body)
+        self.stores[(groups[0], groups[1])]['granules'].update(granules)
+        self.stores[(groups[0], groups[1])]['harvested'] = granules
+        return 202, None
+
+    def get_granules(self, groups, query, body):
+        if (groups[0], groups[1]) not in self.stores:
+            return 404, None
+        granules = sorted(self.stores[(groups[0], groups[1])]['granules'])
+        return 200, {'type': 'FeatureCollection', 'features': [{'properties': {'location': granule}} for granule in granules]}
+
+    def delete_granules(self, groups, query, body):
+        if (groups[0], groups[1]) not in self.stores:
+            return 404, None
+        match = re.fullmatch(r"location = '(.+)'", query.get('filter', [''])[0])
+        if match:
+            self.stores[(groups[0], groups[1])]['granules'].discard(match.group(1))
+        return 200, None
+
+    def get_layer(self, groups, query, body):
+        if groups[0] not in self.layers:
+            return 404, None
+        return 200, {'layer': {'name': groups[0], 'defaultStyle': {'name': self.layers[groups[0]]}}}
+
+    def update_layer(self, groups, query, body):
+        if groups[0] not in self.layers:
+            return 404, None
+        self.layers[groups[0]] = json.loads(body)['layer']['defaultStyle']['name']
+        return 200, None
+
+    ###############################################################################################################################
+
+    ## Funcion get_handler: Sirve para crear la clase que atiende las solicitudes HTTP, que busca la primera ruta que coincide con el
+    #  metodo y la ruta de la solicitud, y responde 404 si no hay ninguna.
+
+    def get_handler(self):
+        mock = self
+
+        class Handler(BaseHTTPRequestHandler):
+
+            def handle_request(self):
+                url = urlsplit(self.path)
+                length = int(self.headers.get('Content-Length') or 0)
+                body = self.rfile.read(length) if length else b''
+
+                with mock.lock:
+                    mock.requests.append((self.command, url.path))
+                    status, payload = 404, None
+                    for method, pattern, route in mock.get_routes():
+                        match = re.fullmatch(pattern, url.path)
+                        if method == self.command and match:
+                            status, payload = route(match.groups(), parse_qs(url.query), body)
+                            break
+
+                content = json.dumps(payload).encode('utf-8') if payload is not None else b''
+                self.send_response(status)
+                self.send_header('Content-Type', 'application/json')
+                self.send_header('Content-Length', str(len(content)))
+                self.end_headers()
+                self.wfile.write(content)
+
+            do_GET = do_POST = do_PUT = do_DELETE = handle_request
+
+            def log_message(self, format, *args):
+                pass
+
+        return Handler
+
+###################################################################################################################################
+
+## Funcion get_zip_granules: Sirve para obtener los nombres de los granulos (archivos ".tif") de un ZIP enviado a un mosaico.
+
+def get_zip_granules(body):
+    with zipfile.ZipFile(io.BytesIO(body)) as zf:
+        return [name for name in zf.namelist() if name.endswith('.tif')]
@@ -0,0 +1,110 @@
+import os
+import sys
+import csv
+import numpy as np
+import pytest
+import rasterio
+import netCDF4
+from rasterio.transform import from_origin
+from rasterio.windows import Window
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+
+from src.scripts.download_clip_v7 import build_download_subset, write_subset_tif, write_subset_csv
+
+###################################################################################################################################
+
+## Recorte de un GeoTiff del SPI guardado como int16 con escala: los valores del NetCDF y del CSV deben ser los reales (valor
+#  guardado por la escala), y el GeoTiff debe conservar la escala de cada banda.
+
+INT16_NODATA = -32768
+INT16_SCALE = 0.001
+
+
+def write_int16_spi_tif(tmp_path):
+    tif_file = os.path.join(tmp_path, 'SPI_jun_2000_ago._2000_scale_3_all_bands_ARG_cropped.tif')
+    data = np.array([[[1500, -250], [INT16_NODATA, 0]], [[2000, 10], [-1000, INT16_NODATA]], [[5, 6], [7, 8]]], dtype='int16')
+
+    profile = {
+        'driver': 'GTiff', 'dtype': 'int16', 'nodata': INT16_NODATA, 'crs': 'EPSG:4326',
+        'transform': from_origin(-60.0, -30.0, 0.1, 0.1), 'width': 2, 'height': 2, 'count': 3,
+    }
+    with rasterio.open(tif_file, 'w', **profile) as dst:
+        dst.write(data)
+        dst.scales = (INT16_SCALE,) * 3
+    return tif_file
+
+
+def get_params(output_format):
+    return {'bbox': None, 'polygon': None, 'start': (2000, 6), 'end': (2000, 7), 'format': output_format}
+
+
+def test_int16_subset_nc_applies_scale(tmp_path):
+    output_file = build_download_subset(write_int16_spi_tif(tmp_path), get_params('nc'), tmp_path)
+
+    with netCDF4.Dataset(output_file) as nc:
+        spi = nc['spi'][:].filled(np.nan)
+
+    assert spi.shape == (2, 2, 2)
+    np.testing.assert_allclose(spi[0], [[1.5, -0.25], [np.nan, 0.0]], rtol=1e-6)
+    np.testing.assert_allclose(spi[1], [[2.0, 0.01], [-1.0, np.nan]], rtol=1e-6)
+
+
+def test_int16_subset_csv_applies_scale(tmp_path):
+    output_file = build_download_subset(write_int16_spi_tif(tmp_path), get_params('csv'), tmp_path)
+
+    with open(output_file, newline='') as f:
+        rows = list(csv.DictReader(f))
+
+    values = {(row['date'], row['lat'], row['lon']): float(row['value']) for row in rows}
+    assert len(values) == 6
+    assert values[('2000-06', '-30.05', '-59.95')] == 1.5
+    assert values[('2000-06', '-30.05', '-59.85')] == -0.25
+    assert values[('2000-07', '-30.15', '-59.95')] == -1.0
+
+
+def test_int16_subset_tif_keeps_scale(tmp_path):
+    output_file = build_download_subset(write_int16_spi_tif(tmp_path), get_params('tif'), tmp_path)
+
+    with rasterio.open(output_file) as src:
+        assert src.count == 2
+        assert src.dtypes[0] == 'int16'
+        assert src.scales == (INT16_SCALE, INT16_SCALE)
+        assert src.offsets == (0.0, 0.0)
+        assert src.read(1)[0, 0] == 1500
+
+
+## Recorte con poligono de un GeoTiff sin valor "nodata": los pixeles fuera de la mascara quedan con el "nodata" del recorte (NaN
+#  para float32 y el menor valor del tipo de dato para int16), que se declara en el GeoTiff y se omite en el CSV.
+
+def write_tif_without_nodata(tmp_path, dtype):
+    tif_file = os.path.join(tmp_path, f'PMP_{dtype}.tif')
+    profile = {
+        'driver': 'GTiff', 'dtype': dtype, 'crs': 'EPSG:4326',
+        'transform': from_origin(-60.0, -30.0, 0.1, 0.1), 'width': 2, 'height': 2, 'count': 1,
+    }
+    with rasterio.open(tif_file, 'w', **profile) as dst:
+        dst.write(np.array([[[1, 2], [3, 4]]], dtype=dtype))
+    return tif_file
+
+
+@pytest.mark.parametrize('dtype, nodata', [('float32', np.nan), ('int16', -32768)])
+def test_polygon_subset_without_nodata_uses_explicit_nodata(tmp_path, dtype, nodata):
+    mask = np.array([[True, False], [True, True]])
+    tif_file = write_tif_without_nodata(tmp_path, dtype)
+    output_tif = os.path.join(tmp_path, 'subset.tif')
+    output_csv = os.path.join(tmp_path, 'subset.csv')
+
+    with rasterio.open(tif_file) as src:
+        window = Window(0, 0, 2, 2)
+        write_subset_tif(src, window, mask, [1], None, output_tif)
+        write_subset_csv(src, window, mask, [1], None, output_csv)
+
+    with rasterio.open(output_tif) as src:
+        data = src.read(1)
+        np.testing.assert_equal(src.nodata, nodata)
+        np.testing.assert_equal(data[0, 1], nodata)
+        assert data[1, 1] == 4
+
+    with open(output_csv, newline='') as f:
+        assert sorted(float(row['value']) for row in csv.DictReader(f)) == [1.0, 3.0, 4.0]
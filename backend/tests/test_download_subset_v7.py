@@ -0,0 +1,238 @@
+import os
+import re
+import sys
+import json
+import hashlib
+import threading
+import pytest
+import requests
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+
+from src.scripts import download_subset_v7
+from src.scripts.download_subset_v7 import poll_subset_job, get_subset_job_error_message, download_granule
+
+###################################################################################################################################
+
+## Monitoreo de la solicitud del subset contra un servicio "GetStatus" local ("FakeGetStatus"), con un reloj simulado ("FakeClock")
+#  en lugar de "monotonic()" y "sleep()", para que las pruebas no esperen y se pueda verificar cada intervalo de espera.
+
+class FakeClock:
+
+    def __init__(self):
+        self.now = 0.0
+        self.sleeps = []
+
+    def monotonic(self):
+        return self.now
+
+    def sleep(self, seconds):
+        self.sleeps.append(seconds)
+        self.now += seconds
+
+
+class FakeGetStatus:
+
+    def __init__(self, statuses, final_result=None):
+        self.statuses = list(statuses)
+        self.final_result = final_result or {}
+        self.requests = []
+
+    def __call__(self, request):
+        assert request['methodname'] == 'GetStatus'
+        self.requests.append(request)
+        status = self.statuses.pop(0) if len(self.statuses) > 1 else self.statuses[0]
+        result = {'Status': status, 'PercentCompleted': 100 if status not in ['Accepted', 'Running'] else 50}
+        if status not in ['Accepted', 'Running']:
+            result.update(self.final_result)
+        return {'result': result}
+
+
+STATUS_REQUEST = {'methodname': 'GetStatus', 'version': '1.0', 'type': 'jsonwsp/request', 'args': {'jobId': 'job-1'}}
+ACCEPTED = {'result': {'Status': 'Accepted', 'PercentCompleted': 0}}
+
+
+@pytest.fixture
+def clock(mocker):
+    clock = FakeClock()
+    mocker.patch.object(download_subset_v7, 'monotonic', side_effect=clock.monotonic)
+    mocker.patch.object(download_subset_v7, 'sleep', side_effect=clock.sleep)
+    return clock
+
+
+def test_poll_subset_job_succeeds(clock):
+    get_status = FakeGetStatus(['Running', 'Running', 'Succeeded'])
+
+    job_status, response = poll_subset_job(get_status, STATUS_REQUEST, ACCEPTED)
+
+    assert job_status == 'Succeeded'
+    assert response['result']['Status'] == 'Succeeded'
+    assert len(get_status.requests) == 3
+    assert len(clock.sleeps) == 3
+
+
+def test_poll_subset_job_failure_builds_error_message(clock):
+    get_status = FakeGetStatus(['Running', 'Failed'], final_result={'message': 'Invalid bounding box'})
+
+    job_status, response = poll_subset_job(get_status, STATUS_REQUEST, ACCEPTED)
+    error_message = get_subset_job_error_message('job-1', job_status, response, 3600)
+
+    assert job_status == 'Failed'
+    assert 'API Error' in error_message
+    assert 'estado Failed' in error_message
+    assert 'Job ID: job-1' in error_message
+    assert 'Invalid bounding box' in error_message
+
+
+def test_poll_subset_job_times_out_at_deadline(clock):
+    get_status = FakeGetStatus(['Running'])
+
+    job_status, response = poll_subset_job(get_status, STATUS_REQUEST, ACCEPTED, deadline=100)
+    error_message = get_subset_job_error_message('job-1', job_status, response, 100)
+
+    assert job_status == 'Timeout'
+    assert clock.now == pytest.approx(100)
+    assert 'TimeoutError' in error_message
+    assert '100 segundos' in error_message
+    assert 'Running' in error_message
+
+
+@pytest.mark.parametrize('jitter', ['min', 'max', 'random'])
+def test_poll_subset_job_backoff_and_jitter_stay_within_bounds(clock, mocker, jitter):
+    if jitter != 'random':
+        mocker.patch.object(download_subset_v7.random, 'uniform', side_effect=lambda low, high: low if jitter == 'min' else high)
+    get_status = FakeGetStatus(['Running'] * 12 + ['Succeeded'])
+
+    poll_subset_job(get_status, STATUS_REQUEST, ACCEPTED, initial_interval=5, max_interval=60, backoff=2, deadline=3600)
+
+    intervals = [min(5 * 2 ** index, 60) for index in range(len(clock.sleeps))]
+    assert len(clock.sleeps) == 13
+    for seconds, interval in zip(clock.sleeps, intervals):
+        assert interval * 0.8 <= seconds <= interval * 1.2
+    assert max(clock.sleeps) <= 60 * 1.2
+    if jitter == 'min':
+        assert clock.sleeps[-1] == pytest.approx(60 * 0.8)
+    elif jitter == 'max':
+        assert clock.sleeps[-1] == pytest.approx(60 * 1.2)
+
+
+## Continuacion de descargas contra un servidor local ("GranuleServer") que admite "Range" e "If-Range" como el de GES DISC: solo
+#  responde 206 si el ETag enviado en "If-Range" coincide con el del archivo actual, y caso contrario responde 200 con el archivo
+#  completo.
+
+class GranuleServer:
+
+    def __init__(self, content):
+        self.content = content
+        self.requests = []
+        server = self
+
+        class Handler(BaseHTTPRequestHandler):
+
+            def do_GET(self):
+                server.requests.append(dict(self.headers))
+                content = server.content
+                etag = f'"{hashlib.md5(content).hexdigest()}"'
+                match = re.fullmatch(r'bytes=(\d+)-', self.headers.get('Range', ''))
+                if_range = self.headers.get('If-Range')
+
+                if match and (if_range is None or if_range == etag):
+                    start = int(match.group(1))
+                    if start >= len(content):
+                        self.send_response(416)
+                        self.send_header('Content-Length', '0')
+                        self.end_headers()
+                        return
+                    body = content[start:]
+                    self.send_response(206)
+                    self.send_header('Content-Range', f'bytes {start}-{len(content) - 1}/{len(content)}')
+                else:
+                    body = content
+                    self.send_response(200)
+
+                self.send_header('ETag', etag)
+                self.send_header('Content-Length', str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, format, *args):
+                pass
+
+        self.server = ThreadingHTTPServer(('127.0.0.1', 0), Handler)
+        self.url = f'http://127.0.0.1:{self.server.server_address[1]}/granule.nc4'
+        threading.Thread(target=self.server.serve_forever, daemon=True).start()
+
+    def close(self):
+        self.server.shutdown()
+        self.server.server_close()
+
+
+@pytest.fixture
+def granule_server():
+    server = GranuleServer(b'0123456789' * 10)
+    yield server
+    server.close()
+
+
+def write_partial_download(tmp_path, server, size, validator):
+    partfn = os.path.join(tmp_path, 'granule.nc4.part')
+    with open(partfn, 'wb') as f:
+        f.write(server.content[:size])
+    if validator is not None:
+        with open(partfn + '.json', 'w') as f:
+            json.dump({'if_range': validator}, f)
+    return partfn
+
+
+def test_download_granule_resumes_unchanged_file(tmp_path, granule_server):
+    outfn = os.path.join(tmp_path, 'granule.nc4')
+    etag = f'"{hashlib.md5(granule_server.content).hexdigest()}"'
+    partfn = write_partial_download(tmp_path, granule_server, 40, etag)
+
+    with requests.Session() as session:
+        _, status_code, http_err, file_info = download_granule(session, granule_server.url, outfn, partfn)
+
+    assert (status_code, http_err) == (206, None)
+    assert granule_server.requests[0]['Range'] == 'bytes=40-'
+    assert granule_server.requests[0]['If-Range'] == etag
+    assert open(outfn, 'rb').read() == granule_server.content
+    assert file_info['size'] == len(granule_server.content)
+    assert not os.path.exists(partfn) and not os.path.exists(partfn + '.json')
+
+
+def test_download_granule_restarts_when_remote_file_changed(tmp_path, granule_server):
+    outfn = os.path.join(tmp_path, 'granule.nc4')
+    partfn = write_partial_download(tmp_path, granule_server, 40, f'"{hashlib.md5(granule_server.content).hexdigest()}"')
+    granule_server.content = b'abcdefghij' * 12
+
+    with requests.Session() as session:
+        _, status_code, http_err, _ = download_granule(session, granule_server.url, outfn, partfn)
+
+    assert (status_code, http_err) == (200, None)
+    assert open(outfn, 'rb').read() == granule_server.content
+
+
+def test_download_granule_without_validator_downloads_again(tmp_path, granule_server):
+    outfn = os.path.join(tmp_path, 'granule.nc4')
+    partfn = write_partial_download(tmp_path, granule_server, 40, None)
+
+    with requests.Session() as session:
+        _, status_code, _, _ = download_granule(session, granule_server.url, outfn, partfn)
+
+    assert status_code == 200
+    assert 'Range' not in granule_server.requests[0]
+    assert open(outfn, 'rb').read() == granule_server.content
+
+
+def test_download_granule_saves_validator_of_interrupted_download(tmp_path, granule_server, mocker):
+    outfn = os.path.join(tmp_path, 'granule.nc4')
+    partfn = os.path.join(tmp_path, 'granule.nc4.part')
+    mocker.patch.object(download_subset_v7, 'get_file_md5', side_effect=OSError('Descarga interrumpida'))
+
+    with requests.Session() as session, pytest.raises(OSError):
+        download_granule(session, granule_server.url, outfn, partfn)
+
+    assert not os.path.exists(outfn)
+    with open(partfn + '.json') as f:
+        assert json.load(f)['if_range'] == f'"{hashlib.md5(granule_server.content).hexdigest()}"'
@@ -0,0 +1,146 @@
+import os
+import sys
+import numpy as np
+import pytest
+import rasterio
+from rasterio.transform import from_origin
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+
+from mock_geoserver import MockGeoServer
+from src.scripts.geoserver_upload_v7 import geoserver_upload
+
+###################################################################################################################################
+
+## Sincronizacion con GeoServer contra el servidor local "MockGeoServer": la primera sincronizacion sube todas las capas, una
+#  ejecucion sin cambios solo realiza consultas (GET), y si cambia un archivo solo se vuelve a subir su capa.
+
+SPI_SCALES = ['1', '2', '3', '6', '9', '12', '24', '36', '48', '60', '72']
+
+
+@pytest.fixture
+def geoserver(tmp_path, monkeypatch):
+    monkeypatch.setenv('HOME', str(tmp_path))
+    mock = MockGeoServer()
+    monkeypatch.setenv('GEOSERVER_URL', mock.url)
+    monkeypatch.setenv('GEOSERVER_USERNAME', 'admin')
+    monkeypatch.setenv('GEOSERVER_PASSWORD', 'geoserver')
+    yield mock
+    mock.close()
+
+
+def get_output_dir(tmp_path, *parts):
+    output_dir = os.path.join(tmp_path, 'EHCPA_SPI', 'backend', 'src', 'output', *parts)
+    os.makedirs(output_dir, exist_ok=True)
+    return output_dir
+
+
+def write_last_band_tifs(tmp_path):
+    with open(os.path.join(get_output_dir(tmp_path, 'geoserver', 'PTM'), 'PTM_jun_2000_present_last_band_ARG_cropped.tif'), 'wb') as f:
+        f.write(b'PTM')
+    for scale in SPI_SCALES:
+        write_spi_last_band_tif(tmp_path, scale, f'SPI {scale}'.encode('utf-8'))
+
+
+def write_spi_last_band_tif(tmp_path, scale, content):
+    tif_file = os.path.join(get_output_dir(tmp_path, 'geoserver', 'SPI'), f'SPI_jun_2000_present_scale_{scale}_last_band_ARG_cropped.tif')
+    with open(tif_file, 'wb') as f:
+        f.write(content)
+
+
+def write_all_bands_tif(tif_file, data):
+    profile = {
+        'driver': 'GTiff', 'dtype': 'float32', 'nodata': np.nan, 'crs': 'EPSG:4326',
+        'transform': from_origin(-60.0, -30.0, 0.1, 0.1), 'width': data.shape[2], 'height': data.shape[1], 'count': data.shape[0],
+    }
+    with rasterio.open(tif_file, 'w', **profile) as dst:
+        dst.write(data)
+
+
+def write_mosaic_sources(tmp_path, spi_data):
+    ptm_data = np.arange(2 * 2 * 2, dtype='float32').reshape(2, 2, 2)
+    write_all_bands_tif(os.path.join(get_output_dir(tmp_path, 'downloable_data', 'PTM'), 'PTM_jun_2000_jul._2000_all_bands_ARG_cropped.tif'), ptm_data)
+    write_all_bands_tif(os.path.join(get_output_dir(tmp_path, 'downloable_data', 'SPI'), 'SPI_jun_2000_jul._2000_scale_3_all_bands_ARG_cropped.tif'), spi_data)
+
+
+def test_layers_first_sync_uploads_every_layer(tmp_path, geoserver):
+    write_last_band_tifs(tmp_path)
+
+    geoserver_upload(upload_mode='layers')
+
+    assert len(geoserver.get_uploads()) == 1 + len(SPI_SCALES)
+    assert geoserver.layers['EHCPA:PTM_Raster'] == 'PTM_Style'
+    assert all(geoserver.layers[f'EHCPA:SPI_scale_{scale}_Raster'] == 'SPI_Style' for scale in SPI_SCALES)
+    assert geoserver.stores[('EHCPA', 'PTM_Raster')]['data'] == b'PTM'
+
+
+def test_layers_unchanged_sync_only_issues_gets(tmp_path, geoserver):
+    write_last_band_tifs(tmp_path)
+    geoserver_upload(upload_mode='layers')
+    geoserver.clear_requests()
+
+    geoserver_upload(upload_mode='layers')
+
+    assert geoserver.get_methods()
+    assert set(geoserver.get_methods()) == {'GET'}
+
+
+def test_layers_changed_tif_only_uploads_its_layer(tmp_path, geoserver):
+    write_last_band_tifs(tmp_path)
+    geoserver_upload(upload_mode='layers')
+    geoserver.clear_requests()
+
+    write_spi_last_band_tif(tmp_path, '12', b'SPI 12 updated')
+    geoserver_upload(upload_mode='layers')
+
+    assert geoserver.get_uploads() == ['/rest/workspaces/EHCPA/coveragestores/SPI_scale_12_Raster/file.geotiff']
+    assert geoserver.stores[('EHCPA', 'SPI_scale_12_Raster')]['data'] == b'SPI 12 updated'
+    assert geoserver.layers['EHCPA:SPI_scale_12_Raster'] == 'SPI_Style'
+
+
+def test_layers_reset_geoserver_is_synced_again(tmp_path, geoserver):
+    write_last_band_tifs(tmp_path)
+    geoserver_upload(upload_mode='layers')
+    geoserver.reset()
+    geoserver.clear_requests()
+
+    geoserver_upload(upload_mode='layers')
+
+    assert 'EHCPA' in geoserver.workspaces
+    assert len(geoserver.get_uploads()) == 1 + len(SPI_SCALES)
+
+
+def test_mosaic_first_sync_creates_both_mosaics(tmp_path, geoserver):
+    write_mosaic_sources(tmp_path, np.ones((2, 2, 2), dtype='float32'))
+
+    geoserver_upload(upload_mode='mosaic')
+
+    assert geoserver.stores[('EHCPA', 'PTM_Mosaic')]['granules'] == {'PTM_200006.tif', 'PTM_200007.tif'}
+    assert geoserver.stores[('EHCPA', 'SPI_Mosaic')]['granules'] == {'SPI_scale_3_200006.tif', 'SPI_scale_3_200007.tif'}
+    assert geoserver.layers['EHCPA:SPI_Mosaic'] == 'SPI_Style'
+
+
+def test_mosaic_unchanged_sync_only_issues_gets(tmp_path, geoserver):
+    write_mosaic_sources(tmp_path, np.ones((2, 2, 2), dtype='float32'))
+    geoserver_upload(upload_mode='mosaic')
+    geoserver.clear_requests()
+
+    geoserver_upload(upload_mode='mosaic')
+
+    assert set(geoserver.get_methods()) == {'GET'}
+
+
+def test_mosaic_changed_band_only_harvests_its_granule(tmp_path, geoserver):
+    spi_data = np.ones((2, 2, 2), dtype='float32')
+    write_mosaic_sources(tmp_path, spi_data)
+    geoserver_upload(upload_mode='mosaic')
+    geoserver.clear_requests()
+
+    spi_data[1, 0, 0] = 2.0
+    write_mosaic_sources(tmp_path, spi_data)
+    geoserver_upload(upload_mode='mosaic')
+
+    assert geoserver.get_uploads() == ['/rest/workspaces/EHCPA/coveragestores/SPI_Mosaic/file.imagemosaic']
+    assert geoserver.stores[('EHCPA', 'SPI_Mosaic')]['harvested'] == ['SPI_scale_3_200007.tif']
+    assert ('DELETE', '/rest/workspaces/EHCPA/coveragestores/SPI_Mosaic/coverages/SPI_Mosaic/index/granules') in geoserver.requests
+    assert geoserver.stores[('EHCPA', 'SPI_Mosaic')]['granules'] == {'SPI_scale_3_200006.tif', 'SPI_scale_3_200007.tif'}
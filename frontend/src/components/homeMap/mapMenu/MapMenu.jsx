@@ -65,6 +65,8 @@ const MapMenu = ({setIsMouseOverComponent, isMouseOverComponent}) => {
      * - layerOpacity: Arreglo que establece el nivel de opacidad de cada una de las capas, tanto de PTM como de SPI, permitiendo ajustar la transparencia 
      *   de cada capa de forma independiente. Mediante "setLayerOpacity" se actualiza el valor de la opacidad.
      * - layers: Estado que mediante "useRef" actúa como contenedor para las capas en el mapa, permitiendo agregar o quitar capas sin afectar el estado.
+     * - pointRequest: Estado que mediante "useRef" guarda la última solicitud al endpoint "/point" del backend junto con las coordenadas consultadas, 
+     *   para que todas las capas activas compartan una única solicitud por cada click en el mapa.
      * - modalInitialPosition: Constante que define las coordenadas de la posición inicial del componente draggableModal en el mapa.
      * - modalPositionRef: Estado que mediante "useRef" se referencia al componente draggableModal en el DOM, permitiendo acceder a sus dimensiones y 
      *   ajustarlas durante el dragg (arrastre).
@@ -187,6 +189,7 @@ const MapMenu = ({setIsMouseOverComponent, isMouseOverComponent}) => {
         SPI_72: 1,
     });
     const layers = useRef({});
+    const pointRequest = useRef({ key: null, promise: null });
     const modalInitialPosition = { x: 58, y: 104 };
     const modalPositionRef = useRef(modalInitialPosition);
     const [modalPosition, setModalPosition] = useState(modalPositionRef.current);
@@ -227,7 +230,8 @@ const MapMenu = ({setIsMouseOverComponent, isMouseOverComponent}) => {
      * 9. Realizamos la solicitud de tipo get al backend con "axios" usando la URL generada. Especificamos "responseType" como "blob" para recibir archivos 
      *    binarios. Adicionalmente, en "onDownloadProgress" calculamos el porcentaje de progreso de la descarga y actualizamos "setDownloadProgress" cada vez 
      *    que cambia.
-     * 10. Una vez completada la descarga, se guarda el archivo descargado con el nombre "EHCPA_Data.zip" utilizando la libreria "FileDownload". Y se espera 
+     * 10. Una vez completada la descarga, se guarda el archivo descargado utilizando la libreria "FileDownload", con el nombre indicado por el backend en el 
+     *     encabezado "Content-Disposition" (el GeoTiff original si se selecciono una sola capa), o "EHCPA_Data.zip" si no se indica. Y se espera 
      *     1200 ms para asegurar que el proceso de descarga finalice, y luego se actualizan los estados "setIsDownloading" a "false" para indicar que termino 
      *     la descarga y "setDownloadProgress" a "null" para resetear el progreso.
      * 11. En el bloque "catch", se maneja el error en caso de que ocurra alguna excepcion durante la descarga, ya que es un archivo binario (blob). Se setea
@@ -289,7 +293,9 @@ const MapMenu = ({setIsMouseOverComponent, isMouseOverComponent}) => {
                 }
             });
     
-            FileDownload(res.data, 'EHCPA_Data.zip');
+            const contentDisposition = res.headers['content-disposition'] || '';
+            const fileNameMatch = contentDisposition.match(/filename\*?=(?:UTF-8'')?"?([^";]+)"?/i);
+            FileDownload(res.data, fileNameMatch ? decodeURIComponent(fileNameMatch[1]) : 'EHCPA_Data.zip');
             setTimeout(() => {
                 setIsDownloading(false); 
                 setDownloadProgress(null); 
@@ -395,6 +401,52 @@ const MapMenu = ({setIsMouseOverComponent, isMouseOverComponent}) => {
 
     /*******************************************************************************************************************************************************/
 
+    /**
+     * Funcion getPointValues: Sirve para obtener los valores de la última banda del PTM y del SPI de todas las escalas en las coordenadas seleccionadas, 
+     * mediante una única solicitud al endpoint "/point" del backend ("VITE_BACKEND_POINT_URL"), en lugar de una solicitud "GetFeatureInfo" a GeoServer 
+     * por cada capa.
+     * 1. Como cada capa activa ejecuta su propio "handleMapClick" en el mismo click, la promesa de la solicitud se guarda en "pointRequest" junto con las 
+     *    coordenadas, y si las coordenadas coinciden se reutiliza la misma promesa en lugar de realizar una nueva solicitud.
+     * 2. La promesa retorna el objeto "values" de la respuesta, con el valor de cada capa ("PTM", "SPI_1", etc.), o "null" si no hay datos.
+    */
+
+    const getPointValues = (lat, lng) => {
+        const key = `${lat},${lng}`;
+        if (pointRequest.current.key !== key) {
+            const promise = axios
+                .get(import.meta.env.VITE_BACKEND_POINT_URL, { params: { lat, lon: lng } })
+                .then((response) => response.data.values);
+            promise.catch(() => {
+                if (pointRequest.current.promise === promise) {
+                    pointRequest.current = { key: null, promise: null };
+                }
+            });
+            pointRequest.current = { key, promise };
+        }
+        return pointRequest.current.promise;
+    };
+
+    /*******************************************************************************************************************************************************/
+
+    /**
+     * Funcion getFeatureInfoValue: Sirve para obtener el valor de una capa de GeoServer en el punto seleccionado mediante una solicitud "GetFeatureInfo",
+     * para las capas que no se encuentran en el endpoint "/point" del backend (PMP y PMD). Retorna el valor de "GRAY_INDEX", o "null" si la respuesta 
+     * no contiene datos.
+    */
+
+    const getFeatureInfoValue = async (e, geoserverLayer) => {
+        const url = `${import.meta.env.VITE_GEOSERVER_DATA_URL}?service=WMS&version=1.1.0&request=GetFeatureInfo&layers=${geoserverLayer}&query_layers=${geoserverLayer}&info_format=application/json&bbox=${map.getBounds().toBBoxString()}&width=${map.getSize().x}&height=${map.getSize().y}&srs=EPSG:4326&x=${Math.floor(e.containerPoint.x)}&y=${Math.floor(e.containerPoint.y)}`;
+
+        const response = await axios.get(url);
+
+        if (response.data.features && response.data.features.length > 0) {
+            return response.data.features[0].properties.GRAY_INDEX;
+        }
+        return null;
+    };
+
+    /*******************************************************************************************************************************************************/
+
     /**
      * Funcion handlePTMLayer: Sirve para gestionar la visualización y comportamiento de la capa de PTM en el mapa, permitiendo renderizarla, actualizar su 
      * opacidad y obtener los valores de la misma al hacer click en el mapa.
@@ -409,10 +461,9 @@ const MapMenu = ({setIsMouseOverComponent, isMouseOverComponent}) => {
      *         - Si el switch se desactiva, y la capa está renderizada en el mapa, se la elimina y no se visualiza en el mapa.
      *    2.3. La función "handleMapClick" obtiene los datos de la capa PTM al hacer click en el mapa. Primero verifica si el mouse está sobre el componente 
      *         "isMouseOverRef" o si la capa PTM no está activada, en cuyo caso sale de la función. Luego obtiene las coordenadas del punto seleccionado y 
-     *         establece el valor en "coordinatesResult". Despues realiza una solicitud al servidor GeoServer para obtener el valor de la capa PTM en las
-     *         coordenadas seleccionadas:
-     *         - Si la respuesta contiene datos, se extrae el valor de "GRAY_INDEX" y se establece en "PTMResult" si es válido, seteando vacio a 
-     *           "notFoundPTMResults".
+     *         establece el valor en "coordinatesResult". Despues obtiene el valor de la capa en las coordenadas seleccionadas, mediante "getPointValues" 
+     *         para el PTM (una única solicitud al backend para todas las capas), o mediante "getFeatureInfoValue" (GeoServer) para las capas PMP y PMD:
+     *         - Si se obtiene un valor, se establece en "PTMResult" si es válido, seteando vacio a "notFoundPTMResults".
      *         - Si los datos son iguales a -9999.900390625 se asigna "null" en "PTMResult" y "S/D" en "notFoundPTMResults" para indicar que no hay datos.
      *         - En caso de error, se muestra el mismo en "notFoundPTMResults".
      *    2.4. El listener "click" se añade al mapa para que "handleMapClick" se ejecute en cada clic.
@@ -458,12 +509,11 @@ const MapMenu = ({setIsMouseOverComponent, isMouseOverComponent}) => {
                 setCoordinatesResult({ lat, lng });
     
                 try {
-                    const url = `${import.meta.env.VITE_GEOSERVER_DATA_URL}?service=WMS&version=1.1.0&request=GetFeatureInfo&layers=${geoserverLayer}&query_layers=${geoserverLayer}&info_format=application/json&bbox=${map.getBounds().toBBoxString()}&width=${map.getSize().x}&height=${map.getSize().y}&srs=EPSG:4326&x=${Math.floor(e.containerPoint.x)}&y=${Math.floor(e.containerPoint.y)}`;
-    
-                    const response = await axios.get(url);
+                    const value = layerName === 'PTM'
+                        ? (await getPointValues(lat, lng))[layerName]
+                        : await getFeatureInfoValue(e, geoserverLayer);
     
-                    if (response.data.features && response.data.features.length > 0) {
-                        const value = response.data.features[0].properties.GRAY_INDEX;
+                    if (value !== null && value !== undefined) {
                         if (value == -9999.900390625 || value == -3.4028234663852886e+38 || value == -99999.0) {
                             setPrecipitationResults((prevState) => ({
                                 ...prevState,
@@ -550,8 +600,9 @@ const MapMenu = ({setIsMouseOverComponent, isMouseOverComponent}) => {
      *         - Si el switch se desactiva, y la capa está renderizada en el mapa, se la elimina y no se visualiza en el mapa.
      *    2.3. La función "handleMapClick" obtiene los datos de la capa SPI al hacer click en el mapa. Primero verifica si el mouse está sobre el componente 
      *         usando "isMouseOverRef", o si la capa SPI no está activada, en cuyo caso sale de la función. Luego obtiene las coordenadas del punto seleccionado 
-     *         y las guarda en "coordinatesResult". Despues realiza una solicitud a GeoServer para obtener el valor de la capa SPI en las coordenadas seleccionadas:
-     *         - Si la respuesta contiene datos, se extrae el valor de "GRAY_INDEX" y se establece en "SPIResults" si es válidoseteando vacio a "notFoundSPIResults".
+     *         y las guarda en "coordinatesResult". Despues obtiene el valor de la capa SPI en las coordenadas seleccionadas mediante "getPointValues", que 
+     *         realiza una única solicitud al backend para todas las capas:
+     *         - Si se obtiene un valor, se establece en "SPIResults" seteando vacio a "notFoundSPIResults".
      *         - Si los datos son iguales a "null", se asigna "null" en "SPIResults" y "S/D" en "notFoundSPIResults" para indicar que no hay datos.
      *         - En caso de error, se muestra el mismo en "notFoundSPIResults".
      *    2.4. El listener "click" se añade al mapa para que "handleMapClick" se ejecute en cada clicK.
@@ -603,31 +654,17 @@ const MapMenu = ({setIsMouseOverComponent, isMouseOverComponent}) => {
                 setCoordinatesResult({ lat, lng });
 
                 try {
-                    const url = `${import.meta.env.VITE_GEOSERVER_DATA_URL}?service=WMS&version=1.1.0&request=GetFeatureInfo&layers=${geoserverLayer}&query_layers=${geoserverLayer}&info_format=application/json&bbox=${map.getBounds().toBBoxString()}&width=${map.getSize().x}&height=${map.getSize().y}&srs=EPSG:4326&x=${Math.floor(e.containerPoint.x)}&y=${Math.floor(e.containerPoint.y)}`;
+                    const value = (await getPointValues(lat, lng))[layerName];
     
-                    const response = await axios.get(url);
-    
-                    if (response.data.features && response.data.features.length > 0) {
-                        const value = response.data.features[0].properties.GRAY_INDEX;
-                        if (value !== null) {
-                            setSPIResults((prevState) => ({
-                                ...prevState,
-                                [layerName]: value,
-                            }));
-                            setNotFoundSPIResults((prevState) => ({
-                                ...prevState,
-                                [layerName]: "",
-                            }));
-                        } else {
-                            setSPIResults((prevState) => ({
-                                ...prevState,
-                                [layerName]: null,
-                            }));
-                            setNotFoundSPIResults((prevState) => ({
-                                ...prevState,
-                                [layerName]: "S/D",
-                            }));
-                        }
+                    if (value !== null && value !== undefined) {
+                        setSPIResults((prevState) => ({
+                            ...prevState,
+                            [layerName]: value,
+                        }));
+                        setNotFoundSPIResults((prevState) => ({
+                            ...prevState,
+                            [layerName]: "",
+                        }));
                     } else {
                         setSPIResults((prevState) => ({
                             ...prevState,